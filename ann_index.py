@@ -0,0 +1,182 @@
+"""Approximate nearest-neighbour search for 1:N identification.
+
+``IVFIndex`` is an inverted-file index in plain NumPy: unit vectors are
+clustered with spherical k-means into ``n_lists`` cells, every vector is
+stored in the list of its nearest centroid, and a query scans only the
+``nprobe`` lists whose centroids are closest to it. Raising nprobe trades
+latency for recall; ``nprobe >= n_lists`` is an exact search. Rows are added
+and removed per owner (a student ID), and the centroids are retrained once
+the index has grown well past the size they were trained on.
+
+``IdentityIndex`` keeps an IVFIndex in step with a ``FaceIndex`` store,
+picking up changes made by other worker processes every few seconds.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+
+from face_index import l2_normalize
+
+logger = logging.getLogger(__name__)
+
+MIN_ROWS_PER_LIST = 8  # Below this many rows per list, one list (brute force) is faster
+RETRAIN_GROWTH = 4  # Retrain when the index is this many times larger than at training time
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+
+
+def spherical_kmeans(vectors, k, iterations=KMEANS_ITERATIONS, seed=0):
+    """Unit-length centroids of k clusters of unit vectors (cosine k-means)."""
+    rng = np.random.default_rng(seed)
+    if vectors.shape[0] > k * KMEANS_SAMPLE_PER_LIST:
+        vectors = vectors[rng.choice(vectors.shape[0], k * KMEANS_SAMPLE_PER_LIST, replace=False)]
+    centroids = vectors[rng.choice(vectors.shape[0], k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(k):
+            members = vectors[assignment == c]
+            centroid = members.sum(axis=0) if members.shape[0] else vectors[rng.integers(vectors.shape[0])]
+            centroids[c] = centroid
+        centroids = l2_normalize(centroids)
+    return centroids
+
+
+class _List:
+    def __init__(self, dim):
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.owners = []
+        self.payloads = []
+
+
+class IVFIndex:
+    """Inverted-file cosine index over unit vectors, with per-owner inserts and deletes."""
+
+    def __init__(self, n_lists=0, nprobe=8, seed=0):
+        self.n_lists = n_lists  # 0 picks about sqrt(rows) at training time
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids = None
+        self._lists = []
+        self._owner_lists = {}  # owner -> set of list numbers holding its rows
+        self._size = 0
+        self._trained_size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _train(self, vectors, owners, payloads):
+        n = vectors.shape[0]
+        k = self.n_lists or int(np.sqrt(n))
+        k = max(1, min(k, n // MIN_ROWS_PER_LIST))
+        self.centroids = spherical_kmeans(vectors, k, seed=self.seed) if k > 1 else l2_normalize(vectors.mean(axis=0, keepdims=True))
+        self._lists = [_List(vectors.shape[1]) for _ in range(k)]
+        self._owner_lists, self._size, self._trained_size = {}, 0, n
+        self._insert(vectors, owners, payloads)
+        logger.info(f"Trained IVF index: {k} list(s) over {n} embeddings.")
+
+    def _insert(self, vectors, owners, payloads):
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        for c in np.unique(assignment):
+            rows = np.flatnonzero(assignment == c)
+            target = self._lists[c]
+            target.vectors = np.vstack([target.vectors, vectors[rows]])
+            target.owners += [owners[i] for i in rows]
+            target.payloads += [payloads[i] for i in rows]
+            for i in rows:
+                self._owner_lists.setdefault(owners[i], set()).add(int(c))
+        self._size += vectors.shape[0]
+
+    def _all_rows(self):
+        if not self._lists: return None, [], []
+        vectors = np.vstack([l.vectors for l in self._lists])
+        return vectors, [o for l in self._lists for o in l.owners], [p for l in self._lists for p in l.payloads]
+
+    def add(self, owner, vectors, payloads):
+        """Inserts one owner's unit vectors (one payload per row, e.g. the image name)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[0] == 0: return
+        owners = [owner] * vectors.shape[0]
+        if self.centroids is None or self.centroids.shape[1] != vectors.shape[1]:
+            self._train(vectors, owners, list(payloads))
+            return
+        self._insert(vectors, owners, list(payloads))
+        if self._size > RETRAIN_GROWTH * max(self._trained_size, MIN_ROWS_PER_LIST):
+            all_vectors, all_owners, all_payloads = self._all_rows()
+            self._train(all_vectors, all_owners, all_payloads)
+
+    def remove(self, owner):
+        """Deletes every row of an owner."""
+        for c in self._owner_lists.pop(owner, ()):
+            target = self._lists[c]
+            keep = [i for i, o in enumerate(target.owners) if o != owner]
+            self._size -= len(target.owners) - len(keep)
+            target.vectors = target.vectors[keep]
+            target.owners = [target.owners[i] for i in keep]
+            target.payloads = [target.payloads[i] for i in keep]
+
+    def search(self, probe, k=5, nprobe=None):
+        """Up to k (distance, owner, payload) tuples closest to a probe, nearest first."""
+        if self._size == 0: return []
+        probe = l2_normalize(probe)
+        nprobe = min(nprobe or self.nprobe, len(self._lists))
+        lists = np.argsort(-(self.centroids @ probe))[:nprobe]
+        candidates = [self._lists[c] for c in lists if self._lists[c].owners]
+        if not candidates: return []
+        distances = 1.0 - np.concatenate([l.vectors @ probe for l in candidates])
+        owners = [o for l in candidates for o in l.owners]
+        payloads = [p for l in candidates for p in l.payloads]
+        top = np.argsort(distances)[:k]
+        return [(float(distances[i]), owners[i], payloads[i]) for i in top]
+
+
+class IdentityIndex:
+    """1:N lookups over every student in a FaceIndex store."""
+
+    def __init__(self, face_index, n_lists=0, nprobe=8, refresh_seconds=5.0):
+        self.face_index = face_index
+        self.refresh_seconds = refresh_seconds
+        self._ivf = IVFIndex(n_lists, nprobe)
+        self._versions = {}  # student_id -> store version the indexed rows came from
+        self._folders = {}
+        self._last_sync = None
+        self._lock = threading.Lock()
+
+    def sync(self, force=False):
+        """Re-indexes the students whose stored rows changed since the last sync."""
+        with self._lock:
+            if not force and self._last_sync and time.time() - self._last_sync < self.refresh_seconds: return
+            self._last_sync = time.time()
+            versions = self.face_index.store_versions()
+            for student_id in [s for s in self._versions if s not in versions]:
+                self._ivf.remove(student_id)
+                self._versions.pop(student_id)
+                self._folders.pop(student_id, None)
+            for student_id, version in versions.items():
+                if self._versions.get(student_id) == version: continue
+                self._ivf.remove(student_id)
+                entry = self.face_index.stored_entry(student_id)
+                if entry and entry['matrix'].shape[0]:
+                    self._ivf.add(student_id, entry['matrix'], entry['files'])
+                    self._folders[student_id] = entry['folder']
+                else:
+                    self._folders.pop(student_id, None)
+                self._versions[student_id] = version
+
+    def identify(self, probe, k=5, nprobe=None):
+        """Best match per student among the k nearest images: [{'student_id', 'folder', 'file', 'distance'}], nearest first."""
+        self.sync()
+        with self._lock:
+            hits = self._ivf.search(probe, k, nprobe)
+            folders = dict(self._folders)
+        matches, seen = [], set()
+        for distance, student_id, file_name in hits:
+            if student_id in seen: continue
+            seen.add(student_id)
+            matches.append({'student_id': student_id, 'folder': folders.get(student_id), 'file': file_name, 'distance': distance})
+        return matches
+
+    def stats(self):
+        with self._lock:
+            return {'students': len(self._folders), 'embeddings': len(self._ivf), 'lists': len(self._ivf._lists), 'nprobe': self._ivf.nprobe}
@@ -1,38 +1,201 @@
 import os
-import cv2
 import json
-import pandas as pd
 import numpy as np
 import base64
 import uuid
 import shutil
 import smtplib
-from email.message import EmailMessage
+import click
+import atexit
+import random
+import time
 from datetime import datetime, timedelta
-from flask import Flask, render_template_string, request, jsonify, redirect, url_for
+from flask import Flask, render_template_string, request, jsonify, redirect, url_for, g
 from geopy.distance import geodesic
-from deepface import DeepFace
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+import inference
+from attendance_store import AttendanceAggregates, SqliteAttendanceStore, create_attendance_store
+from face_index import FaceIndex
+from gallery import GalleryManager
+from ann_index import IdentityIndex
+from image_decode import decode_frame
+from image_writer import AsyncImageWriter
+from quality_gate import QualityGate
+from liveness import SmileLiveness
+from twin_verification import TwinVerifier
+from email_jobs import EmailJobs, SmtpPool
+from student_registry import StudentRegistry
+from timetable import CompiledTimetable
+from session_store import create_session_store
+from reports import build_detailed_report
+from inference import WARMUP_STATE, warm_up
+from inference_daemon import InferenceClient, InferenceError
+from batching import MicroBatcher
+from metrics import Counter, Histogram, HistogramFamily, render_prometheus, snapshot_all
+from profiling import SamplingProfiler
 
 # --- Basic Flask App Setup ---
 app = Flask(__name__)
-app.secret_key = 'your_very_secret_key_for_sessions'
+# Signs the attendance pre-check tokens; whoever knows it can mint tokens, so it comes from the environment, e.g.
+# export SECRET_KEY=$(python -c "import secrets; print(secrets.token_hex(32))"). Without a usable key the app and its
+# maintenance commands still run, but the pre-check and token uploads are refused (see precheck_tokens)
+app.secret_key = os.environ.get('SECRET_KEY', '')
+SECRET_KEY_PLACEHOLDER = 'your_very_secret_key_for_sessions'
+SECRET_KEY_MIN_LENGTH = 16
+if app.secret_key in ('', SECRET_KEY_PLACEHOLDER) or len(app.secret_key) < SECRET_KEY_MIN_LENGTH:
+    app.logger.warning(f"SECRET_KEY is not set to a random string of at least {SECRET_KEY_MIN_LENGTH} characters; "
+                       "students cannot mark attendance until it is.")
 
 # --- Configuration ---
 ADMIN_PASSWORD = "admin123"
-ATTENDANCE_SESSIONS = {}
+# Attendance link sessions: 'memory' (a per-process dict, so run a single worker)
+# or 'sqlite' (one WAL database shared by every worker and kept across restarts)
+SESSION_BACKEND = 'memory'
+SESSION_DB_FILE = "sessions.db"
+SESSION_SWEEP_INTERVAL_SECONDS = 60
+ATTENDANCE_SESSIONS = create_session_store(SESSION_BACKEND, SESSION_DB_FILE, SESSION_SWEEP_INTERVAL_SECONDS)
 MAX_DISTANCE_METERS = 100
 SESSION_TIMEOUT_MINUTES = 30
+# Two-phase marking: /api/precheck checks the session, distance, student ID and already-marked status before any
+# image is sent, and returns a token signed with app.secret_key that the image upload must carry. Each token carries a
+# nonce and is accepted once; the used nonces are kept in ATTENDANCE_SESSIONS until the token would have expired
+PRECHECK_REQUIRED = True  # False also accepts uploads without a token (pages opened before an upgrade)
+PRECHECK_TOKEN_TTL_SECONDS = 120
 DATASET_PATH = "dataset"
 ATTENDANCE_RECORDS_PATH = "attendance_records"
 ATTENDANCE_PROOFS_PATH = "attendance_proofs"
 SENDER_GMAIL_FILE = "sender_gmail.json"
 STUDENT_EMAILS_FILE = "student_emails.json"
 TIMETABLE_FILE = "timetable.json"
+TIMETABLE = CompiledTimetable(TIMETABLE_FILE)  # Parsed once per change of the file
 TWINS_FILE = "twins.json"
+EMBEDDINGS_PATH = "embeddings"
+
+# Cached ID/name -> folder lookups, rebuilt when the dataset directory changes
+STUDENT_REGISTRY = StudentRegistry(DATASET_PATH)
 
 # Confidence threshold
 CONFIDENCE_THRESHOLD = 0.4
 
+# Outgoing mail: bulk emails are sent in the background over a pool of EMAIL_SENDERS connections,
+# retrying transient failures up to EMAIL_MAX_ATTEMPTS times; progress is kept under EMAIL_JOBS_PATH.
+# SMTP_SECURITY is 'ssl', 'starttls' or 'none' (e.g. a local test server: python -m aiosmtpd -n -l localhost:8025)
+SMTP_HOST = 'smtp.gmail.com'
+SMTP_PORT = 465
+SMTP_SECURITY = 'ssl'
+EMAIL_SENDERS = 4
+EMAIL_MAX_ATTEMPTS = 3
+EMAIL_RETRY_BACKOFF_SECONDS = 2.0
+EMAIL_JOBS_PATH = "email_jobs"
+EMAIL_JOBS = EmailJobs(EMAIL_JOBS_PATH, EMAIL_SENDERS, EMAIL_MAX_ATTEMPTS, EMAIL_RETRY_BACKOFF_SECONDS)
+
+# Student page uploads: 'binary' posts the frame as a raw JPEG (multipart), 'json' as a base64 data URL.
+# The browser shrinks frames so the longer side is at most UPLOAD_MAX_DIMENSION (0 keeps the camera size), and
+# the server decodes at 1/2, 1/4 or 1/8 scale as long as the shorter side stays at least DECODE_MIN_DIMENSION.
+UPLOAD_MODE = 'binary'
+UPLOAD_MAX_DIMENSION = 640
+DECODE_MIN_DIMENSION = 480
+
+# Attendance storage engine: 'csv' (dated attendance.csv files, appended under a per-day lock)
+# or 'sqlite' (one indexed WAL database; run `flask --app app import-attendance` once when switching)
+ATTENDANCE_STORAGE = 'csv'
+ATTENDANCE_DB_FILE = os.path.join(ATTENDANCE_RECORDS_PATH, "attendance.db")
+# fsync policy is 'always', 'interval' or 'never'
+ATTENDANCE_FSYNC_POLICY = 'always'
+ATTENDANCE_FSYNC_INTERVAL_SECONDS = 1.0
+ATTENDANCE_STORE = create_attendance_store(ATTENDANCE_STORAGE, ATTENDANCE_RECORDS_PATH, ATTENDANCE_DB_FILE, ATTENDANCE_FSYNC_POLICY, ATTENDANCE_FSYNC_INTERVAL_SECONDS)
+# Running present / classes-held counts for the overall report (`flask --app app rebuild-aggregates` to recompute)
+ATTENDANCE_AGGREGATES = AttendanceAggregates(os.path.join(ATTENDANCE_RECORDS_PATH, "aggregates.json"))
+
+# Quality gate: cheap OpenCV checks that reject dark, overexposed, washed-out or blurry frames, and frames without
+# exactly one face at least QUALITY_MIN_FACE_FRACTION of the frame's shorter side wide, before any model runs.
+# Brightness/contrast are the pixel mean/std (0-255) and sharpness the variance of the Laplacian, measured on a
+# copy whose longer side is QUALITY_ANALYSIS_DIMENSION pixels. Rejections are counted per reason at /metrics.
+# The face checks use OpenCV 4's Haar cascade; the app refuses to start without it unless QUALITY_CHECK_FACES is False
+QUALITY_GATE_ENABLED = True
+QUALITY_MIN_BRIGHTNESS = 40
+QUALITY_MAX_BRIGHTNESS = 220
+QUALITY_MIN_CONTRAST = 20
+QUALITY_MIN_SHARPNESS = 30
+QUALITY_MIN_FACE_FRACTION = 0.15
+QUALITY_MAX_FACES = 1
+QUALITY_ANALYSIS_DIMENSION = 320
+QUALITY_CHECK_FACES = True
+QUALITY_GATE = QualityGate(QUALITY_MIN_BRIGHTNESS, QUALITY_MAX_BRIGHTNESS, QUALITY_MIN_CONTRAST, QUALITY_MIN_SHARPNESS, QUALITY_MIN_FACE_FRACTION,
+                           QUALITY_MAX_FACES, QUALITY_ANALYSIS_DIMENSION, check_faces=QUALITY_CHECK_FACES, enabled=QUALITY_GATE_ENABLED)
+
+# Face detector used by DeepFace, and whether to build and warm up every model before serving
+DETECTOR_BACKEND = "opencv"
+WARMUP_MODELS_ON_STARTUP = True
+
+# Optional shared inference daemon (see inference_daemon.py). When set, workers never load the models themselves
+INFERENCE_SOCKET = os.environ.get("INFERENCE_SOCKET")
+INFERENCE_BACKEND = InferenceClient(INFERENCE_SOCKET) if INFERENCE_SOCKET else inference
+
+# Embeddings of every student's gallery, persisted under EMBEDDINGS_PATH and loaded once per process.
+# `flask --app app compact-embeddings` packs them into one memory-mapped matrix stored as EMBEDDING_PACKED_DTYPE
+# ('float32', 'float16' or 'int8'; see benchmarks/bench_embedding_quantization.py for the accuracy impact)
+EMBEDDING_PACKED_DTYPE = 'float32'
+FACE_INDEX = FaceIndex(DATASET_PATH, EMBEDDINGS_PATH, model_name="VGG-Face", detector_backend=DETECTOR_BACKEND, backend=INFERENCE_BACKEND, packed_dtype=EMBEDDING_PACKED_DTYPE)
+
+# Verified frames join a gallery only if at least GALLERY_NOVELTY_THRESHOLD (cosine distance) from every image in it;
+# past GALLERY_MAX_IMAGES the most redundant captured frame is evicted (`flask --app app prune-galleries` for old ones)
+GALLERY_MAX_IMAGES = 30
+GALLERY_NOVELTY_THRESHOLD = 0.05
+GALLERY = GalleryManager(FACE_INDEX, GALLERY_MAX_IMAGES, GALLERY_NOVELTY_THRESHOLD)
+
+# Twins are verified with every recognition model in TWIN_MODELS (model -> maximum cosine distance of a match; the
+# first is the model above, 10% stricter than usual). Both twins' galleries are embedded ahead of time under each model
+# (in the background when a twin is enrolled or gets photos, or with `flask --app app embed-twins`; every model is
+# warmed up at startup), and a claim is accepted only if the claimed twin beats their sibling by TWIN_MARGIN
+TWIN_MODELS = {"VGG-Face": CONFIDENCE_THRESHOLD * 0.9, "Facenet512": 0.27}
+TWIN_MARGIN = 0.05
+TWIN_VERIFIER = TwinVerifier(FACE_INDEX, TWIN_MODELS, TWIN_MARGIN)
+
+# Optional 1:N identification: students may leave their ID empty and are found among everyone enrolled through an
+# IVF index over the embeddings store. IDENTIFY_NPROBE trades recall for latency (>= the number of lists is exact)
+IDENTIFY_ENABLED = False
+IDENTIFY_IVF_LISTS = 0  # 0 = about sqrt(number of stored embeddings)
+IDENTIFY_NPROBE = 8
+IDENTIFY_REFRESH_SECONDS = 5  # How often changes made by other workers are picked up
+IDENTITY_INDEX = IdentityIndex(FACE_INDEX, IDENTIFY_IVF_LISTS, IDENTIFY_NPROBE, IDENTIFY_REFRESH_SECONDS)
+
+# Micro-batching of concurrent emotion/embedding passes (useful with threaded workers, e.g. gunicorn -k gthread).
+# With the inference daemon, batching happens there across all workers instead.
+INFERENCE_BATCHING = True
+INFERENCE_MAX_BATCH_SIZE = 16
+INFERENCE_MAX_WAIT_MS = 20
+EMOTION_BATCHER = MicroBatcher("emotion", INFERENCE_BACKEND.analyze_emotions, INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS, enabled=INFERENCE_BATCHING and not INFERENCE_SOCKET)
+EMBEDDING_BATCHER = MicroBatcher("embedding", lambda crops: INFERENCE_BACKEND.embed_faces(crops, FACE_INDEX.model_name), INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS, enabled=INFERENCE_BATCHING and not INFERENCE_SOCKET)
+
+# Smile liveness: 'tiered' lets OpenCV's smile cascade decide clear smiles (score >= ACCEPT) and clear non-smiles
+# (score < REJECT) in milliseconds, and sends only the frames in between to the emotion model; 'emotion' always
+# uses the model, 'cascade' never does. The score is smile-cascade hits per 1000 px of the rescaled mouth region,
+# independent of the crop size (benchmarks/calibrate_liveness.py scores labelled crops from your cameras)
+LIVENESS_MODE = 'tiered'
+LIVENESS_SMILE_ACCEPT_SCORE = 15.0
+LIVENESS_SMILE_REJECT_SCORE = 5.0
+LIVENESS = SmileLiveness(EMOTION_BATCHER.run, LIVENESS_MODE, LIVENESS_SMILE_ACCEPT_SCORE, LIVENESS_SMILE_REJECT_SCORE)
+
+# Proof and retraining images are encoded and written by a background thread after the response
+ASYNC_IMAGE_WRITES = True
+IMAGE_WRITE_QUEUE_SIZE = 64
+IMAGE_WRITER = AsyncImageWriter(IMAGE_WRITE_QUEUE_SIZE, enabled=ASYNC_IMAGE_WRITES)
+
+# Per-stage timings and outcomes of /api/mark_attendance, exported with everything else at /metrics
+STAGE_LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+ATTENDANCE_STAGE_SECONDS = HistogramFamily("attendance_stage_seconds", "Time spent in each step of marking attendance", STAGE_LATENCY_BUCKETS, 'stage')
+ATTENDANCE_REQUEST_SECONDS = Histogram("attendance_request_seconds", "Total time to handle a mark-attendance request", STAGE_LATENCY_BUCKETS)
+ATTENDANCE_OUTCOMES = Counter("attendance_outcomes_total", "Mark-attendance requests by outcome", 'outcome')
+ATTENDANCE_PRECHECK_OUTCOMES = Counter("attendance_precheck_outcomes_total", "Attendance pre-checks by outcome", 'outcome')
+
+# Opt-in sampling profiler: when enabled, requests sent with an "X-Profile: 1" header (plus a random
+# PROFILING_SAMPLE_RATE fraction of all requests) are profiled and saved as collapsed stacks under PROFILES_PATH
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_INTERVAL_MS = 5
+PROFILES_PATH = "profiles"
+
 # --- Core Logic & Helper Functions ---
 
 def sanitize_filename(filename):
@@ -41,36 +204,15 @@ def sanitize_filename(filename):
 
 def get_all_students():
     """Gets a list of student names from the dataset folder names."""
-    if not os.path.exists(DATASET_PATH): return []
-    student_folders = sorted([f for f in os.listdir(DATASET_PATH) if os.path.isdir(os.path.join(DATASET_PATH, f))])
-    student_names = []
-    for folder in student_folders:
-        try:
-            student_names.append(folder.split('-', 1)[1])
-        except IndexError:
-            student_names.append(folder)
-    return student_names
+    return STUDENT_REGISTRY.all_names()
 
 def find_folder_by_id(student_id):
     """Finds the full 'ID-Name' folder for a given student ID."""
-    if not os.path.exists(DATASET_PATH): return None
-    for folder in os.listdir(DATASET_PATH):
-        if os.path.isdir(os.path.join(DATASET_PATH, folder)) and folder.startswith(f"{student_id}-"):
-            return folder
-    return None
+    return STUDENT_REGISTRY.folder_by_id(student_id)
 
 def find_folder_by_name(student_name):
     """Finds the full 'ID-Name' folder for a given student display name."""
-    if not os.path.exists(DATASET_PATH): return None
-    for folder in os.listdir(DATASET_PATH):
-        if os.path.isdir(os.path.join(DATASET_PATH, folder)):
-            try:
-                if folder.split('-', 1)[1] == student_name:
-                    return folder
-            except IndexError:
-                if folder == student_name:
-                    return folder
-    return None
+    return STUDENT_REGISTRY.folder_by_name(student_name)
 
 def load_twins():
     """Loads twin pairs from the twins.json file."""
@@ -87,52 +229,71 @@ def save_twins(twins_data):
     with open(TWINS_FILE, 'w') as f:
         json.dump(twins_data, f, indent=4)
 
+def identify_student(probe_embedding):
+    """1:N lookup: the ID of the closest enrolled student within the confidence threshold, or None."""
+    matches = IDENTITY_INDEX.identify(probe_embedding)
+    if not matches or matches[0]['distance'] > CONFIDENCE_THRESHOLD:
+        return None
+    return matches[0]['student_id']
+
+def read_uploaded_frame(data, is_binary_upload):
+    """Decodes the webcam frame of a multipart or JSON upload, at reduced scale when it is larger than needed."""
+    if is_binary_upload:
+        image_file = request.files.get('image')
+        img_buffer = image_file.read() if image_file else b''
+    else:
+        img_buffer = base64.b64decode(data['image'].split(',')[1])
+    return decode_frame(img_buffer, DECODE_MIN_DIMENSION) if img_buffer else None
+
 def mark_attendance(name, subject):
     """Marks a student's attendance in the CSV file for the current day inside a dated folder."""
+    # Appends one row under the day's file lock; duplicates are checked against in-memory keys
     now = datetime.now()
-    date_str = now.strftime("%Y-%m-%d")
-    # Create a directory for the current date if it doesn't exist
-    date_folder_path = os.path.join(ATTENDANCE_RECORDS_PATH, date_str)
-    os.makedirs(date_folder_path, exist_ok=True)
-    
-    file_path = os.path.join(date_folder_path, "attendance.csv")
-    time_now = now.strftime("%H:%M:%S")
-
-    new_entry = pd.DataFrame([[name, time_now, subject]], columns=["Name", "Time", "Subject"])
-
-    if os.path.exists(file_path):
-        try:
-            df = pd.read_csv(file_path)
-        except pd.errors.EmptyDataError:
-            df = pd.DataFrame(columns=["Name", "Time", "Subject"])
-    else:
-        df = pd.DataFrame(columns=["Name", "Time", "Subject"])
-
-    if not df[(df['Name'] == name) & (df['Subject'] == subject)].empty:
+    if not ATTENDANCE_STORE.mark(name, subject, now):
         return False # Already marked
-
-    df = pd.concat([df, new_entry], ignore_index=True)
-    df.to_csv(file_path, index=False)
+    ATTENDANCE_AGGREGATES.record(name, subject, now.strftime("%Y-%m-%d"))
     return True
 
 def get_current_subject():
     """Determines the current subject based on the timetable."""
-    if not os.path.exists(TIMETABLE_FILE): return None
-    try:
-        with open(TIMETABLE_FILE, 'r') as f: timetable = json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError): return None
-    
-    now = datetime.now()
-    today_str = now.strftime('%A')
-    
-    for slot in timetable.get(today_str, []):
-        try:
-            start_dt = datetime.combine(now.date(), datetime.strptime(slot['start'], "%H:%M").time())
-            end_dt = datetime.combine(now.date(), datetime.strptime(slot['end'], "%H:%M").time())
-            if (start_dt - timedelta(minutes=10)) <= now <= (end_dt + timedelta(minutes=15)):
-                return slot['subject']
-        except (ValueError, KeyError): continue
-    return None
+    return TIMETABLE.subject_at(datetime.now())
+
+def precheck_tokens():
+    """Signer for the pre-check tokens, or None (logged) while SECRET_KEY is missing, the placeholder or too short."""
+    key = app.secret_key
+    if not key or key == SECRET_KEY_PLACEHOLDER or len(key) < SECRET_KEY_MIN_LENGTH:
+        app.logger.error(f"Refusing to sign or check attendance tokens: set SECRET_KEY to a random string of at least {SECRET_KEY_MIN_LENGTH} characters.")
+        return None
+    return URLSafeTimedSerializer(key, salt='attendance-precheck')
+
+def precheck_attendance(session, student_id, latitude, longitude):
+    """Checks that need no image: distance, student ID and already-marked status.
+
+    Returns (outcome, message, student_folder); the outcome is 'ok' when the frame may be uploaded.
+    """
+    with ATTENDANCE_STAGE_SECONDS.time('geolocation'):
+        distance = geodesic(session['admin_location'], (float(latitude), float(longitude))).meters
+    if distance > MAX_DISTANCE_METERS:
+        return 'too_far', f"Too far: {int(distance)}m. Must be within {MAX_DISTANCE_METERS}m.", None
+
+    if not student_id and not IDENTIFY_ENABLED:
+        return 'missing_id', 'Student ID is required.', None
+    if not student_id:
+        return 'ok', None, None  # 1:N mode: who it is is only known once the face is seen
+
+    student_folder = find_folder_by_id(student_id)
+    if not student_folder:
+        return 'unknown_student', f'No student found with ID: {student_id}.', None
+    name = student_folder.split('-', 1)[-1]
+    if ATTENDANCE_STORE.is_marked(name, session['subject']):
+        return 'already_marked', f"Info: Hello, {name}. You are already marked present for {session['subject']}.", student_folder
+    return 'ok', None, student_folder
+
+def attendance_result(outcome, message, success=False, status=200, **extra):
+    """Counts a mark-attendance outcome and its total time, and builds the JSON response."""
+    ATTENDANCE_OUTCOMES.inc(outcome)
+    ATTENDANCE_REQUEST_SECONDS.observe(time.perf_counter() - g.attendance_started)
+    return jsonify({'success': success, 'message': message, **extra}), status
 
 # --- HTML Templates ---
 def render_student_page(session_id, subject, message=None):
@@ -171,17 +332,18 @@ def render_student_page(session_id, subject, message=None):
             const statusDisplay = document.getElementById('status-display'), loadingOverlay = document.getElementById('loading-overlay'), mainPrompt = document.getElementById('main-prompt');
             const studentIdEntry = document.getElementById('student-id-entry'), livenessPrompt = document.getElementById('liveness-prompt');
             const sessionId = "{session_id}"; let studentLocation = null, isProcessing = false;
+            const uploadMode = "{UPLOAD_MODE}", maxDimension = {UPLOAD_MAX_DIMENSION}, identifyMode = {'true' if IDENTIFY_ENABLED else 'false'};
 
             function showStatus(message, type = 'info') {{ statusDisplay.textContent = message; statusDisplay.className = 'status-box mt-6 p-4 rounded-lg border-2 text-lg font-semibold text-center'; statusDisplay.classList.add(`status-${{type}}`); statusDisplay.style.opacity = 1; }}
             
             async function setupDevice() {{
                 showStatus("Requesting location permission...", "processing"); mainPrompt.textContent = "Please allow location access and enter your Student ID.";
-                navigator.geolocation.getCurrentPosition( (position) => {{ studentLocation = {{ latitude: position.coords.latitude, longitude: position.coords.longitude }}; showStatus("Location found! Enter your Student ID to proceed.", "success"); mainPrompt.textContent = "Enter your Student ID and point camera at face."; }}, (err) => {{ showStatus("Location access denied. You cannot mark attendance.", "error"); mainPrompt.textContent = "Location is required. Please enable it and refresh."; markButton.disabled = true; }}, {{ enableHighAccuracy: true }} );
+                navigator.geolocation.getCurrentPosition( (position) => {{ studentLocation = {{ latitude: position.coords.latitude, longitude: position.coords.longitude }}; showStatus("Location found! Enter your Student ID to proceed.", "success"); mainPrompt.textContent = "Enter your Student ID and point camera at face."; if (identifyMode) {{ markButton.disabled = false; showStatus("Location found! Look at the camera, or enter your Student ID.", "success"); }} }}, (err) => {{ showStatus("Location access denied. You cannot mark attendance.", "error"); mainPrompt.textContent = "Location is required. Please enable it and refresh."; markButton.disabled = true; }}, {{ enableHighAccuracy: true }} );
                 try {{ const stream = await navigator.mediaDevices.getUserMedia({{ video: {{ facingMode: 'user' }} }}); video.srcObject = stream; video.onloadedmetadata = () => {{ loadingOverlay.style.display = 'none'; }}; }} catch (err) {{ loadingOverlay.innerHTML = `<p class="text-red-400 text-xl px-4">Error: Could not access camera.</p>`; markButton.disabled = true; }}
             }}
             
             studentIdEntry.addEventListener('input', () => {{
-                if (studentIdEntry.value.trim().length > 0 && studentLocation) {{
+                if ((studentIdEntry.value.trim().length > 0 || identifyMode) && studentLocation) {{
                     markButton.disabled = false;
                     showStatus("Student ID entered. Ready to mark attendance.", "success");
                 }} else {{
@@ -191,19 +353,39 @@ def render_student_page(session_id, subject, message=None):
             }});
             
             markButton.addEventListener('click', async () => {{
-                if (isProcessing || !studentLocation || !studentIdEntry.value.trim()) return;
-                isProcessing = true; markButton.disabled = true; markButton.textContent = 'Processing...'; showStatus('Capturing & verifying...', 'processing');
-                
-                canvas.width = video.videoWidth; canvas.height = video.videoHeight;
-                const context = canvas.getContext('2d');
-                context.translate(canvas.width, 0); context.scale(-1, 1);
-                context.drawImage(video, 0, 0, canvas.width, canvas.height);
-                const imageData = canvas.toDataURL('image/jpeg');
-
-                let payload = {{ image: imageData, location: studentLocation, student_id: studentIdEntry.value.trim() }};
+                if (isProcessing || !studentLocation || (!studentIdEntry.value.trim() && !identifyMode)) return;
+                isProcessing = true; markButton.disabled = true; markButton.textContent = 'Processing...'; showStatus('Checking in...', 'processing');
 
                 try {{
-                    const response = await fetch(`/api/mark_attendance/${{sessionId}}`, {{ method: 'POST', headers: {{ 'Content-Type': 'application/json' }}, body: JSON.stringify(payload) }});
+                    // Cheap checks first (distance, ID, already marked); the frame is only captured and sent once they pass
+                    const precheck = await fetch(`/api/precheck/${{sessionId}}`, {{ method: 'POST', headers: {{ 'Content-Type': 'application/json' }},
+                        body: JSON.stringify({{ latitude: studentLocation.latitude, longitude: studentLocation.longitude, student_id: studentIdEntry.value.trim() }}) }}).then(res => res.json());
+                    if (!precheck.success || precheck.marked) {{
+                        showStatus(precheck.message, precheck.success ? 'success' : 'error');
+                        if (precheck.marked) markButton.textContent = 'Attendance Marked';
+                        return;
+                    }}
+                    showStatus('Capturing & verifying...', 'processing');
+
+                    const scale = maxDimension > 0 ? Math.min(1, maxDimension / Math.max(video.videoWidth, video.videoHeight)) : 1;
+                    canvas.width = Math.round(video.videoWidth * scale); canvas.height = Math.round(video.videoHeight * scale);
+                    const context = canvas.getContext('2d');
+                    context.translate(canvas.width, 0); context.scale(-1, 1);
+                    context.drawImage(video, 0, 0, canvas.width, canvas.height);
+
+                    let requestOptions;
+                    if (uploadMode === 'binary') {{
+                        const blob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.92));
+                        const form = new FormData();
+                        form.append('image', blob, 'frame.jpg');
+                        form.append('token', precheck.token);
+                        requestOptions = {{ method: 'POST', body: form }};
+                    }} else {{
+                        let payload = {{ image: canvas.toDataURL('image/jpeg'), token: precheck.token }};
+                        requestOptions = {{ method: 'POST', headers: {{ 'Content-Type': 'application/json' }}, body: JSON.stringify(payload) }};
+                    }}
+
+                    const response = await fetch(`/api/mark_attendance/${{sessionId}}`, requestOptions);
                     const result = await response.json();
                     showStatus(result.message, result.success ? 'success' : 'error');
 
@@ -290,6 +472,7 @@ ADMIN_DASHBOARD_PAGE = """
                         <div class="mt-4 border-t pt-4">
                             <button id="send-overall-email-btn" class="w-full bg-purple-600 text-white p-3 rounded hover:bg-purple-700">Send Detailed Overall Report</button>
                         </div>
+                        <p id="email-job-status" class="text-sm text-gray-600 hidden"></p>
                     </div>
                 </div>
             </div>
@@ -537,10 +720,21 @@ document.addEventListener('DOMContentLoaded', () => {
             const formData = new FormData();
             formData.append('subject', selectedValue);
             const result = await api.post('/api/send_todays_email', formData);
-            alert(result.message);
+            alert(result.message); if (result.job_id) pollEmailJob(result.job_id);
         }
     });
-    document.getElementById('send-overall-email-btn').addEventListener('click', async () => { if (confirm("This will email the DETAILED overall attendance summary to all registered students. Proceed?")) { const result = await api.post('/api/send_overall_email', new FormData()); alert(result.message); } });
+    document.getElementById('send-overall-email-btn').addEventListener('click', async () => { if (confirm("This will email the DETAILED overall attendance summary to all registered students. Proceed?")) { const result = await api.post('/api/send_overall_email', new FormData()); alert(result.message); if (result.job_id) pollEmailJob(result.job_id); } });
+    async function pollEmailJob(jobId) {
+        const statusEl = document.getElementById('email-job-status'); statusEl.classList.remove('hidden');
+        const data = await api.get(`/api/email_job/${jobId}`);
+        if (!data.success) { statusEl.textContent = data.message; return; }
+        const job = data.job;
+        statusEl.textContent = `Emails: ${job.sent} sent, ${job.failed} failed of ${job.total} (${job.status.replace(/_/g, ' ')})`;
+        if (job.status === 'queued' || job.status === 'running') { setTimeout(() => pollEmailJob(jobId), 2000); return; }
+        const failures = Object.entries(job.recipients).filter(([, r]) => r.status === 'failed').map(([name, r]) => `${name} (${r.email}): ${r.error}`);
+        if (job.status === 'failed' && job.message) statusEl.textContent += ` - ${job.message}`;
+        if (failures.length) statusEl.textContent += ` - Failed: ${failures.join('; ')}`;
+    }
     
     loadAll();
 });
@@ -571,15 +765,96 @@ def admin_dashboard():
 
 @app.route('/attend/<session_id>')
 def attend_page(session_id):
-    session = ATTENDANCE_SESSIONS.get(session_id)
-    if not session or datetime.now() > session['expires_at']:
-        if session_id in ATTENDANCE_SESSIONS:
-            del ATTENDANCE_SESSIONS[session_id]
+    session = ATTENDANCE_SESSIONS.get(session_id)  # None once expired
+    if not session:
         return "Attendance session not found or has expired.", 404
     return render_template_string(render_student_page(session_id, session.get('subject', 'General')))
 
+# --- Request Profiling ---
+@app.before_request
+def start_request_profiler():
+    if not PROFILING_ENABLED: return
+    if request.headers.get('X-Profile') == '1' or random.random() < PROFILING_SAMPLE_RATE:
+        g.profiler = SamplingProfiler(interval_seconds=PROFILING_INTERVAL_MS / 1000).start()
+
+@app.after_request
+def save_request_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None: return response
+    profiler.stop()
+    file_name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{sanitize_filename(request.endpoint or 'unknown')}-{uuid.uuid4().hex[:6]}.folded"
+    profiler.save(os.path.join(PROFILES_PATH, file_name))
+    top = ', '.join(f"{name} ({count})" for name, count in profiler.top(5))
+    app.logger.info(f"Profiled {request.path} for {profiler.duration_seconds * 1000:.0f} ms ({profiler.samples} samples): {top}")
+    response.headers['X-Profile'] = file_name
+    return response
+
+@app.teardown_request
+def stop_request_profiler(exc):
+    profiler = g.pop('profiler', None)  # Still set only if the request raised before after_request ran
+    if profiler is not None: profiler.stop()
+
 # --- API Endpoints ---
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Every in-process metric (stage timings, outcomes, batching, image writes) in Prometheus text format."""
+    return render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/api/ready', methods=['GET'])
+def api_ready():
+    """Readiness probe: 200 once the models are warmed up, 503 until then."""
+    if INFERENCE_SOCKET:
+        try:
+            health = INFERENCE_BACKEND.health()
+        except InferenceError as e:
+            return jsonify({'ready': False, 'error': str(e)}), 503
+        return jsonify({'inference_daemon': health, 'ready': health['ready']}), 200 if health['ready'] else 503
+    ready = WARMUP_STATE['ready'] or not WARMUP_MODELS_ON_STARTUP
+    return jsonify({**WARMUP_STATE, 'ready': ready}), 200 if ready else 503
+
+@app.route('/api/identify_stats', methods=['GET'])
+def api_identify_stats():
+    """Size and search settings of the 1:N identification index."""
+    return jsonify({'enabled': IDENTIFY_ENABLED, **IDENTITY_INDEX.stats()})
+
+@app.route('/api/inference_stats', methods=['GET'])
+def api_inference_stats():
+    """Batch-size and latency histograms of the inference micro-batchers."""
+    return jsonify({'batching': INFERENCE_BATCHING, 'max_batch_size': INFERENCE_MAX_BATCH_SIZE, 'max_wait_ms': INFERENCE_MAX_WAIT_MS, 'histograms': snapshot_all()})
+
+@app.route('/api/liveness_stats', methods=['GET'])
+def api_liveness_stats():
+    """How liveness decisions were made, and the share decided without the emotion model."""
+    return jsonify(LIVENESS.stats())
+
+@app.route('/api/image_writer_stats', methods=['GET'])
+def api_image_writer_stats():
+    """Queue depth and write/failure counts of the background proof image writer."""
+    return jsonify(IMAGE_WRITER.stats())
+
+@app.route('/api/identify/<session_id>', methods=['POST'])
+def api_identify(session_id):
+    """1:N identification of the face in a frame (multipart 'image' or JSON data URL), without marking attendance."""
+    if not IDENTIFY_ENABLED:
+        return jsonify({'success': False, 'message': 'Identification is not enabled.'}), 404
+    if not ATTENDANCE_SESSIONS.get(session_id):
+        return jsonify({'success': False, 'message': 'Session expired.'}), 404
+    is_binary_upload = request.mimetype == 'multipart/form-data'
+    frame = read_uploaded_frame(request.form if is_binary_upload else request.get_json(), is_binary_upload)
+    if frame is None or frame.size == 0:
+        return jsonify({'success': False, 'message': 'Could not decode image from webcam. Please try again.'})
+    try:
+        face = INFERENCE_BACKEND.detect_face(frame, detector_backend=DETECTOR_BACKEND, enforce_detection=True)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'No face detected. Please look directly at the camera and try again.'})
+    matches = IDENTITY_INDEX.identify(EMBEDDING_BATCHER.run(face['crop']))
+    if not matches or matches[0]['distance'] > CONFIDENCE_THRESHOLD:
+        return jsonify({'success': False, 'message': 'Face not recognised.'})
+    best = matches[0]
+    folder = find_folder_by_id(best['student_id']) or best['folder'] or ''
+    return jsonify({'success': True, 'student_id': best['student_id'], 'name': folder.split('-', 1)[-1], 'distance': round(best['distance'], 4)})
+
 @app.route('/api/generate_link', methods=['POST'])
 def api_generate_link():
     current_subject = get_current_subject()
@@ -588,121 +863,177 @@ def api_generate_link():
     location_data = json.loads(request.form.get('location'))
     session_id = str(uuid.uuid4().hex[:10])
     expires_at = datetime.now() + timedelta(minutes=SESSION_TIMEOUT_MINUTES)
-    ATTENDANCE_SESSIONS[session_id] = {
+    ATTENDANCE_SESSIONS.put(session_id, {
         'admin_location': (location_data['latitude'], location_data['longitude']),
         'expires_at': expires_at,
         'subject': current_subject
-    }
+    })
     full_url = request.host_url + 'attend/' + session_id
     return jsonify({'success': True, 'url': full_url, 'timeout': SESSION_TIMEOUT_MINUTES, 'subject': current_subject})
 
+@app.route('/api/precheck/<session_id>', methods=['POST'])
+def api_precheck(session_id):
+    """First phase of marking attendance: validates everything but the face and returns a short-lived upload token."""
+    session = ATTENDANCE_SESSIONS.get(session_id)
+    if not session:
+        ATTENDANCE_PRECHECK_OUTCOMES.inc('session_expired')
+        return jsonify({'success': False, 'message': 'Session expired.'}), 404
+    try:
+        data = request.get_json()
+        student_id = str(data.get('student_id', '')).strip()
+        outcome, message, _ = precheck_attendance(session, student_id, data['latitude'], data['longitude'])
+    except (TypeError, KeyError, ValueError, AttributeError):
+        ATTENDANCE_PRECHECK_OUTCOMES.inc('bad_request')
+        return jsonify({'success': False, 'message': 'Location and Student ID are required.'}), 400
+
+    ATTENDANCE_PRECHECK_OUTCOMES.inc(outcome)
+    if outcome == 'already_marked':
+        return jsonify({'success': True, 'marked': True, 'message': message})
+    if outcome != 'ok':
+        return jsonify({'success': False, 'message': message})
+    tokens = precheck_tokens()
+    if tokens is None:
+        ATTENDANCE_PRECHECK_OUTCOMES.inc('not_configured')
+        return jsonify({'success': False, 'message': 'Attendance is not set up on the server yet. Please tell your instructor.'}), 503
+    token = tokens.dumps({'session_id': session_id, 'student_id': student_id, 'nonce': uuid.uuid4().hex})
+    return jsonify({'success': True, 'token': token, 'expires_in': PRECHECK_TOKEN_TTL_SECONDS})
+
 @app.route('/api/mark_attendance/<session_id>', methods=['POST'])
 def api_mark_attendance(session_id):
     """
     Handles the core logic for verifying and marking a student's attendance.
+    Expects the token from /api/precheck, which has already checked the distance and the student ID.
     This updated version saves proof images in a nested directory structure:
     attendance_proofs/YYYY-MM-DD/SubjectName/student_id-student_name_time.jpg
     """
+    g.attendance_started = time.perf_counter()
     session = ATTENDANCE_SESSIONS.get(session_id)
-    if not session or datetime.now() > session['expires_at']:
-        return jsonify({'success': False, 'message': 'Session expired.'}), 404
+    if not session:
+        return attendance_result('session_expired', 'Session expired.', status=404)
 
     try:
-        data = request.get_json()
-        admin_loc = session['admin_location']
-        student_loc = (data['location']['latitude'], data['location']['longitude'])
-        distance = geodesic(admin_loc, student_loc).meters
-
-        if distance > MAX_DISTANCE_METERS:
-            return jsonify({'success': False, 'message': f"Too far: {int(distance)}m. Must be within {MAX_DISTANCE_METERS}m."})
-
-        student_id = data.get('student_id', '').strip()
-        if not student_id:
-            return jsonify({'success': False, 'message': 'Student ID is required.'})
-
-        student_folder = find_folder_by_id(student_id)
-        if not student_folder:
-            return jsonify({'success': False, 'message': f'No student found with ID: {student_id}.'})
+        with ATTENDANCE_STAGE_SECONDS.time('parse'):
+            # Binary uploads are multipart with the JPEG as a file; older pages still post JSON with a data URL
+            is_binary_upload = request.mimetype == 'multipart/form-data'
+            data = request.form if is_binary_upload else request.get_json()
+
+        token = data.get('token')
+        if token:
+            tokens = precheck_tokens()
+            if tokens is None:
+                return attendance_result('not_configured', 'Attendance is not set up on the server yet. Please tell your instructor.', status=503)
+            try:
+                claims = tokens.loads(token, max_age=PRECHECK_TOKEN_TTL_SECONDS)
+            except SignatureExpired:
+                return attendance_result('token_expired', 'Your check-in has expired. Please try again.')
+            except BadSignature:
+                claims = None
+            if not claims or claims.get('session_id') != session_id or not claims.get('nonce'):
+                return attendance_result('bad_token', 'Invalid check-in. Please reload the page and try again.', status=400)
+            # Single use: a replayed upload (or a second attempt with the same check-in) is refused
+            if not ATTENDANCE_SESSIONS.use_token(claims['nonce'], datetime.now() + timedelta(seconds=PRECHECK_TOKEN_TTL_SECONDS)):
+                return attendance_result('token_used', 'This check-in was already used. Please try again.', status=400)
+            student_id = claims['student_id']
+            student_folder = find_folder_by_id(student_id) if student_id else None
+            if student_id and not student_folder:
+                return attendance_result('unknown_student', f'No student found with ID: {student_id}.')
+        elif PRECHECK_REQUIRED:
+            return attendance_result('missing_token', 'Please reload the page and try again.', status=400)
+        else:
+            student_id = data.get('student_id', '').strip()
+            location = data if is_binary_upload else data['location']
+            outcome, message, student_folder = precheck_attendance(session, student_id, location['latitude'], location['longitude'])
+            if outcome != 'ok':
+                return attendance_result(outcome, message, success=outcome == 'already_marked')
 
         # Decode the image data from the frontend
-        image_data = data['image'].split(',')[1]
-        img_buffer = base64.b64decode(image_data)
-        np_arr = np.frombuffer(img_buffer, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        with ATTENDANCE_STAGE_SECONDS.time('decode'):
+            frame = read_uploaded_frame(data, is_binary_upload)
 
         if frame is None or frame.size == 0:
-            return jsonify({'success': False, 'message': 'Could not decode image from webcam. Please try again.'})
+            return attendance_result('bad_image', 'Could not decode image from webcam. Please try again.')
+
+        # Reject frames the models would fail on anyway, in milliseconds and with a reason the student can fix
+        with ATTENDANCE_STAGE_SECONDS.time('quality'):
+            quality_issue, _ = QUALITY_GATE.check(frame)
+        if quality_issue:
+            return attendance_result('poor_quality', QUALITY_GATE.message(quality_issue), quality=quality_issue)
+
+        # Detect and align the face once; liveness and recognition both work on this crop
+        try:
+            with ATTENDANCE_STAGE_SECONDS.time('detect'):
+                face = INFERENCE_BACKEND.detect_face(frame, detector_backend=DETECTOR_BACKEND, enforce_detection=True)
+        except ValueError:
+            return attendance_result('no_face', 'No face detected. Please look directly at the camera and try again.')
 
         # Liveness detection: Check for a smile to prevent using static photos
         try:
-            liveness_result = DeepFace.analyze(frame, actions=['emotion'], enforce_detection=False, silent=True)
-            # Check if the dominant emotion is happy or if the happiness score is high
-            has_smile = liveness_result[0]['dominant_emotion'] == 'happy' or liveness_result[0]['emotion']['happy'] > 0.7
+            with ATTENDANCE_STAGE_SECONDS.time('liveness'):
+                # Clear cases are decided by the smile cascade; only unclear frames run the emotion model
+                has_smile = LIVENESS.check(face['crop'])['live']
             if not has_smile:
-                return jsonify({'success': False, 'message': 'Liveness not detected. Please smile to confirm you are live.', 'requires_liveness': True})
+                return attendance_result('no_liveness', 'Liveness not detected. Please smile to confirm you are live.', requires_liveness=True)
         except Exception as e:
             app.logger.error(f"Liveness detection error: {e}")
-            return jsonify({'success': False, 'message': 'Liveness check failed. Please try again.', 'requires_liveness': True})
+            return attendance_result('liveness_error', 'Liveness check failed. Please try again.', requires_liveness=True)
 
-        student_path = os.path.join(DATASET_PATH, student_folder)
         twins = load_twins()
-        is_twin = any(student_id in pair for pair in twins.values())
+        probe_embedding = None
+        if not student_id:
+            # 1:N mode: find who this is among everyone enrolled; the usual 1:1 check below then confirms it
+            with ATTENDANCE_STAGE_SECONDS.time('embed'):
+                probe_embedding = EMBEDDING_BATCHER.run(face['crop'])
+            with ATTENDANCE_STAGE_SECONDS.time('identify'):
+                student_id = identify_student(probe_embedding)
+            student_folder = find_folder_by_id(student_id) if student_id else None
+            if not student_folder:
+                return attendance_result('not_recognised', 'Face not recognised. Please enter your Student ID.')
+            if any(student_id in pair for pair in twins.values()):
+                return attendance_result('twin_needs_id', 'Please enter your Student ID to mark attendance.')
+
+        student_path = os.path.join(DATASET_PATH, student_folder)
+        twin_pair = next((pair for pair in twins.values() if student_id in pair), None)
+        is_twin = twin_pair is not None
         name = "" # Initialize name variable
+        keep_frame = True  # Whether the verified frame is added to the student's gallery
+        twin_embeddings = None
 
         # --- Face Recognition Logic ---
         try:
             if is_twin:
-                # Enhanced, stricter analysis for twins using multiple models
-                dfs = DeepFace.find(
-                    img_path=frame,
-                    db_path=student_path,
-                    model_name=["VGG-Face", "Age", "Gender"],
-                    distance_metric="cosine",
-                    enforce_detection=True,
-                    silent=True
-                )
-                if not dfs or len(dfs) < 3 or any(df.empty for df in dfs):
-                    return jsonify({'success': False, 'message': 'Face recognition failed for twin analysis.'})
-
-                df_identity = dfs[0]
-                distance_col = 'distance'
-                if distance_col not in df_identity.columns:
-                    return jsonify({'success': False, 'message': 'Internal error: Result format is unexpected.'})
-
-                # Use a 10% stricter confidence threshold for twins
-                potential_matches = df_identity[df_identity[distance_col] <= CONFIDENCE_THRESHOLD * 0.9]
-                if potential_matches.empty:
-                    return jsonify({'success': False, 'message': 'Face did not match with sufficient confidence.'})
-
-                match_identity = potential_matches.iloc[0]['identity']
-                folder_name = os.path.basename(os.path.dirname(match_identity))
-                student_id_verified, name = folder_name.split('-', 1)
-
-                if student_id_verified != student_id:
-                    return jsonify({'success': False, 'message': 'Student ID mismatch with recognized face.'})
+                # Stricter analysis for twins: the probe is embedded once per model and scored against the
+                # precomputed galleries of both twins, so the claimed twin has to beat their sibling
+                siblings = {sibling: find_folder_by_id(sibling) for sibling in twin_pair if sibling != student_id}
+                siblings = {sibling: folder for sibling, folder in siblings.items() if folder}  # A deleted sibling has no gallery
+                with ATTENDANCE_STAGE_SECONDS.time('embed'):
+                    probe_embedding = EMBEDDING_BATCHER.run(face['crop'])
+                    twin_embeddings = TWIN_VERIFIER.embed(face['crop'], known={FACE_INDEX.model_name: probe_embedding})
+                with ATTENDANCE_STAGE_SECONDS.time('match'):
+                    verdict = TWIN_VERIFIER.verify(student_id, student_folder, siblings, twin_embeddings)
+                if verdict['outcome'] == 'sibling':
+                    return attendance_result('mismatch', 'Student ID mismatch with recognized face.')
+                if verdict['outcome'] == 'low_confidence':
+                    return attendance_result('low_confidence', 'Face did not match with sufficient confidence.')
+                if verdict['outcome'] == 'ambiguous':
+                    return attendance_result('twin_ambiguous', 'Could not tell you apart from your twin with confidence. Please face the camera directly and try again.')
+                keep_frame = GALLERY.is_novel(verdict['distances'])
+                name = student_folder.split('-', 1)[1]
             else:
-                # Standard analysis for non-twins
-                dfs = DeepFace.find(
-                    img_path=frame,
-                    db_path=student_path,
-                    model_name="VGG-Face",
-                    distance_metric="cosine",
-                    enforce_detection=True,
-                    silent=True
-                )
-                if not dfs or dfs[0].empty:
-                    return jsonify({'success': False, 'message': 'Face did not match the registered student.'})
-
-                df = dfs[0]
-                distance_col = 'distance'
-                if distance_col not in df.columns:
-                    return jsonify({'success': False, 'message': 'Internal error: Result format is unexpected.'})
-
-                potential_matches = df[df[distance_col] <= CONFIDENCE_THRESHOLD]
-                if potential_matches.empty:
-                    return jsonify({'success': False, 'message': 'Face did not match with sufficient confidence.'})
-
-                identity_path = potential_matches.iloc[0]['identity']
+                # Standard analysis for non-twins: only the probe is embedded, the gallery comes from the index
+                if probe_embedding is None:
+                    with ATTENDANCE_STAGE_SECONDS.time('embed'):
+                        probe_embedding = EMBEDDING_BATCHER.run(face['crop'])
+                with ATTENDANCE_STAGE_SECONDS.time('match'):
+                    distances, identity_paths = FACE_INDEX.distances(student_id, student_folder, probe_embedding)
+                if distances.size == 0:
+                    return attendance_result('mismatch', 'Face did not match the registered student.')
+
+                best = int(np.argmin(distances))
+                if distances[best] > CONFIDENCE_THRESHOLD:
+                    return attendance_result('low_confidence', 'Face did not match with sufficient confidence.')
+                keep_frame = GALLERY.is_novel(distances)
+
+                identity_path = identity_paths[best]
                 folder_name = os.path.basename(os.path.dirname(identity_path))
                 try:
                     student_id_verified, name = folder_name.split('-', 1)
@@ -710,10 +1041,12 @@ def api_mark_attendance(session_id):
                     name, student_id_verified = folder_name, "UnknownID"
 
                 if student_id_verified != student_id:
-                    return jsonify({'success': False, 'message': 'Student ID mismatch with recognized face.'})
+                    return attendance_result('mismatch', 'Student ID mismatch with recognized face.')
 
             # --- Attendance Marking & File Saving ---
-            if mark_attendance(name, session['subject']):
+            with ATTENDANCE_STAGE_SECONDS.time('record'):
+                marked = mark_attendance(name, session['subject'])
+            if marked:
                 now = datetime.now()
                 date_str = now.strftime("%Y-%m-%d")
                 time_str = now.strftime("%H%M%S")
@@ -722,35 +1055,37 @@ def api_mark_attendance(session_id):
                 # Sanitize subject name to make it a valid folder name
                 safe_subject = sanitize_filename(session['subject'])
                 
-                # Create the nested directory: /proofs/YYYY-MM-DD/SubjectName/
+                # Nested directory: /proofs/YYYY-MM-DD/SubjectName/ (created by the image writer)
                 proof_subject_folder = os.path.join(ATTENDANCE_PROOFS_PATH, date_str, safe_subject)
-                os.makedirs(proof_subject_folder, exist_ok=True)
                 
                 safe_name = sanitize_filename(name)
                 proof_filename = f"{student_id}-{safe_name}_{time_str}.jpg"
                 proof_path = os.path.join(proof_subject_folder, proof_filename)
                 
-                cv2.imwrite(proof_path, frame)
-                
-                # Add the verified photo back to the dataset for continuous learning
-                try:
+                # Add a novel verified photo back to the dataset for continuous learning; it is written in the
+                # background as a hard link to the proof, and indexed once it exists
+                retrain_path, on_written = None, None
+                if keep_frame:
                     retrain_filename = f"upload_{date_str}_{time_str}.jpg"
                     retrain_path = os.path.join(student_path, retrain_filename)
-                    cv2.imwrite(retrain_path, frame)
-                except Exception as e:
-                    app.logger.error(f"Could not save retraining image: {e}")
+                    if probe_embedding is not None:
+                        def on_written():
+                            GALLERY.add_verified_frame(student_id, student_folder, retrain_path, probe_embedding)
+                            if twin_embeddings: TWIN_VERIFIER.add_embeddings(student_id, student_folder, retrain_path, twin_embeddings)
+                with ATTENDANCE_STAGE_SECONDS.time('save_images'):
+                    IMAGE_WRITER.submit(frame, proof_path, retrain_path, on_written)
                 
-                return jsonify({'success': True, 'message': f"Success! Welcome, {name}. Attendance marked for {session['subject']}."})
+                return attendance_result('success', f"Success! Welcome, {name}. Attendance marked for {session['subject']}.", success=True)
             else:
-                return jsonify({'success': True, 'message': f"Info: Hello, {name}. You are already marked present for {session['subject']}."})
+                return attendance_result('already_marked', f"Info: Hello, {name}. You are already marked present for {session['subject']}.", success=True)
 
         except Exception as e:
             app.logger.error(f"Face recognition error: {e}", exc_info=True)
-            return jsonify({'success': False, 'message': 'Face recognition failed. Please try again.'})
+            return attendance_result('recognition_error', 'Face recognition failed. Please try again.')
 
     except Exception as e:
         app.logger.error(f"A critical error occurred in api_mark_attendance: {e}", exc_info=True)
-        return jsonify({'success': False, 'message': 'An unexpected server error occurred. Please try again.'})
+        return attendance_result('error', 'An unexpected server error occurred. Please try again.')
 
 # --- Management & Report APIs ---
 @app.route('/api/students', methods=['GET'])
@@ -768,7 +1103,7 @@ def api_add_student():
 
     name, student_id = name.strip(), student_id.strip()
     
-    if any(folder.startswith(f"{student_id}-") for folder in os.listdir(DATASET_PATH)):
+    if find_folder_by_id(student_id):
         return jsonify({'success': False, 'message': f'Student ID "{student_id}" is already in use.'})
 
     images = request.files.getlist('images')
@@ -781,12 +1116,14 @@ def api_add_student():
         return jsonify({'success': False, 'message': f'A student with this ID and Name combination already exists.'})
     
     os.makedirs(student_path)
+    STUDENT_REGISTRY.invalidate()
+    saved_paths = []
     for i, image in enumerate(images):
         unique_filename = f"upload_{datetime.now().strftime('%Y%m%d%H%M%S')}_{i}.jpg"
         image.save(os.path.join(student_path, unique_filename))
-        
-    db_file = os.path.join(DATASET_PATH, "representations_vgg_face.pkl")
-    if os.path.exists(db_file): os.remove(db_file)
+        saved_paths.append(os.path.join(student_path, unique_filename))
+
+    FACE_INDEX.add_images(student_id, student_folder_name, saved_paths)
 
     if is_twin:
         twins = load_twins()
@@ -800,6 +1137,7 @@ def api_add_student():
         else:
             twins[student_id] = [student_id]
         save_twins(twins)
+        TWIN_VERIFIER.precompute_in_background([(student_id, student_folder_name)])
 
     return jsonify({'success': True, 'message': f'Student "{name}" added successfully. Database will be updated.'})
 
@@ -818,14 +1156,18 @@ def api_add_photos():
         return jsonify({'success': False, 'message': f'Student "{student_name}" not found.'})
 
     student_path = os.path.join(DATASET_PATH, student_folder)
+    saved_paths = []
     for i, image in enumerate(images):
         unique_filename = f"upload_{datetime.now().strftime('%Y%m%d%H%M%S')}_{i}.jpg"
         image.save(os.path.join(student_path, unique_filename))
+        saved_paths.append(os.path.join(student_path, unique_filename))
+
+    # Only the new photos are embedded; everyone else's rows are untouched
+    student_id = student_folder.split('-', 1)[0]
+    FACE_INDEX.add_images(student_id, student_folder, saved_paths)
+    if any(student_id in pair for pair in load_twins().values()):
+        TWIN_VERIFIER.precompute_in_background([(student_id, student_folder)])
 
-    db_file = os.path.join(DATASET_PATH, "representations_vgg_face.pkl")
-    if os.path.exists(db_file):
-        os.remove(db_file)
-        
     return jsonify({'success': True, 'message': f'Added {len(images)} more photos for "{student_name}". Database will be updated.'})
 
 @app.route('/api/rename_student', methods=['POST'])
@@ -843,23 +1185,14 @@ def api_rename_student():
     if os.path.exists(new_path): return jsonify({'success': False, 'message': 'A student with the new name already exists for that ID.'})
     
     os.rename(old_path, new_path)
+    STUDENT_REGISTRY.invalidate()
     
-    # Iterate through dated subfolders to update records
-    for date_folder in os.listdir(ATTENDANCE_RECORDS_PATH):
-        folder_path = os.path.join(ATTENDANCE_RECORDS_PATH, date_folder)
-        if os.path.isdir(folder_path):
-            file_path = os.path.join(folder_path, "attendance.csv")
-            if os.path.exists(file_path):
-                try:
-                    df = pd.read_csv(file_path)
-                    if 'Name' in df.columns and old_name in df['Name'].values:
-                        df['Name'] = df['Name'].replace(old_name, new_name.strip())
-                        df.to_csv(file_path, index=False)
-                except (pd.errors.EmptyDataError, KeyError):
-                    continue
+    # Rewrite dated records under the same lock the attendance writer uses
+    ATTENDANCE_STORE.rename_student(old_name, new_name.strip())
+    ATTENDANCE_AGGREGATES.rename_student(old_name, new_name.strip())
 
-    db_file = os.path.join(DATASET_PATH, "representations_vgg_face.pkl")
-    if os.path.exists(db_file): os.remove(db_file)
+    FACE_INDEX.rename_student(student_id, new_folder_name)
+    TWIN_VERIFIER.rename_student(student_id, new_folder_name)
 
     return jsonify({'success': True, 'message': f'Renamed "{old_name}" to "{new_name}".'})
 
@@ -872,8 +1205,9 @@ def api_delete_student():
     student_path = os.path.join(DATASET_PATH, folder_to_delete)
     if os.path.exists(student_path):
         shutil.rmtree(student_path)
-        db_file = os.path.join(DATASET_PATH, "representations_vgg_face.pkl")
-        if os.path.exists(db_file): os.remove(db_file)
+        STUDENT_REGISTRY.invalidate()
+        FACE_INDEX.remove_student(folder_to_delete.split('-', 1)[0])
+        TWIN_VERIFIER.remove_student(folder_to_delete.split('-', 1)[0])
         twins = load_twins()
         for pair in list(twins.values()):
             if any(folder_to_delete.split('-', 1)[0] in p for p in pair):
@@ -890,21 +1224,11 @@ def api_todays_attendance():
     all_students = get_all_students()
     
     date_str = datetime.now().strftime('%Y-%m-%d')
-    file_path = os.path.join(ATTENDANCE_RECORDS_PATH, date_str, "attendance.csv")
-    
-    if not os.path.exists(file_path):
-        return jsonify({'present': [], 'absent': all_students})
+    df = ATTENDANCE_STORE.day_records(date_str, None if subject_filter == 'all' else subject_filter)
 
-    try:
-        df = pd.read_csv(file_path)
-        if subject_filter != 'all':
-            df = df[df['Subject'] == subject_filter]
-        
-        present_today = df['Name'].unique().tolist()
-        absent_students = [s for s in all_students if s not in present_today]
-        return jsonify({'present': df.to_dict('records'), 'absent': absent_students})
-    except pd.errors.EmptyDataError:
-        return jsonify({'present': [], 'absent': all_students})
+    present_today = set(df['Name'].unique())
+    absent_students = [s for s in all_students if s not in present_today]
+    return jsonify({'present': df.to_dict('records'), 'absent': absent_students})
 
 @app.route('/api/overall_attendance', methods=['GET'])
 def api_overall_attendance():
@@ -912,48 +1236,15 @@ def api_overall_attendance():
     all_students = get_all_students()
     if not all_students: return jsonify({'report': []})
 
-    # Scan subdirectories for record files
-    record_files = []
-    if os.path.exists(ATTENDANCE_RECORDS_PATH):
-        for date_folder in os.listdir(ATTENDANCE_RECORDS_PATH):
-            folder_path = os.path.join(ATTENDANCE_RECORDS_PATH, date_folder)
-            if os.path.isdir(folder_path):
-                csv_path = os.path.join(folder_path, "attendance.csv")
-                if os.path.exists(csv_path):
-                    record_files.append(csv_path)
-    
+    # 'all' counts days with records; a subject counts the days it was held
+    subject = None if subject_filter == 'all' else subject_filter
+    total_classes, present_counts = ATTENDANCE_AGGREGATES.totals(subject)
+
     report = []
+    for s in all_students:
+        present = present_counts.get(s, 0)
+        report.append({'student': s, 'present_count': present, 'total_classes': total_classes, 'percentage': (present / total_classes * 100) if total_classes > 0 else 0})
 
-    if subject_filter == 'all':
-        total_days = len(record_files)
-        present_days_count = {student: 0 for student in all_students}
-        for file in record_files:
-            try:
-                df = pd.read_csv(file)
-                if 'Name' in df.columns:
-                    for student in df['Name'].unique():
-                        if student in present_days_count: present_days_count[student] += 1
-            except pd.errors.EmptyDataError: continue
-        for s in all_students:
-            present = present_days_count.get(s, 0)
-            report.append({'student': s, 'present_count': present, 'total_classes': total_days, 'percentage': (present / total_days * 100) if total_days > 0 else 0})
-    else:
-        total_subject_classes = 0
-        present_subject_count = {student: 0 for student in all_students}
-        for file in record_files:
-            try:
-                df = pd.read_csv(file)
-                if 'Subject' in df.columns and subject_filter in df['Subject'].unique():
-                    total_subject_classes += 1
-                    if 'Name' in df.columns:
-                        present_for_subject = df[df['Subject'] == subject_filter]['Name'].unique()
-                        for student in present_for_subject:
-                            if student in present_subject_count: present_subject_count[student] += 1
-            except (pd.errors.EmptyDataError, KeyError): continue
-        for s in all_students:
-            present = present_subject_count.get(s, 0)
-            report.append({'student': s, 'present_count': present, 'total_classes': total_subject_classes, 'percentage': (present / total_subject_classes * 100) if total_subject_classes > 0 else 0})
-            
     return jsonify({'report': report})
 
 # --- CORRECTED AND SELF-HEALING TIMETABLE FUNCTION ---
@@ -982,6 +1273,7 @@ def api_get_timetable():
         try:
             with open(TIMETABLE_FILE, 'w') as f:
                 json.dump(timetable, f, indent=4)
+            TIMETABLE.invalidate()
             app.logger.info("Timetable updated with new unique IDs for legacy slots.")
         except Exception as e:
             app.logger.error(f"Could not save updated timetable with new IDs: {e}")
@@ -994,15 +1286,7 @@ def api_get_current_subject():
 
 @app.route('/api/subjects', methods=['GET'])
 def api_get_subjects():
-    subjects = set()
-    if os.path.exists(TIMETABLE_FILE):
-        with open(TIMETABLE_FILE, 'r') as f:
-            try:
-                timetable = json.load(f)
-                for day in timetable.values():
-                    for slot in day: subjects.add(slot['subject'])
-            except json.JSONDecodeError: pass
-    return jsonify({'subjects': sorted(list(subjects))})
+    return jsonify({'subjects': TIMETABLE.subjects()})
 
 @app.route('/api/save_slot', methods=['POST'])
 def api_save_slot():
@@ -1054,6 +1338,7 @@ def api_save_slot():
     try:
         with open(TIMETABLE_FILE, 'w') as f:
             json.dump(timetable, f, indent=4)
+        TIMETABLE.invalidate()
         return jsonify({'success': True, 'message': message})
     except Exception as e:
         app.logger.error(f"Failed to save timetable: {e}")
@@ -1080,6 +1365,7 @@ def api_delete_slot():
         if len(timetable[day]) < original_length:
             with open(TIMETABLE_FILE, 'w') as f:
                 json.dump(timetable, f, indent=4)
+            TIMETABLE.invalidate()
             return jsonify({'success': True, 'message': 'Slot deleted.'})
 
     return jsonify({'success': False, 'message': 'Slot not found or already deleted.'})
@@ -1115,14 +1401,7 @@ def api_send_todays_email():
     try:
         subject_filter = request.form.get('subject')
         date_str = datetime.now().strftime("%Y-%m-%d")
-        file_path = os.path.join(ATTENDANCE_RECORDS_PATH, date_str, "attendance.csv")
-        
-        present_df = pd.DataFrame()
-        if os.path.exists(file_path):
-            try:
-                present_df = pd.read_csv(file_path)
-            except pd.errors.EmptyDataError:
-                pass
+        present_df = ATTENDANCE_STORE.day_records(date_str)
         
         if subject_filter == 'all_today':
             email_subject = f"Attendance Summary for {date_str}"
@@ -1153,68 +1432,10 @@ def _get_detailed_overall_report():
     all_students = get_all_students()
     if not all_students: return []
 
-    subjects = set()
-    if os.path.exists(TIMETABLE_FILE):
-        with open(TIMETABLE_FILE, 'r') as f:
-            try:
-                timetable = json.load(f)
-                for day in timetable.values():
-                    for slot in day: subjects.add(slot['subject'])
-            except json.JSONDecodeError: pass
-    all_subjects = sorted(list(subjects))
-
-    record_files = []
-    if os.path.exists(ATTENDANCE_RECORDS_PATH):
-        for date_folder in os.listdir(ATTENDANCE_RECORDS_PATH):
-            folder_path = os.path.join(ATTENDANCE_RECORDS_PATH, date_folder)
-            if os.path.isdir(folder_path):
-                csv_path = os.path.join(folder_path, "attendance.csv")
-                if os.path.exists(csv_path):
-                    record_files.append(csv_path)
-    
-    record_dfs = []
-    for file in record_files:
-        try:
-            record_dfs.append(pd.read_csv(file))
-        except pd.errors.EmptyDataError:
-            continue
-    
-    final_report = []
+    all_subjects = TIMETABLE.subjects()
 
-    for student in all_students:
-        student_report = {
-            "student_name": student,
-            "subject_breakdown": [],
-        }
-        
-        grand_total_present = 0
-        grand_total_classes = 0
-
-        if all_subjects:
-            for subject in all_subjects:
-                total_subject_classes = 0
-                present_subject_classes = 0
-                for df in record_dfs:
-                    if 'Subject' in df.columns and subject in df['Subject'].unique():
-                        total_subject_classes += 1
-                        if 'Name' in df.columns and not df[(df['Name'] == student) & (df['Subject'] == subject)].empty:
-                            present_subject_classes += 1
-                
-                # Add subject to breakdown regardless of whether classes were held, for consistency
-                student_report["subject_breakdown"].append({
-                    "subject": subject,
-                    "present": present_subject_classes,
-                    "total": total_subject_classes,
-                })
-                grand_total_present += present_subject_classes
-                grand_total_classes += total_subject_classes
-        
-        student_report["grand_total_present"] = grand_total_present
-        student_report["grand_total_classes"] = grand_total_classes
-            
-        final_report.append(student_report)
-        
-    return final_report
+    # One vectorised pass over every record instead of students x subjects x days
+    return build_detailed_report(ATTENDANCE_STORE.all_records(), all_students, all_subjects)
 
 # --- MODIFIED FUNCTION ---
 @app.route('/api/send_overall_email', methods=['POST'])
@@ -1249,7 +1470,7 @@ def api_send_overall_email():
         return jsonify({'success': False, 'message': f'An unexpected server error occurred: {e}'})
 
 def _send_email_logic(subject, content_generator):
-    """Handles the logic of connecting to Gmail and sending emails."""
+    """Checks the mail login, then sends the emails as a background job whose ID is returned for polling."""
     try:
         if not os.path.exists(SENDER_GMAIL_FILE) or not os.path.exists(STUDENT_EMAILS_FILE):
             return jsonify({'success': False, 'message': 'Sender or student emails not configured. Please set them up in the admin dashboard.'})
@@ -1263,14 +1484,7 @@ def _send_email_logic(subject, content_generator):
         if not SENDER_EMAIL or not SENDER_PASSWORD:
             return jsonify({'success': False, 'message': 'Sender credentials are incomplete.'})
 
-        server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-        try:
-            server.login(SENDER_EMAIL, SENDER_PASSWORD)
-        except smtplib.SMTPAuthenticationError:
-            return jsonify({'success': False, 'message': 'Gmail login failed. Check your email and App Password.'})
-
-        sent_count = 0
-        errors = []
+        messages = []
         for student_name, recipient_email in student_emails.items():
             if not recipient_email:
                 continue
@@ -1278,24 +1492,17 @@ def _send_email_logic(subject, content_generator):
             body = content_generator(student_name)
             if not body:
                 continue
-            
-            try:
-                msg = EmailMessage()
-                msg['Subject'] = subject
-                msg['From'] = SENDER_EMAIL
-                msg['To'] = recipient_email
-                msg.set_content(body)
-                server.send_message(msg)
-                sent_count += 1
-            except Exception as e:
-                errors.append(f"Could not send to {student_name} ({recipient_email}): {str(e)}")
-
-        server.quit()
-
-        if errors:
-            return jsonify({'success': False, 'message': f'Completed with errors. Sent {sent_count} emails. Failed: {", ".join(errors)}'})
-        
-        return jsonify({'success': True, 'message': f'Successfully sent {sent_count} emails.'})
+            messages.append((student_name, recipient_email, body))
+
+        # Log in once up front so a bad password is reported right away; the connection is reused by the job
+        pool = SmtpPool(SMTP_HOST, SMTP_PORT, SMTP_SECURITY, SENDER_EMAIL, SENDER_PASSWORD, size=EMAIL_SENDERS)
+        try:
+            pool.check()
+        except smtplib.SMTPAuthenticationError:
+            return jsonify({'success': False, 'message': 'Gmail login failed. Check your email and App Password.'})
+
+        job_id = EMAIL_JOBS.submit(subject, SENDER_EMAIL, messages, pool)
+        return jsonify({'success': True, 'job_id': job_id, 'message': f'Sending {len(messages)} emails in the background.'})
     
     except json.JSONDecodeError:
         return jsonify({'success': False, 'message': 'Error reading configuration file. Please re-save sender and student emails.'})
@@ -1303,6 +1510,89 @@ def _send_email_logic(subject, content_generator):
         app.logger.error(f"Critical error in _send_email_logic: {e}", exc_info=True)
         return jsonify({'success': False, 'message': f'A critical error occurred: {str(e)}'})
 
+@app.route('/api/email_job/<job_id>', methods=['GET'])
+def api_email_job(job_id):
+    """Progress and per-recipient status of a background email job."""
+    job = EMAIL_JOBS.get(job_id)
+    if job is None: return jsonify({'success': False, 'message': 'Email job not found.'}), 404
+    return jsonify({'success': True, 'job': job})
+
+# --- Maintenance Commands ---
+
+@app.cli.command('import-attendance')
+def import_attendance_command():
+    """One-shot import of the attendance_records CSV tree into the SQLite store."""
+    store = ATTENDANCE_STORE if isinstance(ATTENDANCE_STORE, SqliteAttendanceStore) else SqliteAttendanceStore(ATTENDANCE_DB_FILE, ATTENDANCE_FSYNC_POLICY)
+    inserted = store.import_csv_tree(ATTENDANCE_RECORDS_PATH)
+    print(f"Imported {inserted} attendance rows into {store.db_path}.")
+    # The running counts must cover the imported history too, or the overall report drifts from it
+    ATTENDANCE_AGGREGATES.rebuild(ATTENDANCE_STORE)
+    print(f"Rebuilt {ATTENDANCE_AGGREGATES.path}.")
+
+@app.cli.command('export-attendance')
+@click.argument('date_str')
+@click.argument('out_path', required=False)
+def export_attendance_command(date_str, out_path):
+    """Exports one day (YYYY-MM-DD) from the configured store in the attendance.csv format."""
+    out_path = out_path or f"attendance_{date_str}.csv"
+    ATTENDANCE_STORE.export_csv(date_str, out_path)
+    print(f"Wrote {out_path}.")
+
+@app.cli.command('rebuild-aggregates')
+def rebuild_aggregates_command():
+    """Recomputes the running attendance counts from the attendance store."""
+    ATTENDANCE_AGGREGATES.rebuild(ATTENDANCE_STORE)
+    print(f"Rebuilt {ATTENDANCE_AGGREGATES.path}.")
+
+@app.cli.command('compact-embeddings')
+@click.option('--dtype', type=click.Choice(['float32', 'float16', 'int8']), default=None, help='Storage type (default: EMBEDDING_PACKED_DTYPE).')
+def compact_embeddings_command(dtype):
+    """Packs every student's embeddings into one memory-mapped matrix shared by all workers."""
+    if dtype: FACE_INDEX.packed_dtype = dtype
+    students, rows = FACE_INDEX.compact()
+    print(f"Packed {rows} embeddings of {students} students as {FACE_INDEX.packed_dtype} in {FACE_INDEX.store_dir}.")
+
+@app.cli.command('embed-dataset')
+def embed_dataset_command():
+    """Embeds every student not yet in the embeddings store, so 1:N identification covers everyone."""
+    for folder in STUDENT_REGISTRY.folders():
+        if '-' in folder: FACE_INDEX.gallery(folder.split('-', 1)[0], folder)
+    print(f"Embeddings store covers {sum(1 for _ in FACE_INDEX.stored_entries())} students.")
+
+@app.cli.command('embed-twins')
+def embed_twins_command():
+    """Embeds the galleries of every twin under each model in TWIN_MODELS, so verification never has to."""
+    members = [(student_id, find_folder_by_id(student_id)) for pair in load_twins().values() for student_id in pair]
+    members = [(student_id, folder) for student_id, folder in members if folder]
+    TWIN_VERIFIER.precompute(members)
+    print(f"Embedded {len(members)} twins with {', '.join(TWIN_MODELS)}.")
+
+@app.cli.command('prune-galleries')
+@click.option('--max-images', type=int, default=None, help='Images to keep per student (default: GALLERY_MAX_IMAGES).')
+@click.option('--dry-run', is_flag=True, help='Only report what would be removed.')
+def prune_galleries_command(max_images, dry_run):
+    """Shrinks oversized galleries to their most diverse images; enrolment photos are always kept."""
+    total = 0
+    for folder in STUDENT_REGISTRY.folders():
+        if '-' not in folder: continue
+        evicted = GALLERY.prune(folder.split('-', 1)[0], folder, max_images, dry_run)
+        if evicted: print(f"{folder}: {'would remove' if dry_run else 'removed'} {len(evicted)} image(s).")
+        total += len(evicted)
+    print(f"{'Would remove' if dry_run else 'Removed'} {total} image(s) in total.")
+
+# --- Process Startup ---
+# Runs on import so gunicorn workers (and a --preload master) start with the index in memory
+FACE_INDEX.load()
+TWIN_VERIFIER.load()
+ATTENDANCE_STORE.load()
+ATTENDANCE_AGGREGATES.load(ATTENDANCE_STORE)
+EMAIL_JOBS.recover()  # Jobs left 'running' by a worker that was recycled or killed
+atexit.register(IMAGE_WRITER.close)  # Flush queued proof images on a graceful shutdown
+if IDENTIFY_ENABLED:
+    IDENTITY_INDEX.sync(force=True)
+if WARMUP_MODELS_ON_STARTUP and not INFERENCE_SOCKET:
+    warm_up(recognition_model=FACE_INDEX.model_name, detector_backend=DETECTOR_BACKEND, extra_models=TWIN_MODELS)
+
 # --- Main Entry Point ---
 if __name__ == '__main__':
     os.makedirs(DATASET_PATH, exist_ok=True)
@@ -0,0 +1,416 @@
+"""Attendance record storage engines.
+
+Two interchangeable engines implement the same methods (``mark``,
+``rename_student``, ``day_records``, ``all_records``, ``count_days``,
+``present_days``, ``export_csv``), and every report endpoint queries
+through them:
+
+``CsvAttendanceStore`` keeps the existing ``attendance_records/<date>/attendance.csv``
+layout but only ever appends to it. Duplicate checks use an in-memory set of
+(date, student, subject) keys; before each append the writer takes an flock
+on the day's lock file and reads just the bytes other processes appended
+since it last looked, so a mark costs O(1) and is safe across gunicorn
+workers. Its queries scan the day files, as the app always has.
+
+``SqliteAttendanceStore`` keeps every row in one SQLite database in WAL mode,
+indexed on date, subject and student, so reports no longer parse hundreds of
+files. ``import_csv_tree`` loads an existing ``attendance_records`` tree into
+it, and ``export_csv`` writes a day back out in the CSV format above.
+
+``AttendanceAggregates`` keeps running present / classes-held counts next to
+the records so the overall report does not have to recompute them.
+"""
+import csv
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from file_locks import atomic_write_bytes, locked
+
+COLUMNS = ["Name", "Time", "Subject"]
+CSV_FILE_NAME = "attendance.csv"
+LOCK_FILE_NAME = ".attendance.lock"
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class CsvAttendanceStore:
+    """Append-only, process-safe writer for the per-day attendance CSV files."""
+
+    def __init__(self, records_path, fsync_policy='always', fsync_interval=1.0):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync_policy must be one of {FSYNC_POLICIES}")
+        self.records_path = records_path
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self._days = {}  # date_str -> {'keys': set, 'offset': int, 'inode': int, 'columns': dict}
+        self._last_fsync = 0.0
+        self._lock = threading.Lock()
+
+    def _paths(self, date_str):
+        folder = os.path.join(self.records_path, date_str)
+        return folder, os.path.join(folder, CSV_FILE_NAME), os.path.join(folder, LOCK_FILE_NAME)
+
+    def _catch_up(self, date_str, f):
+        """Parses whatever was appended to the open day file since this process last read it."""
+        stat = os.fstat(f.fileno())
+        day = self._days.get(date_str)
+        if day is None or day['inode'] != stat.st_ino or stat.st_size < day['offset']:
+            day = {'keys': set(), 'offset': 0, 'inode': stat.st_ino, 'columns': None}  # New or rewritten file
+            self._days[date_str] = day
+        if stat.st_size == day['offset']:
+            return day
+
+        f.seek(day['offset'])
+        chunk = f.read()
+        day['offset'] += len(chunk)
+        for row in csv.reader(io.StringIO(chunk.decode('utf-8'))):
+            if not row: continue
+            if day['columns'] is None:
+                day['columns'] = {name: i for i, name in enumerate(row)}
+                continue
+            try:
+                day['keys'].add((row[day['columns']['Name']], row[day['columns']['Subject']]))
+            except (KeyError, IndexError):
+                continue
+        return day
+
+    def _fsync(self, f):
+        if self.fsync_policy == 'never': return
+        now = time.monotonic()
+        if self.fsync_policy == 'interval' and now - self._last_fsync < self.fsync_interval: return
+        os.fsync(f.fileno())
+        self._last_fsync = now
+
+    def load(self, date_str=None):
+        """Rebuilds the duplicate-check keys for a day (today by default) from its file."""
+        date_str = date_str or datetime.now().strftime("%Y-%m-%d")
+        folder, csv_path, lock_path = self._paths(date_str)
+        if not os.path.exists(csv_path): return
+        with locked(lock_path, shared=True), open(csv_path, 'rb') as f, self._lock:
+            self._catch_up(date_str, f)
+
+    def mark(self, name, subject, now=None):
+        """Appends one attendance row; returns False if the student is already marked for the subject that day."""
+        now = now or datetime.now()
+        date_str = now.strftime("%Y-%m-%d")
+        folder, csv_path, lock_path = self._paths(date_str)
+        os.makedirs(folder, exist_ok=True)
+        with locked(lock_path), open(csv_path, 'a+b') as f, self._lock:
+            day = self._catch_up(date_str, f)
+            if (name, subject) in day['keys']:
+                return False # Already marked
+
+            out = io.StringIO()
+            writer = csv.writer(out, lineterminator='\n')
+            if day['offset'] == 0:
+                writer.writerow(COLUMNS)
+                day['columns'] = {c: i for i, c in enumerate(COLUMNS)}
+            writer.writerow([name, now.strftime("%H:%M:%S"), subject])
+            data = out.getvalue().encode('utf-8')
+            f.write(data)
+            f.flush()
+            self._fsync(f)
+            day['offset'] += len(data)
+            day['keys'].add((name, subject))
+            return True
+
+    def is_marked(self, name, subject, now=None):
+        """Whether the student is already marked for the subject that day."""
+        date_str = (now or datetime.now()).strftime("%Y-%m-%d")
+        folder, csv_path, lock_path = self._paths(date_str)
+        if not os.path.exists(csv_path): return False
+        with locked(lock_path, shared=True), open(csv_path, 'rb') as f, self._lock:
+            return (name, subject) in self._catch_up(date_str, f)['keys']
+
+    def rename_student(self, old_name, new_name):
+        """Rewrites every day file that mentions old_name; each rewrite is atomic and holds that day's lock."""
+        if not os.path.exists(self.records_path): return
+        for date_str in os.listdir(self.records_path):
+            folder, csv_path, lock_path = self._paths(date_str)
+            if not os.path.isfile(csv_path): continue
+            with locked(lock_path):
+                with open(csv_path, newline='', encoding='utf-8') as f:
+                    rows = list(csv.reader(f))
+                if not rows or 'Name' not in rows[0]: continue
+                name_col = rows[0].index('Name')
+                if not any(len(r) > name_col and r[name_col] == old_name for r in rows[1:]): continue
+                for r in rows[1:]:
+                    if len(r) > name_col and r[name_col] == old_name: r[name_col] = new_name
+                tmp_path = f"{csv_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+                    csv.writer(f, lineterminator='\n').writerows(rows)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, csv_path)  # New inode, so every process re-reads this day
+                with self._lock:
+                    self._days.pop(date_str, None)
+
+    # --- Queries ---
+
+    def _day_files(self):
+        if not os.path.exists(self.records_path): return []
+        day_files = []
+        for date_str in sorted(os.listdir(self.records_path)):
+            csv_path = os.path.join(self.records_path, date_str, CSV_FILE_NAME)
+            if os.path.isfile(csv_path):
+                day_files.append((date_str, csv_path))
+        return day_files
+
+    @staticmethod
+    def _read_day(csv_path):
+        try:
+            df = pd.read_csv(csv_path, dtype=str)
+        except (pd.errors.EmptyDataError, FileNotFoundError):
+            return pd.DataFrame(columns=COLUMNS)
+        return df if set(COLUMNS) <= set(df.columns) else pd.DataFrame(columns=COLUMNS)
+
+    def day_records(self, date_str, subject=None):
+        """Rows (Name, Time, Subject) for one day, optionally for one subject."""
+        df = self._read_day(os.path.join(self.records_path, date_str, CSV_FILE_NAME))
+        return df[df['Subject'] == subject] if subject else df
+
+    def all_records(self):
+        """Every row, with a Date column added."""
+        frames = [self._read_day(path).assign(Date=date_str) for date_str, path in self._day_files()]
+        frames = [f for f in frames if not f.empty]
+        if not frames: return pd.DataFrame(columns=["Date"] + COLUMNS)
+        return pd.concat(frames, ignore_index=True)[["Date"] + COLUMNS]
+
+    def count_days(self, subject=None):
+        """Days with a record file, or days on which the subject was held."""
+        if subject is None: return len(self._day_files())
+        return sum(1 for _, path in self._day_files() if subject in self._read_day(path)['Subject'].values)
+
+    def present_days(self, subject=None):
+        """Number of days each student was present (for the subject, if given)."""
+        counts = {}
+        for _, path in self._day_files():
+            df = self._read_day(path)
+            if subject: df = df[df['Subject'] == subject]
+            for name in df['Name'].unique():
+                counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def export_csv(self, date_str, out_path):
+        """Writes one day's records in the attendance.csv format."""
+        self.day_records(date_str).to_csv(out_path, index=False, columns=COLUMNS)
+
+
+class SqliteAttendanceStore:
+    """Attendance rows in one indexed SQLite database in WAL mode, shared by every worker."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS attendance (
+            date TEXT NOT NULL,
+            name TEXT NOT NULL,
+            time TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            UNIQUE (date, name, subject)
+        );
+        CREATE INDEX IF NOT EXISTS idx_attendance_subject_date ON attendance (subject, date);
+        CREATE INDEX IF NOT EXISTS idx_attendance_name ON attendance (name);
+    """
+    SYNCHRONOUS = {'always': 'FULL', 'interval': 'NORMAL', 'never': 'OFF'}
+
+    def __init__(self, db_path, fsync_policy='always'):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync_policy must be one of {FSYNC_POLICIES}")
+        self.db_path = db_path
+        self.fsync_policy = fsync_policy
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():  # Connections must not cross a fork
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.SYNCHRONOUS[self.fsync_policy]}")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def load(self):
+        self._conn().executescript(self.SCHEMA)
+
+    def mark(self, name, subject, now=None):
+        """Inserts one attendance row; returns False if the student is already marked for the subject that day."""
+        now = now or datetime.now()
+        cursor = self._conn().execute("INSERT OR IGNORE INTO attendance (date, name, time, subject) VALUES (?, ?, ?, ?)",
+                                      (now.strftime("%Y-%m-%d"), name, now.strftime("%H:%M:%S"), subject))
+        return cursor.rowcount == 1
+
+    def is_marked(self, name, subject, now=None):
+        row = self._conn().execute("SELECT 1 FROM attendance WHERE date = ? AND name = ? AND subject = ?",
+                                   ((now or datetime.now()).strftime("%Y-%m-%d"), name, subject)).fetchone()
+        return row is not None
+
+    def rename_student(self, old_name, new_name):
+        self._conn().execute("UPDATE OR REPLACE attendance SET name = ? WHERE name = ?", (new_name, old_name))
+
+    def _frame(self, sql, params=()):
+        rows = self._conn().execute(sql, params).fetchall()
+        return pd.DataFrame(rows, columns=["Date"] + COLUMNS)
+
+    def day_records(self, date_str, subject=None):
+        sql = "SELECT date, name, time, subject FROM attendance WHERE date = ?"
+        params = (date_str,)
+        if subject:
+            sql += " AND subject = ?"
+            params += (subject,)
+        return self._frame(sql + " ORDER BY rowid", params)[COLUMNS]
+
+    def all_records(self):
+        return self._frame("SELECT date, name, time, subject FROM attendance ORDER BY date, rowid")
+
+    def count_days(self, subject=None):
+        if subject is None:
+            return self._conn().execute("SELECT COUNT(DISTINCT date) FROM attendance").fetchone()[0]
+        return self._conn().execute("SELECT COUNT(DISTINCT date) FROM attendance WHERE subject = ?", (subject,)).fetchone()[0]
+
+    def present_days(self, subject=None):
+        if subject is None:
+            rows = self._conn().execute("SELECT name, COUNT(DISTINCT date) FROM attendance GROUP BY name")
+        else:
+            rows = self._conn().execute("SELECT name, COUNT(DISTINCT date) FROM attendance WHERE subject = ? GROUP BY name", (subject,))
+        return dict(rows.fetchall())
+
+    def export_csv(self, date_str, out_path):
+        self.day_records(date_str).to_csv(out_path, index=False, columns=COLUMNS)
+
+    def import_csv_tree(self, records_path):
+        """One-shot import of an attendance_records/<date>/attendance.csv tree; returns rows inserted."""
+        self.load()
+        conn = self._conn()
+        inserted = 0
+        conn.execute("BEGIN")
+        try:
+            for date_str, csv_path in CsvAttendanceStore(records_path)._day_files():
+                df = CsvAttendanceStore._read_day(csv_path).fillna('')
+                cursor = conn.executemany("INSERT OR IGNORE INTO attendance (date, name, time, subject) VALUES (?, ?, ?, ?)",
+                                          [(date_str, r.Name, r.Time, r.Subject) for r in df.itertuples(index=False)])
+                inserted += max(cursor.rowcount, 0)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return inserted
+
+
+def create_attendance_store(engine, records_path, db_path, fsync_policy='always', fsync_interval=1.0):
+    """Builds the configured storage engine: 'csv' or 'sqlite'."""
+    if engine == 'csv':
+        return CsvAttendanceStore(records_path, fsync_policy, fsync_interval)
+    if engine == 'sqlite':
+        return SqliteAttendanceStore(db_path, fsync_policy)
+    raise ValueError(f"Unknown attendance storage engine: {engine}")
+
+
+class AttendanceAggregates:
+    """Running attendance counts persisted next to the records.
+
+    Keeps the number of days with records, the days each subject was held,
+    and the days each student was present overall and per subject. Every
+    successful mark updates the counts under an flock, so report endpoints
+    read O(students) numbers instead of rescanning every day. ``rebuild``
+    recomputes everything from the store if the file is lost or drifts.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self._lock_path = path + '.lock'
+        self._data = self._empty()
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _empty(cls):
+        return {'version': cls.FORMAT_VERSION, 'days': 0, 'present': {}, 'held': {}, 'subject_present': {},
+                'today': {'date': None, 'subjects': [], 'students': []}}
+
+    def _refresh(self):
+        """Re-reads the file if another process has rewritten it."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime: return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return
+        if data.get('version') == self.FORMAT_VERSION:
+            self._data, self._mtime = data, mtime
+
+    def _save(self):
+        atomic_write_bytes(self.path, json.dumps(self._data).encode('utf-8'))
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def load(self, store):
+        """Loads the persisted counts, rebuilding them from the store if there are none yet."""
+        if os.path.exists(self.path):
+            with self._lock: self._refresh()
+        else:
+            self.rebuild(store)
+
+    def record(self, name, subject, date_str):
+        """Folds one newly inserted (date, name, subject) row into the counts."""
+        with locked(self._lock_path), self._lock:
+            self._refresh()
+            data, today = self._data, self._data['today']
+            if today['date'] != date_str:
+                data['days'] += 1
+                today.update(date=date_str, subjects=[], students=[])
+            if subject not in today['subjects']:
+                today['subjects'].append(subject)
+                data['held'][subject] = data['held'].get(subject, 0) + 1
+            if name not in today['students']:
+                today['students'].append(name)
+                data['present'][name] = data['present'].get(name, 0) + 1
+            per_subject = data['subject_present'].setdefault(subject, {})
+            per_subject[name] = per_subject.get(name, 0) + 1
+            self._save()
+
+    def rename_student(self, old_name, new_name):
+        with locked(self._lock_path), self._lock:
+            self._refresh()
+            data = self._data
+            counts = [data['present']] + list(data['subject_present'].values())
+            for c in counts:
+                if old_name in c: c[new_name] = c.get(new_name, 0) + c.pop(old_name)
+            data['today']['students'] = [new_name if s == old_name else s for s in data['today']['students']]
+            self._save()
+
+    def totals(self, subject=None):
+        """(classes held, {student: days present}) overall or for one subject."""
+        with self._lock:
+            self._refresh()
+            if subject is None:
+                return self._data['days'], dict(self._data['present'])
+            return self._data['held'].get(subject, 0), dict(self._data['subject_present'].get(subject, {}))
+
+    def rebuild(self, store):
+        """Recomputes every count from the attendance store."""
+        records = store.all_records()
+        today_str = datetime.now().strftime("%Y-%m-%d")
+        data = self._empty()
+        data['days'] = store.count_days()
+        data['held'] = {str(k): int(v) for k, v in records.groupby('Subject')['Date'].nunique().items()}
+        data['present'] = {str(k): int(v) for k, v in records.groupby('Name')['Date'].nunique().items()}
+        for (subject, name), days in records.groupby(['Subject', 'Name'])['Date'].nunique().items():
+            data['subject_present'].setdefault(str(subject), {})[str(name)] = int(days)
+        today_records = records[records['Date'] == today_str]
+        if not today_records.empty:
+            data['today'] = {'date': today_str, 'subjects': sorted(today_records['Subject'].unique().tolist()),
+                             'students': sorted(today_records['Name'].unique().tolist())}
+        with locked(self._lock_path), self._lock:
+            self._data = data
+            self._save()
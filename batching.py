@@ -0,0 +1,106 @@
+"""Micro-batching scheduler for model inference.
+
+Concurrent requests in one worker process (threaded Flask or gunicorn
+``gthread`` workers) submit single face crops; a background thread collects
+them until ``max_batch_size`` items are pending or ``max_wait_ms`` has passed
+since the first one arrived, runs one batched forward pass and hands each
+result back to the request waiting for it. An item that finds the queue
+otherwise empty is run at once instead of waiting out the window; under load,
+items queue up behind the running pass and form the next batch.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64]
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+DEFAULT_TIMEOUT_SECONDS = 60  # A request never waits longer than this for its result
+
+
+class MicroBatcher:
+    """Runs batch_fn over batches of submitted items.
+
+    batch_fn receives a list of items and returns a list of the same length;
+    an element that is an Exception is raised in the matching request only.
+    """
+
+    def __init__(self, name, batch_fn, max_batch_size=16, max_wait_ms=20, enabled=True):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.enabled = enabled
+        self.batch_size = Histogram(f"{name}_batch_size", f"Items per {name} forward pass", BATCH_SIZE_BUCKETS)
+        self.queue_wait = Histogram(f"{name}_queue_wait_seconds", f"Time a {name} item waited for its batch", LATENCY_BUCKETS)
+        self.batch_latency = Histogram(f"{name}_batch_seconds", f"Duration of one {name} forward pass", LATENCY_BUCKETS)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so a gunicorn --preload worker starts its own
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid(): return
+        with self._start_lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid(): return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name=f"{self.name}-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, item):
+        """Queues one item and returns a Future for its result."""
+        future = Future()
+        if not self.enabled:
+            self._run([(item, future, time.perf_counter())])
+            return future
+        self._ensure_thread()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def run(self, item, timeout=DEFAULT_TIMEOUT_SECONDS):
+        """Submits one item and waits for its result; raises TimeoutError after timeout seconds."""
+        return self.submit(item).result(timeout=timeout)
+
+    def _loop(self):
+        while True:
+            pending = [self._queue.get()]
+            if self._queue.empty():
+                self._run(pending)  # Nobody else is waiting: don't hold a lone request for the window
+                continue
+            deadline = time.perf_counter() + self.max_wait
+            while len(pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0: break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run(pending)
+
+    def _run(self, pending):
+        started = time.perf_counter()
+        for _, _, queued_at in pending:
+            self.queue_wait.observe(started - queued_at)
+        self.batch_size.observe(len(pending))
+        try:
+            results = self.batch_fn([item for item, _, _ in pending])
+        except Exception as e:
+            logger.error(f"{self.name} batch of {len(pending)} failed: {e}", exc_info=True)
+            results = [e] * len(pending)
+        self.batch_latency.observe(time.perf_counter() - started)
+        if not isinstance(results, (list, tuple)) or len(results) != len(pending):
+            logger.error(f"{self.name} batch of {len(pending)} returned {len(results) if isinstance(results, (list, tuple)) else type(results).__name__} results")
+            results = [RuntimeError(f"{self.name} batch returned a result count that does not match its inputs")] * len(pending)
+        for (_, future, _), result in zip(pending, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,191 @@
+"""Benchmark: latency and throughput of the app's hot paths on a synthetic workspace.
+
+Generates N students, M days of attendance, K subjects and a timetable in a
+temporary directory (see ``synthetic.py``), imports the app there with the
+deterministic DeepFace stub from ``benchmarks/stub_deepface`` and times:
+
+* precheck               POST /api/precheck, the location / ID / already-marked check before the upload
+* mark_attendance        POST /api/mark_attendance with a 640x480 JPEG frame (a new subject each call, so every call marks)
+* get_all_students       the student list behind every admin view
+* get_current_subject    the timetable lookup
+* overall_attendance     GET /api/overall_attendance
+* detailed_report        _get_detailed_overall_report, used by the overall email
+* quality_gate           the exposure and sharpness checks on a 640x480 frame
+* liveness               the smile check on a face crop (smile cascade, then the emotion model if unclear)
+* decode_frame           decoding a 1280x720 upload (binary path)
+* decode_frame_base64    the same frame posted as a base64 data URL (JSON path)
+
+The synthetic faces are patterns that no face or smile detector finds, so the
+quality gate's face checks and the liveness fast-path rejection are switched
+off for the whole run (unclear frames still go through the smile cascade).
+
+Each reports throughput and p50/p90/p99 latency. --save-baseline writes the
+results to JSON; --baseline compares a run against such a file and exits
+with status 1 if any median got more than --tolerance slower.
+
+Usage: python benchmarks/bench_app.py [--students 200] [--days 60] [--subjects 8] [--iterations 200]
+                                      [--only NAME ...] [--save-baseline FILE] [--baseline FILE] [--tolerance 0.2]
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import secrets
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+import synthetic  # noqa: E402
+
+FRAME_SIZE = (640, 480)
+UPLOAD_SIZE = (1280, 720)
+
+
+def percentile_summary(samples):
+    samples = np.asarray(samples)
+    return {'iterations': int(samples.size), 'throughput_per_s': float(samples.size / samples.sum()), 'mean_ms': float(samples.mean() * 1000),
+            'p50_ms': float(np.percentile(samples, 50) * 1000), 'p90_ms': float(np.percentile(samples, 90) * 1000),
+            'p99_ms': float(np.percentile(samples, 99) * 1000), 'max_ms': float(samples.max() * 1000)}
+
+
+def measure(fn, iterations, warmup, prepare=None):
+    """Per-call wall times of fn(prepare(i)) (or fn()), after warmup untimed calls."""
+    samples = []
+    for i in range(warmup + iterations):
+        arg = prepare(i) if prepare else None
+        started = time.perf_counter()
+        result = fn(arg) if prepare else fn()
+        elapsed = time.perf_counter() - started
+        if i >= warmup: samples.append(elapsed)
+    return samples, result
+
+
+def benchmarks(app_module, folders):
+    """name -> (fn, prepare) for every benchmark; prepare(i) builds the untimed input of call i."""
+    client = app_module.app.test_client()
+    n_students = len(folders)
+    frames = {}
+
+    def precheck_input(i):
+        return {'latitude': 0.0, 'longitude': 0.0, 'student_id': folders[i % n_students].split('-', 1)[0]}
+
+    def mark_input(i):
+        index = i % n_students
+        if index not in frames:
+            frames[index] = synthetic.encode_jpeg(synthetic.face_image(index, *FRAME_SIZE, shot=1000))
+        session_id = f"bench-{i}"
+        app_module.ATTENDANCE_SESSIONS.put(session_id, {'admin_location': (0.0, 0.0), 'subject': f"Bench {i}",
+                                                        'expires_at': datetime.now() + timedelta(minutes=30)})
+        precheck = client.post(f'/api/precheck/{session_id}', json=precheck_input(i)).get_json()
+        if not precheck.get('token'): raise RuntimeError(f"precheck failed: {precheck}")
+        return session_id, {'image': (io.BytesIO(frames[index]), 'frame.jpg'), 'token': precheck['token']}
+
+    def mark(arg):
+        session_id, form = arg
+        result = client.post(f'/api/mark_attendance/{session_id}', data=form, content_type='multipart/form-data').get_json()
+        if not result.get('success'): raise RuntimeError(f"mark_attendance failed: {result}")
+        return result
+
+    frame = synthetic.face_image(0, *FRAME_SIZE)
+    upload = synthetic.encode_jpeg(synthetic.face_image(0, *UPLOAD_SIZE))
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(upload).decode()
+    app_module.ATTENDANCE_SESSIONS.put('bench-precheck', {'admin_location': (0.0, 0.0), 'subject': "Bench precheck",
+                                                          'expires_at': datetime.now() + timedelta(minutes=30)})
+    return {
+        'precheck': (lambda arg: client.post('/api/precheck/bench-precheck', json=arg).get_json(), precheck_input),
+        'mark_attendance': (mark, mark_input),
+        'get_all_students': (app_module.get_all_students, None),
+        'get_current_subject': (app_module.get_current_subject, None),
+        'overall_attendance': (lambda: client.get('/api/overall_attendance').get_json(), None),
+        'detailed_report': (app_module._get_detailed_overall_report, None),
+        'quality_gate': (lambda: app_module.QUALITY_GATE.check(frame), None),
+        'liveness': (lambda: app_module.LIVENESS.check(frame), None),
+        'decode_frame': (lambda: app_module.decode_frame(upload, app_module.DECODE_MIN_DIMENSION), None),
+        'decode_frame_base64': (lambda: app_module.decode_frame(base64.b64decode(data_url.split(',')[1]), app_module.DECODE_MIN_DIMENSION), None),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Prints median changes against a baseline; returns the names that regressed."""
+    if baseline.get('params') != results['params']:
+        print(f"Note: baseline was recorded with {baseline.get('params')}, this run uses {results['params']}.")
+    regressions = []
+    for name, current in results['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if not previous: continue
+        change = current['p50_ms'] / previous['p50_ms'] - 1 if previous['p50_ms'] else 0.0
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:>22}: p50 {previous['p50_ms']:9.3f} -> {current['p50_ms']:9.3f} ms ({change:+.0%})  "
+              f"p99 {previous['p99_ms']:9.3f} -> {current['p99_ms']:9.3f} ms{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--subjects', type=int, default=8)
+    parser.add_argument('--images', type=int, default=3, help="Enrolment photos per student")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--only', nargs='+', metavar='NAME', help="Run only these benchmarks")
+    parser.add_argument('--workdir', help="Generate the workspace here instead of a temporary directory")
+    parser.add_argument('--real-deepface', action='store_true', help="Use the installed DeepFace instead of the stub")
+    parser.add_argument('--save-baseline', metavar='FILE')
+    parser.add_argument('--baseline', metavar='FILE', help="Compare against a saved baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed median slowdown before a benchmark counts as a regression")
+    args = parser.parse_args()
+
+    # Resolved now, because the working directory changes below
+    save_path, baseline_path = [os.path.abspath(p) if p else None for p in (args.save_baseline, args.baseline)]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="attendance-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    folders, _ = synthetic.generate(workdir, args.students, args.days, args.subjects, args.images)
+    print(f"Workspace {workdir}: {args.students} students, {args.days} days, {args.subjects} subjects")
+
+    # The app resolves its data paths against the working directory when it is imported
+    os.chdir(workdir)
+    if not args.real_deepface:
+        sys.path.insert(0, os.path.join(BENCH_DIR, 'stub_deepface'))
+    os.environ.setdefault('SECRET_KEY', secrets.token_hex(32))
+    import app as app_module
+    app_module.QUALITY_GATE.check_faces = False
+    app_module.LIVENESS.reject_score = 0
+
+    params = {'students': args.students, 'days': args.days, 'subjects': args.subjects, 'images': args.images, 'real_deepface': args.real_deepface}
+    results = {'params': params, 'created_at': datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'machine': platform.machine(), 'benchmarks': {}}
+    selected = benchmarks(app_module, folders)
+    for name, (fn, prepare) in selected.items():
+        if args.only and name not in args.only: continue
+        samples, _ = measure(fn, args.iterations, args.warmup, prepare)
+        summary = percentile_summary(samples)
+        results['benchmarks'][name] = summary
+        print(f"{name:>22}: {summary['throughput_per_s']:10.1f}/s  p50 {summary['p50_ms']:9.3f} ms  "
+              f"p90 {summary['p90_ms']:9.3f} ms  p99 {summary['p99_ms']:9.3f} ms")
+    app_module.IMAGE_WRITER.flush()
+
+    if save_path:
+        with open(save_path, 'w') as f: json.dump(results, f, indent=2)
+        print(f"Saved baseline to {save_path}")
+    if baseline_path:
+        with open(baseline_path) as f: baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Slower than the baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark: vectorised detailed report vs. the original per-student loop.
+
+Usage: python benchmarks/bench_detailed_report.py [--students 500] [--subjects 12] [--days 150]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from reports import build_detailed_report  # noqa: E402
+
+
+def synthetic_records(n_students, n_subjects, n_days, attendance_rate=0.8, seed=0):
+    """One row per (day, subject held that day, present student), like the dated CSV files."""
+    rng = np.random.default_rng(seed)
+    students = [f"Student {i:04d}" for i in range(n_students)]
+    subjects = [f"Subject {i:02d}" for i in range(n_subjects)]
+    frames = []
+    for day in range(n_days):
+        date_str = (pd.Timestamp("2025-01-01") + pd.Timedelta(days=day)).strftime("%Y-%m-%d")
+        for subject in rng.choice(subjects, size=max(1, n_subjects // 3), replace=False):
+            present = [s for s in students if rng.random() < attendance_rate]
+            frames.append(pd.DataFrame({"Date": date_str, "Name": present, "Time": "09:00:00", "Subject": subject}))
+    return pd.concat(frames, ignore_index=True), students, subjects
+
+
+def legacy_detailed_report(record_dfs, all_students, all_subjects):
+    """The original students x subjects x days implementation, kept for comparison."""
+    final_report = []
+    for student in all_students:
+        student_report = {"student_name": student, "subject_breakdown": []}
+        grand_total_present = 0
+        grand_total_classes = 0
+        if all_subjects:
+            for subject in all_subjects:
+                total_subject_classes = 0
+                present_subject_classes = 0
+                for df in record_dfs:
+                    if 'Subject' in df.columns and subject in df['Subject'].unique():
+                        total_subject_classes += 1
+                        if 'Name' in df.columns and not df[(df['Name'] == student) & (df['Subject'] == subject)].empty:
+                            present_subject_classes += 1
+                student_report["subject_breakdown"].append({"subject": subject, "present": present_subject_classes, "total": total_subject_classes})
+                grand_total_present += present_subject_classes
+                grand_total_classes += total_subject_classes
+        student_report["grand_total_present"] = grand_total_present
+        student_report["grand_total_classes"] = grand_total_classes
+        final_report.append(student_report)
+    return final_report
+
+
+def timed(fn, repeat):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=500)
+    parser.add_argument('--subjects', type=int, default=12)
+    parser.add_argument('--days', type=int, default=150)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-legacy', action='store_true', help="Only time the vectorised engine")
+    args = parser.parse_args()
+
+    records, students, subjects = synthetic_records(args.students, args.subjects, args.days)
+    print(f"{len(records)} records: {args.students} students, {args.subjects} subjects, {args.days} days")
+
+    new_time, new_report = timed(lambda: build_detailed_report(records, students, subjects), args.repeat)
+    print(f"vectorised: {new_time * 1000:.1f} ms")
+    if args.skip_legacy: return
+
+    record_dfs = [day_df for _, day_df in records.groupby('Date')]
+    legacy_time, legacy_report = timed(lambda: legacy_detailed_report(record_dfs, students, subjects), 1)
+    print(f"legacy:     {legacy_time * 1000:.1f} ms  ({legacy_time / new_time:.0f}x slower)")
+    assert legacy_report == new_report, "Reports differ"
+    print("Reports are identical.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Benchmark: accuracy and size of float16 / int8 packed embeddings vs. float32.
+
+Reads every student's gallery from the embeddings store (or generates
+synthetic clusters when the store is empty), quantizes it the way
+``FaceIndex.compact`` does and, with each image in turn as the probe, compares
+against the float32 results:
+
+* distance error between the probe and every other image;
+* rank-1 identification: does the nearest other image still belong to the
+  probe's student;
+* verification: does the accept / reject decision at the threshold change,
+  for the probe against its own student and against the closest other student.
+
+Usage: python benchmarks/bench_embedding_quantization.py [--store embeddings] [--model VGG-Face] [--threshold 0.4]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_index import FaceIndex, dequantize, l2_normalize, quantize  # noqa: E402
+
+
+def stored_gallery(store_path, model_name):
+    """(matrix, labels) of every embedding in the store."""
+    index = FaceIndex(dataset_path='', store_path=store_path, model_name=model_name)
+    blocks, labels = [], []
+    for student_id, entry in index.stored_entries():
+        if entry['matrix'].shape[0]:
+            blocks.append(np.asarray(entry['matrix'], dtype=np.float32))
+            labels += [student_id] * entry['matrix'].shape[0]
+    return (np.vstack(blocks), np.array(labels)) if blocks else (None, None)
+
+
+def synthetic_gallery(n_students, images_per_student, dim, spread=0.6, seed=0):
+    """Clusters of unit vectors standing in for real embeddings."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(n_students, dim))
+    matrix = np.repeat(centres, images_per_student, axis=0) + spread * rng.normal(size=(n_students * images_per_student, dim))
+    return l2_normalize(matrix), np.repeat(np.arange(n_students).astype(str), images_per_student)
+
+
+def evaluate(reference, candidate, labels, probes, threshold):
+    stats = {'max_abs_error': 0.0, 'sum_abs_error': 0.0, 'pairs': 0, 'rank1_ref': 0, 'rank1': 0, 'decisions_changed': 0, 'decisions': 0}
+    for p in probes:
+        ref = 1.0 - reference @ reference[p]
+        got = 1.0 - candidate @ candidate[p]
+        ref[p] = got[p] = np.inf
+        finite = np.isfinite(ref)
+        error = np.abs(ref[finite] - got[finite])
+        stats['max_abs_error'] = max(stats['max_abs_error'], float(error.max()))
+        stats['sum_abs_error'] += float(error.sum())
+        stats['pairs'] += int(error.size)
+        stats['rank1_ref'] += labels[int(np.argmin(ref))] == labels[p]
+        stats['rank1'] += labels[int(np.argmin(got))] == labels[p]
+        same = labels == labels[p]
+        for mask in (same, ~same):
+            if mask.any() and np.isfinite(ref[mask]).any():
+                stats['decisions'] += 1
+                stats['decisions_changed'] += (ref[mask].min() <= threshold) != (got[mask].min() <= threshold)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--store', default='embeddings')
+    parser.add_argument('--model', default='VGG-Face')
+    parser.add_argument('--threshold', type=float, default=0.4, help="CONFIDENCE_THRESHOLD used by the app")
+    parser.add_argument('--max-probes', type=int, default=2000)
+    parser.add_argument('--synthetic-students', type=int, default=200)
+    parser.add_argument('--synthetic-images', type=int, default=10)
+    parser.add_argument('--synthetic-dim', type=int, default=4096)
+    args = parser.parse_args()
+
+    matrix, labels = stored_gallery(args.store, args.model)
+    if matrix is None:
+        print(f"No embeddings under {args.store}/{args.model.lower()}; using a synthetic gallery.")
+        matrix, labels = synthetic_gallery(args.synthetic_students, args.synthetic_images, args.synthetic_dim)
+    print(f"{matrix.shape[0]} embeddings of {len(set(labels))} students, dim {matrix.shape[1]}")
+
+    rng = np.random.default_rng(0)
+    probes = rng.choice(matrix.shape[0], size=min(args.max_probes, matrix.shape[0]), replace=False)
+    for dtype in ('float32', 'float16', 'int8'):
+        rows, scales = quantize(matrix, dtype)
+        candidate = dequantize(rows, scales)
+        s = evaluate(matrix, candidate, labels, probes, args.threshold)
+        size_mb = (rows.nbytes + (scales.nbytes if dtype == 'int8' else 0)) / 1e6
+        print(f"{dtype:>8}: {size_mb:9.1f} MB  max |d err| {s['max_abs_error']:.5f}  mean |d err| {s['sum_abs_error'] / max(s['pairs'], 1):.6f}  "
+              f"rank-1 {s['rank1'] / len(probes):.4f} (float32 {s['rank1_ref'] / len(probes):.4f})  "
+              f"decisions changed at {args.threshold}: {s['decisions_changed']}/{s['decisions']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Calibration: smile scores of labelled face crops for the liveness thresholds.
+
+Reads face images from DIR/smiling and DIR/not_smiling, scores each one with
+``SmileLiveness.smile_score`` at a few crop sizes (the score should not
+depend on it) and reports, per class, the score range and, for the given
+thresholds, how many crops the fast path decides and how many of those it
+gets wrong. With --detect, whole photos (e.g. attendance proofs) are
+accepted and the largest face found by OpenCV's frontal face cascade is
+cropped first; otherwise every image is taken to be a face crop already.
+
+Usage: python benchmarks/calibrate_liveness.py DIR [--accept 15] [--reject 5] [--detect]
+"""
+import argparse
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_index import IMAGE_EXTENSIONS  # noqa: E402
+from liveness import SmileLiveness  # noqa: E402
+from quality_gate import FACE_CASCADE_FILE, load_cascade  # noqa: E402
+
+CLASSES = ('smiling', 'not_smiling')
+CROP_SIZES = (64, 112, 160, 224, 300)
+
+
+def face_crops(folder, detect):
+    """(file name, BGR crop) for every readable image in folder."""
+    cascade = load_cascade(FACE_CASCADE_FILE) if detect else None
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS): continue
+        image = cv2.imread(os.path.join(folder, name))
+        if image is None: continue
+        if cascade is not None:
+            faces = cascade.detectMultiScale(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), scaleFactor=1.1, minNeighbors=5, minSize=(48, 48))
+            if len(faces) == 0: continue
+            x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+            image = image[y:y + h, x:x + w]
+        yield name, image
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('dir')
+    parser.add_argument('--accept', type=float, default=15.0, help="LIVENESS_SMILE_ACCEPT_SCORE")
+    parser.add_argument('--reject', type=float, default=5.0, help="LIVENESS_SMILE_REJECT_SCORE")
+    parser.add_argument('--detect', action='store_true', help="Crop the largest detected face from whole photos")
+    args = parser.parse_args()
+
+    liveness = SmileLiveness(emotion_fn=None, mode='cascade')
+    scores = {}
+    for label in CLASSES:
+        folder = os.path.join(args.dir, label)
+        scores[label] = []
+        for name, crop in face_crops(folder, args.detect) if os.path.isdir(folder) else []:
+            per_size = [liveness.smile_score(cv2.resize(crop, (size, round(size * crop.shape[0] / crop.shape[1])))) for size in CROP_SIZES]
+            scores[label] += per_size
+            print(f"{label:>11}  {name:<40} " + ' '.join(f"{s:6.2f}" for s in per_size))
+
+    for label in CLASSES:
+        values = np.array(scores[label])
+        if values.size == 0:
+            print(f"{label}: no images under {os.path.join(args.dir, label)}")
+            continue
+        accepted, rejected = int(np.sum(values >= args.accept)), int(np.sum(values < args.reject))
+        wrong = rejected if label == 'smiling' else accepted
+        print(f"{label}: {values.size} scores, min {values.min():.2f}  median {np.median(values):.2f}  max {values.max():.2f}; "
+              f"fast path decides {(accepted + rejected) / values.size:.0%}, {wrong} wrongly")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Deterministic, CPU-only stand-in for DeepFace used by the benchmarks.
+
+Putting ``benchmarks/stub_deepface`` first on ``sys.path`` makes
+``from deepface import DeepFace`` resolve here, so the app's own code paths
+run without TensorFlow, model downloads or network access:
+
+* ``extract_faces`` returns the whole image as the face;
+* ``represent`` embeds an image as its mean-centred 16x16 grayscale
+  thumbnail, so differently captured images of the same synthetic face are
+  close in cosine distance and different faces are not;
+* ``analyze`` always reports a smile.
+
+The numbers measure the app around the models, not the models themselves.
+"""
+import cv2
+import numpy as np
+
+EMBEDDING_SIZE = 16  # Thumbnail side; embeddings have EMBEDDING_SIZE ** 2 dimensions
+
+
+def _image(img):
+    if isinstance(img, str):
+        img = cv2.imread(img)
+        if img is None: raise ValueError(f"Could not read image {img}")
+    return img
+
+
+def _embedding(img):
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    vector = cv2.resize(gray, (EMBEDDING_SIZE, EMBEDDING_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+    vector -= vector.mean()
+    return (vector / (np.linalg.norm(vector) or 1.0)).tolist()
+
+
+def _face(img):
+    h, w = img.shape[:2]
+    return {'x': 0, 'y': 0, 'w': w, 'h': h, 'left_eye': None, 'right_eye': None}
+
+
+class DeepFace:
+    @staticmethod
+    def build_model(model_name, task=None):
+        return model_name
+
+    @staticmethod
+    def extract_faces(img_path, detector_backend='opencv', enforce_detection=True, align=True, **kwargs):
+        img = _image(img_path)
+        return [{'face': img[:, :, ::-1].astype(np.float32) / 255.0, 'facial_area': _face(img), 'confidence': 1.0}]
+
+    @staticmethod
+    def represent(img_path, model_name='VGG-Face', enforce_detection=True, detector_backend='opencv', align=True, **kwargs):
+        if isinstance(img_path, list):
+            return [DeepFace.represent(img, model_name, enforce_detection, detector_backend, align) for img in img_path]
+        img = _image(img_path)
+        return [{'embedding': _embedding(img), 'facial_area': _face(img), 'face_confidence': 1.0}]
+
+    @staticmethod
+    def analyze(img_path, actions=('emotion',), enforce_detection=True, detector_backend='opencv', silent=False, **kwargs):
+        if isinstance(img_path, list):
+            return [DeepFace.analyze(img, actions, enforce_detection, detector_backend, silent) for img in img_path]
+        emotion = {'angry': 0.5, 'disgust': 0.0, 'fear': 0.5, 'happy': 95.0, 'sad': 1.0, 'surprise': 1.0, 'neutral': 2.0}
+        return [{'emotion': emotion, 'dominant_emotion': 'happy', 'region': _face(_image(img_path))}]
+
+    @staticmethod
+    def find(*args, **kwargs):
+        raise NotImplementedError("The benchmark stub does not implement DeepFace.find")
@@ -0,0 +1,109 @@
+"""Synthetic workspace for the benchmarks: students, photos, attendance history and a timetable.
+
+Every student gets a random 16x16 "face" pattern; their enrolment photos and
+webcam frames are that pattern scaled up with a little noise, which the
+benchmark DeepFace stub maps to nearby embeddings. Attendance is written as
+the dated ``attendance_records/<date>/attendance.csv`` files the app keeps.
+
+Usage: python benchmarks/synthetic.py OUT_DIR [--students 200] [--days 60] [--subjects 8] [--images 3]
+"""
+import argparse
+import csv
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import cv2
+import numpy as np
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+PATTERN_SIZE = 16
+PHOTO_SIZE = 160
+
+
+def student_folders(n_students):
+    return [f"{i + 1:04d}-Student {i + 1:04d}" for i in range(n_students)]
+
+
+def face_pattern(student_index, seed=0):
+    """The student's fixed PATTERN_SIZE x PATTERN_SIZE grayscale pattern."""
+    rng = np.random.default_rng([seed, student_index])
+    return rng.uniform(0, 255, size=(PATTERN_SIZE, PATTERN_SIZE)).astype(np.float32)
+
+
+def face_image(student_index, width, height, noise=6.0, seed=0, shot=0):
+    """A BGR image of the student's pattern scaled to width x height, with per-shot noise."""
+    rng = np.random.default_rng([seed, student_index, shot + 1])
+    pattern = face_pattern(student_index, seed) + rng.normal(0, noise, size=(PATTERN_SIZE, PATTERN_SIZE))
+    # Nearest-neighbour scaling keeps hard edges, so the frames pass the quality gate's sharpness check
+    gray = cv2.resize(np.clip(pattern, 0, 255).astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+def encode_jpeg(image, quality=90):
+    ok, buf = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok: raise ValueError("JPEG encoding failed")
+    return buf.tobytes()
+
+
+def timetable(subjects):
+    """Every subject once a day in one-hour slots from 08:00, in an order rotated by weekday."""
+    table = {}
+    for day_index, day in enumerate(WEEKDAYS):
+        slots = []
+        for i, subject in enumerate(subjects[day_index:] + subjects[:day_index]):
+            hour = 8 + i % 14
+            slots.append({'id': str(uuid.uuid4()), 'subject': subject, 'start': f"{hour:02d}:00", 'end': f"{hour:02d}:50"})
+        table[day] = slots
+    return table
+
+
+def generate(out_dir, n_students=200, n_days=60, n_subjects=8, images_per_student=3, attendance_rate=0.8, seed=0):
+    """Writes dataset/, attendance_records/ and timetable.json under out_dir; returns (folders, subjects)."""
+    rng = np.random.default_rng(seed)
+    folders = student_folders(n_students)
+    subjects = [f"Subject {i + 1:02d}" for i in range(n_subjects)]
+
+    for i, folder in enumerate(folders):
+        path = os.path.join(out_dir, "dataset", folder)
+        os.makedirs(path, exist_ok=True)
+        for shot in range(images_per_student):
+            with open(os.path.join(path, f"photo_{shot}.jpg"), 'wb') as f:
+                f.write(encode_jpeg(face_image(i, PHOTO_SIZE, PHOTO_SIZE, seed=seed, shot=shot)))
+
+    # History ends yesterday, so the benchmarked marks for today never collide with it
+    names = [folder.split('-', 1)[1] for folder in folders]
+    today = datetime.now().date()
+    for day in range(n_days):
+        date_str = (today - timedelta(days=n_days - day)).strftime("%Y-%m-%d")
+        day_path = os.path.join(out_dir, "attendance_records", date_str)
+        os.makedirs(day_path, exist_ok=True)
+        with open(os.path.join(day_path, "attendance.csv"), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(["Name", "Time", "Subject"])
+            for j, subject in enumerate(rng.choice(subjects, size=max(1, n_subjects // 2), replace=False)):
+                for name in names:
+                    if rng.random() < attendance_rate:
+                        writer.writerow([name, f"{8 + j:02d}:{rng.integers(0, 60):02d}:00", subject])
+
+    with open(os.path.join(out_dir, "timetable.json"), 'w') as f:
+        json.dump(timetable(subjects), f, indent=4)
+    return folders, subjects
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('out_dir')
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--subjects', type=int, default=8)
+    parser.add_argument('--images', type=int, default=3, help="Enrolment photos per student")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.out_dir, args.students, args.days, args.subjects, args.images, seed=args.seed)
+    print(f"Wrote {args.students} students, {args.days} days and {args.subjects} subjects to {args.out_dir}")
+
+
+if __name__ == '__main__':
+    main()
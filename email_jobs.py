@@ -0,0 +1,244 @@
+"""Bulk email delivery as background jobs.
+
+Sending the attendance emails used to happen inside the HTTP request over a
+single SMTP connection, one message at a time. A job now takes the already
+rendered messages, returns an ID at once, and delivers them from a small
+pool of reusable SMTP connections with a few parallel senders. Transient
+failures (dropped connections, 4xx replies) are retried with exponential
+backoff; a refused recipient fails for that recipient only.
+
+Each job's progress and per-recipient status are persisted as JSON under
+``jobs_path``, so any worker process can answer the dashboard's polling.
+Jobs run on a daemon thread of the worker that accepted them and record its
+pid; a queued or running job whose worker has exited (recycled, killed or
+restarted) is marked failed when it is next read, and at startup.
+"""
+import json
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.message import EmailMessage
+
+from file_locks import atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+SMTP_SECURITY_MODES = ('ssl', 'starttls', 'none')
+_STATUS_WRITE_INTERVAL = 0.5  # Seconds between progress snapshots while a job runs
+_ACTIVE_STATUSES = ('queued', 'running')
+
+
+def _process_alive(pid):
+    if not pid: return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, but belongs to another user
+    return True
+
+
+class SmtpPool:
+    """Up to size authenticated SMTP connections shared by the sender threads."""
+
+    def __init__(self, host, port, security='ssl', username=None, password=None, size=4, timeout=30):
+        if security not in SMTP_SECURITY_MODES:
+            raise ValueError(f"security must be one of {SMTP_SECURITY_MODES}")
+        self.host, self.port, self.security = host, port, security
+        self.username, self.password = username, password
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(size)
+
+    def _connect(self):
+        if self.security == 'ssl':
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.security == 'starttls': server.starttls()
+        try:
+            server.ehlo_or_helo_if_needed()
+            # Local relays used for testing ('none') usually do not offer AUTH at all
+            if self.username and (self.security != 'none' or server.has_extn('auth')):
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def check(self):
+        """Opens and logs in one connection now (raising SMTPAuthenticationError etc.) and keeps it for the job."""
+        self.release(self._connect())
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, server):
+        try:
+            self._idle.put_nowait(server)
+        except queue.Full:
+            self.discard(server)
+
+    def discard(self, server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def close(self):
+        while True:
+            try:
+                self.discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+def _is_permanent(error):
+    # 5xx replies and refused recipients will not succeed on a retry; dropped connections and 4xx might
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, (smtplib.SMTPSenderRefused, smtplib.SMTPAuthenticationError)):
+        return True
+    code = getattr(error, 'smtp_code', None)
+    return isinstance(code, int) and 500 <= code < 600
+
+
+class EmailJobs:
+    """Runs bulk email jobs in the background and persists their status."""
+
+    def __init__(self, jobs_path, senders=4, max_attempts=3, backoff_seconds=2.0):
+        self.jobs_path = jobs_path
+        self.senders = senders
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self._active = set()  # IDs of the jobs running in this process
+        self._lock = threading.Lock()  # Orders a job's final save against the orphan check
+
+    def _job_file(self, job_id):
+        return os.path.join(self.jobs_path, f"{job_id}.json")
+
+    def get(self, job_id):
+        """The persisted status of a job, or None if there is no such job."""
+        if not job_id or not all(c.isalnum() for c in job_id): return None
+        job = self._load(job_id)
+        if job and job.get('status') in _ACTIVE_STATUSES:
+            with self._lock:
+                job = self._load(job_id)  # It may have finished meanwhile
+                if job and self._orphaned(job): self._fail_orphan(job)
+        return job
+
+    def _load(self, job_id):
+        try:
+            with open(self._job_file(job_id)) as f: return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _orphaned(self, job):
+        """Whether a job still marked queued or running has lost the thread that was sending it."""
+        if job.get('status') not in _ACTIVE_STATUSES: return False
+        if job.get('pid') == os.getpid(): return job['id'] not in self._active
+        return not _process_alive(job.get('pid'))
+
+    def _fail_orphan(self, job):
+        job['status'] = 'failed'
+        job['message'] = (f"Interrupted: the worker process sending this job stopped after {job['sent']} of {job['total']} emails. "
+                          "Emails not marked as sent may not have been delivered.")
+        for recipient in job['recipients'].values():
+            if recipient['status'] == 'pending':
+                recipient.update(status='failed', error="Not sent: the job was interrupted.")
+                job['failed'] += 1
+        job['finished_at'] = datetime.now().isoformat(timespec='seconds')
+        self._save(job)
+        logger.warning(f"Email job {job['id']} lost its sending thread (worker {job.get('pid')} stopped); marked it failed.")
+
+    def recover(self):
+        """Marks every job orphaned by an exited worker as failed; returns how many were."""
+        if not os.path.isdir(self.jobs_path): return 0
+        recovered = 0
+        for name in os.listdir(self.jobs_path):
+            if not name.endswith('.json'): continue
+            with self._lock:
+                job = self._load(name[:-len('.json')])
+                if job and self._orphaned(job):
+                    self._fail_orphan(job)
+                    recovered += 1
+        return recovered
+
+    def submit(self, subject, sender, messages, pool):
+        """Starts sending (name, recipient, body) messages from sender through pool; returns the job ID."""
+        job_id = uuid.uuid4().hex[:12]
+        job = {'id': job_id, 'subject': subject, 'status': 'queued', 'created_at': datetime.now().isoformat(timespec='seconds'),
+               'finished_at': None, 'total': len(messages), 'sent': 0, 'failed': 0, 'message': None, 'pid': os.getpid(),
+               'recipients': {name: {'email': email, 'status': 'pending', 'attempts': 0, 'error': None} for name, email, _ in messages}}
+        os.makedirs(self.jobs_path, exist_ok=True)
+        self._active.add(job_id)
+        self._save(job)
+        threading.Thread(target=self._run, args=(job, sender, messages, pool), name=f"email-job-{job_id}", daemon=True).start()
+        return job_id
+
+    def _save(self, job):
+        job['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        atomic_write_bytes(self._job_file(job['id']), json.dumps(job, indent=2).encode())
+
+    def _run(self, job, sender, messages, pool):
+        lock = threading.Lock()
+        last_save = [0.0]
+        job['status'] = 'running'
+        self._save(job)
+
+        def record(name, status, attempts, error=None):
+            with lock:
+                job['recipients'][name].update(status=status, attempts=attempts, error=error)
+                job['sent' if status == 'sent' else 'failed'] += 1
+                if time.time() - last_save[0] >= _STATUS_WRITE_INTERVAL:
+                    last_save[0] = time.time()
+                    self._save(job)
+
+        def deliver(item):
+            name, recipient, body = item
+            msg = EmailMessage()
+            msg['Subject'] = job['subject']
+            msg['From'] = sender
+            msg['To'] = recipient
+            msg.set_content(body)
+            for attempt in range(1, self.max_attempts + 1):
+                server = None
+                try:
+                    server = pool.acquire()
+                    server.send_message(msg)
+                    pool.release(server)
+                    record(name, 'sent', attempt)
+                    return
+                except Exception as e:
+                    if server is not None:
+                        # A rejected message leaves the session usable (smtplib resets it); anything else may not
+                        if isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException)): pool.release(server)
+                        else: pool.discard(server)
+                    if _is_permanent(e) or attempt == self.max_attempts:
+                        record(name, 'failed', attempt, str(e))
+                        return
+                    time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.senders, thread_name_prefix=f"email-{job['id']}") as executor:
+                list(executor.map(deliver, messages))
+            job['status'] = 'done' if not job['failed'] else 'done_with_errors'
+            job['message'] = f"Sent {job['sent']} of {job['total']} emails." + (f" {job['failed']} failed." if job['failed'] else "")
+        except Exception as e:
+            logger.error(f"Email job {job['id']} failed: {e}", exc_info=True)
+            job['status'], job['message'] = 'failed', str(e)
+        finally:
+            pool.close()
+            job['finished_at'] = datetime.now().isoformat(timespec='seconds')
+            with self._lock:
+                self._save(job)
+                self._active.discard(job['id'])
@@ -0,0 +1,385 @@
+"""Persistent, incrementally updated index of face embeddings per student.
+
+Each student's gallery is stored as one small versioned ``.npz`` file holding
+a matrix of L2-normalised embeddings and the image file names the rows came
+from. Files are keyed by student ID, so adding photos only embeds the new
+images, deleting a student drops one file and a rename only relabels the
+folder. Every process loads the store once and reloads a single student when
+another process has rewritten that student's file.
+
+For large deployments ``compact()`` folds every student into one packed
+matrix (``packed-<generation>.npy``), stored as float32, float16 or int8 with
+a float32 scale per row, plus a small ``packed.json`` table of each student's
+folder, image names and row offset. The matrix is memory-mapped, so every
+worker shares the same page-cache copy instead of holding its own. Updates
+after a compaction are written as per-student ``.npz`` override files as
+before (a deleted student gets an empty "tombstone" override) until the next
+compaction folds them in.
+"""
+import io
+import json
+import logging
+import os
+import threading
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+import inference
+from file_locks import atomic_write_bytes, locked
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+STORE_FORMAT_VERSION = 1
+PACKED_DTYPES = ('float32', 'float16', 'int8')
+
+
+def l2_normalize(vectors):
+    """Scales vectors (a single vector or one per row) to unit length."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def cosine_distances(matrix, probe):
+    """Cosine distance between every row of a normalised matrix and a probe vector."""
+    if matrix.shape[0] == 0:
+        return np.empty(0, dtype=np.float32)
+    return 1.0 - matrix @ l2_normalize(probe)
+
+
+def _stack(matrix, rows):
+    """Appends rows to a matrix that may still be empty."""
+    if matrix.shape[0] == 0: return rows
+    if rows.shape[0] == 0: return matrix
+    return np.vstack([matrix, rows])
+
+
+def _empty_entry(folder):
+    return {'folder': folder, 'files': [], 'matrix': np.empty((0, 0), dtype=np.float32)}
+
+
+def quantize(matrix, dtype):
+    """Returns (stored rows, per-row scales) of a float32 matrix in the given packed dtype."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.ones(matrix.shape[0], dtype=np.float32)
+    if dtype == 'float16':
+        return matrix.astype(np.float16), scales
+    if dtype == 'int8':
+        peaks = np.abs(matrix).max(axis=1) if matrix.size else scales
+        scales = np.where(peaks > 0, peaks / 127.0, 1.0).astype(np.float32)
+        return np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8), scales
+    return matrix, scales
+
+
+def dequantize(rows, scales):
+    """Float32, unit-length rows from stored rows; float32 storage is returned without copying."""
+    if rows.dtype == np.float32:
+        return rows
+    if rows.dtype == np.int8:
+        return l2_normalize(rows.astype(np.float32) * scales[:, None])
+    return l2_normalize(rows.astype(np.float32))
+
+
+class FaceIndex:
+    """Per-student embedding matrices, keyed by student ID and persisted on disk."""
+
+    def __init__(self, dataset_path, store_path, model_name="VGG-Face", detector_backend="opencv", backend=inference, packed_dtype='float32'):
+        if packed_dtype not in PACKED_DTYPES:
+            raise ValueError(f"packed_dtype must be one of {PACKED_DTYPES}")
+        self.dataset_path = dataset_path
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.backend = backend  # The inference module itself, or an InferenceClient
+        self.packed_dtype = packed_dtype  # Storage type used by compact()
+        self.store_dir = os.path.join(store_path, model_name.lower())
+        self._entries = {}  # student_id -> {'folder': str, 'files': [str], 'matrix': np.ndarray, 'mtime': int}
+        self._packed = {'mtime': None, 'students': {}, 'rows': None, 'scales': None}
+        self._lock = threading.Lock()
+
+    # --- Embedding ---
+
+    def embed(self, img, enforce_detection=True, detector_backend=None):
+        """Returns the embedding of the first face found in an image path or BGR array.
+
+        Pass detector_backend='skip' for a face crop that has already been detected and aligned.
+        """
+        return self.backend.represent_image(img, self.model_name, detector_backend or self.detector_backend, enforce_detection)
+
+    def _embed_images(self, paths):
+        kept, vectors = [], []
+        for path in paths:
+            try:
+                vectors.append(self.embed(path))
+                kept.append(os.path.basename(path))
+            except ValueError as e:
+                # No detectable face, or an unreadable file: skipped, as DeepFace.find does. Anything else (a model
+                # that failed to load, the daemon being down) propagates instead of leaving an empty gallery
+                logger.warning(f"Skipping gallery image {path}: {e}")
+                continue
+        matrix = l2_normalize(np.vstack(vectors)) if vectors else np.empty((0, 0), dtype=np.float32)
+        return kept, matrix
+
+    # --- On-disk format ---
+
+    def _student_file(self, student_id):
+        return os.path.join(self.store_dir, quote(student_id, safe='') + '.npz')
+
+    def _lock_path(self):
+        return os.path.join(self.store_dir, '.lock')
+
+    def _packed_table_path(self):
+        return os.path.join(self.store_dir, 'packed.json')
+
+    def _refresh_packed(self):
+        """Maps the current packed matrix, again only if another process compacted since."""
+        try:
+            mtime = os.stat(self._packed_table_path()).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._packed['mtime']: return self._packed
+        packed = {'mtime': mtime, 'students': {}, 'rows': None, 'scales': None}
+        if mtime is not None:
+            try:
+                with open(self._packed_table_path()) as f: table = json.load(f)
+                if table.get('version') == STORE_FORMAT_VERSION:
+                    packed['rows'] = np.load(os.path.join(self.store_dir, table['matrix']), mmap_mode='r', allow_pickle=False)
+                    packed['scales'] = np.load(os.path.join(self.store_dir, table['scales']), allow_pickle=False)
+                    packed['students'] = table['students']
+            except (OSError, ValueError, KeyError):
+                packed = {'mtime': None, 'students': {}, 'rows': None, 'scales': None}  # Mid-compaction; retry next time
+        with self._lock:
+            self._packed = packed
+        return packed
+
+    def _packed_entry(self, student_id):
+        packed = self._refresh_packed()
+        info = packed['students'].get(student_id)
+        if info is None: return None
+        start, end = info['offset'], info['offset'] + info['count']
+        matrix = dequantize(packed['rows'][start:end], packed['scales'][start:end]) if info['count'] else np.empty((0, 0), dtype=np.float32)
+        return {'folder': info['folder'], 'files': list(info['files']), 'matrix': matrix, 'mtime': None}
+
+    def _read(self, student_id):
+        """The student's override file if there is one, else their packed rows; None if absent or deleted."""
+        path = self._student_file(student_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return self._packed_entry(student_id)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data['version']) != STORE_FORMAT_VERSION or 'tombstone' in data: return None
+                return {'folder': str(data['folder']), 'files': data['files'].tolist(),
+                        'matrix': data['matrix'].astype(np.float32), 'mtime': mtime}
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            return None
+
+    def _write(self, student_id, entry):
+        os.makedirs(self.store_dir, exist_ok=True)
+        buffer = io.BytesIO()
+        np.savez(buffer, version=np.int32(STORE_FORMAT_VERSION), folder=np.str_(entry['folder']),
+                 files=np.array(entry['files'], dtype=np.str_), matrix=entry['matrix'].astype(np.float32))
+        path = self._student_file(student_id)
+        atomic_write_bytes(path, buffer.getvalue())
+        entry['mtime'] = os.stat(path).st_mtime_ns
+        with self._lock:
+            self._entries[student_id] = entry
+
+    def _update(self, student_id, mutate):
+        """Applies mutate() to the freshest on-disk copy of a student's entry (or None) under the store lock."""
+        with locked(self._lock_path()):
+            entry = mutate(self._read(student_id))
+            if entry is None:
+                if student_id in self._refresh_packed()['students']:
+                    # The packed rows stay until the next compaction; mask them
+                    buffer = io.BytesIO()
+                    np.savez(buffer, version=np.int32(STORE_FORMAT_VERSION), tombstone=np.int8(1))
+                    atomic_write_bytes(self._student_file(student_id), buffer.getvalue())
+                else:
+                    try: os.remove(self._student_file(student_id))
+                    except FileNotFoundError: pass
+                with self._lock: self._entries.pop(student_id, None)
+            else:
+                self._write(student_id, entry)
+
+    def load(self):
+        """Loads every stored student; stores written in another format version are discarded."""
+        os.makedirs(self.store_dir, exist_ok=True)
+        version_file = os.path.join(self.store_dir, 'VERSION')
+        with locked(self._lock_path()):
+            try:
+                with open(version_file) as f: version = int(f.read().strip())
+            except (FileNotFoundError, ValueError):
+                version = None
+            if version != STORE_FORMAT_VERSION:
+                for name in os.listdir(self.store_dir):
+                    if name.endswith('.npz') or name.startswith('packed'): os.remove(os.path.join(self.store_dir, name))
+                atomic_write_bytes(version_file, str(STORE_FORMAT_VERSION).encode())
+        entries = {}
+        for name in os.listdir(self.store_dir):
+            if name.endswith('.npz'):
+                student_id = unquote(name[:-len('.npz')])
+                entry = self._read(student_id)
+                if entry: entries[student_id] = entry
+        with self._lock:
+            self._entries = entries
+        self._refresh_packed()
+
+    def compact(self):
+        """Folds every student into a new packed matrix in packed_dtype and removes the override files.
+
+        Returns (students, rows) written.
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
+        with locked(self._lock_path()):
+            students, blocks, offset = {}, [], 0
+            for student_id, entry in self.stored_entries():
+                count = entry['matrix'].shape[0]
+                students[student_id] = {'folder': entry['folder'], 'files': entry['files'], 'offset': offset, 'count': count}
+                if count: blocks.append(entry['matrix'])
+                offset += count
+            dim = max((b.shape[1] for b in blocks), default=0)
+            rows, scales = quantize(np.vstack(blocks) if blocks else np.empty((0, dim), dtype=np.float32), self.packed_dtype)
+
+            generation = (max((int(n.split('-')[1].split('.')[0]) for n in os.listdir(self.store_dir) if n.startswith('packed-')), default=0) + 1)
+            matrix_name, scales_name = f"packed-{generation}.npy", f"packed-{generation}.scales.npy"
+            for name, array in ((matrix_name, rows), (scales_name, scales)):
+                buffer = io.BytesIO()
+                np.save(buffer, array, allow_pickle=False)
+                atomic_write_bytes(os.path.join(self.store_dir, name), buffer.getvalue())
+            table = {'version': STORE_FORMAT_VERSION, 'dtype': self.packed_dtype, 'dim': dim,
+                     'matrix': matrix_name, 'scales': scales_name, 'students': students}
+            atomic_write_bytes(self._packed_table_path(), json.dumps(table).encode())  # Commit point
+
+            # Readers that still map an older generation keep working; the files are unlinked, not truncated
+            for name in os.listdir(self.store_dir):
+                if name.endswith('.npz') or (name.startswith('packed-') and name not in (matrix_name, scales_name)):
+                    os.remove(os.path.join(self.store_dir, name))
+            with self._lock:
+                self._entries = {}
+            self._refresh_packed()
+        return len(students), offset
+
+    # --- Queries ---
+
+    def stored_entries(self):
+        """Yields (student_id, entry) for every student in the store, overrides taking precedence over packed rows."""
+        overrides = [unquote(n[:-len('.npz')]) for n in os.listdir(self.store_dir) if n.endswith('.npz')] if os.path.isdir(self.store_dir) else []
+        for student_id in sorted(set(self._refresh_packed()['students']) | set(overrides)):
+            entry = self._read(student_id)
+            if entry is not None:
+                yield student_id, entry
+
+    def _current(self, student_id, folder):
+        """Returns the student's entry, reloading it if another process rewrote it."""
+        try:
+            mtime = os.stat(self._student_file(student_id)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            entry = self._entries.get(student_id)
+        if mtime is None:
+            entry = self._packed_entry(student_id)  # No override file: the packed rows, if any
+            if entry is None:
+                # Never indexed (e.g. a dataset that predates the store): embed the whole folder once
+                folder_path = os.path.join(self.dataset_path, folder)
+                paths = sorted(os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.lower().endswith(IMAGE_EXTENSIONS)) if os.path.isdir(folder_path) else []
+                self.add_images(student_id, folder, paths)
+                with self._lock:
+                    entry = self._entries.get(student_id)
+        elif not entry or entry['mtime'] != mtime:
+            entry = self._read(student_id)
+            if entry:
+                with self._lock: self._entries[student_id] = entry
+        if entry and entry['folder'] != folder:
+            self.rename_student(student_id, folder)  # Folder was renamed outside the app
+            with self._lock:
+                entry = self._entries.get(student_id)
+        return entry
+
+    def store_versions(self):
+        """{student_id: version} for every stored student; a student's version changes whenever their rows do."""
+        packed = self._refresh_packed()
+        versions = {student_id: ('packed', packed['mtime']) for student_id in packed['students']}
+        if os.path.isdir(self.store_dir):
+            with os.scandir(self.store_dir) as entries:
+                for e in entries:
+                    if e.name.endswith('.npz'): versions[unquote(e.name[:-len('.npz')])] = e.stat().st_mtime_ns
+        return versions
+
+    def stored_entry(self, student_id):
+        """A student's stored entry exactly as on disk (no bootstrap or relabelling), or None."""
+        return self._read(student_id)
+
+    def distances(self, student_id, folder, probe):
+        """Returns (distances, paths) of a probe embedding against one student's gallery."""
+        entry = self._current(student_id, folder)
+        if not entry:
+            return np.empty(0, dtype=np.float32), []
+        paths = [os.path.join(self.dataset_path, entry['folder'], f) for f in entry['files']]
+        return cosine_distances(entry['matrix'], probe), paths
+
+    def gallery(self, student_id, folder):
+        """Returns (file names, normalised embedding matrix) of a student's current gallery."""
+        entry = self._current(student_id, folder)
+        if not entry:
+            return [], np.empty((0, 0), dtype=np.float32)
+        return list(entry['files']), entry['matrix']
+
+    # --- Incremental updates ---
+
+    def add_images(self, student_id, folder, paths):
+        """Embeds only the given new images and appends them to the student's rows."""
+        with self._lock:
+            entry = self._entries.get(student_id)
+        known = set(entry['files']) if entry and entry['folder'] == folder else set()
+        files, matrix = self._embed_images([p for p in paths if os.path.basename(p) not in known])
+
+        def mutate(current):
+            current = current or _empty_entry(folder)
+            keep = [i for i, f in enumerate(files) if f not in set(current['files'])]
+            current['folder'] = folder
+            current['files'] = current['files'] + [files[i] for i in keep]
+            current['matrix'] = _stack(current['matrix'], matrix[keep] if keep else np.empty((0, 0), dtype=np.float32))
+            return current
+        self._update(student_id, mutate)
+
+    def add_embedding(self, student_id, folder, path, embedding):
+        """Appends an already computed embedding, e.g. for a verified attendance frame."""
+        row = l2_normalize(embedding)[None, :]
+
+        def mutate(current):
+            current = current or _empty_entry(folder)
+            file_name = os.path.basename(path)
+            if file_name in current['files']: return current
+            current['folder'] = folder
+            current['files'] = current['files'] + [file_name]
+            current['matrix'] = _stack(current['matrix'], row)
+            return current
+        self._update(student_id, mutate)
+
+    def rename_student(self, student_id, new_folder):
+        """Relabels a student's rows after their folder was renamed."""
+        def mutate(current):
+            if current: current['folder'] = new_folder
+            return current
+        self._update(student_id, mutate)
+
+    def remove_student(self, student_id):
+        """Drops every row belonging to a student."""
+        self._update(student_id, lambda current: None)
+
+    def remove_images(self, student_id, file_names):
+        """Drops the rows of the given image files from a student's gallery."""
+        drop = set(file_names)
+
+        def mutate(current):
+            if not current: return current
+            keep = [i for i, f in enumerate(current['files']) if f not in drop]
+            current['files'] = [current['files'][i] for i in keep]
+            current['matrix'] = current['matrix'][keep] if keep else np.empty((0, 0), dtype=np.float32)
+            return current
+        self._update(student_id, mutate)
@@ -0,0 +1,32 @@
+"""Advisory file locks shared by every worker process on the host."""
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to no cross-process locking
+    fcntl = None
+
+
+@contextmanager
+def locked(lock_path, shared=False):
+    """Holds an flock on lock_path for the duration of the block."""
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    with open(lock_path, 'a') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write_bytes(path, data):
+    """Writes data to a temporary file and renames it over path."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,108 @@
+"""Bounded, diverse per-student galleries for continuous learning.
+
+Every verified attendance frame used to be added to the student's folder, so
+galleries filled up with hundreds of near-identical frames. The gallery
+manager keeps them small and varied:
+
+* a verified frame is only kept when its embedding is at least
+  ``novelty_threshold`` (cosine distance) away from every image already in
+  the gallery; the distances come for free from the recognition step;
+* when a gallery grows past ``max_images``, the most redundant captured
+  frame (the one closest to its nearest neighbour) is evicted;
+* ``prune`` re-selects an oversized gallery with farthest-point (greedy
+  k-center) selection seeded with the enrolment photos.
+
+Enrolment photos uploaded by the admin are never evicted; only frames captured
+during attendance (``upload_YYYY-MM-DD_HHMMSS.jpg``) are.
+"""
+import logging
+import os
+import re
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CAPTURED_FRAME_PATTERN = re.compile(r'^upload_\d{4}-\d{2}-\d{2}_\d{6}\.jpg$')
+
+
+def is_captured_frame(file_name):
+    """True for frames saved by attendance verification, False for enrolment photos."""
+    return bool(CAPTURED_FRAME_PATTERN.match(file_name))
+
+
+def pairwise_distances(matrix):
+    """Cosine distances between all rows of a normalised matrix, with +inf on the diagonal."""
+    distances = 1.0 - matrix @ matrix.T
+    np.fill_diagonal(distances, np.inf)
+    return distances
+
+
+def select_diverse(matrix, protected, k):
+    """Indices of k rows chosen by farthest-point traversal, always including the protected ones."""
+    n = matrix.shape[0]
+    selected = list(protected)
+    if n <= k: return list(range(n))
+    if len(selected) >= k: return selected
+    if not selected: selected = [0]
+    nearest = np.min(1.0 - matrix @ matrix[selected].T, axis=1)
+    nearest[selected] = -np.inf
+    while len(selected) < k:
+        i = int(np.argmax(nearest))
+        selected.append(i)
+        nearest = np.minimum(nearest, 1.0 - matrix @ matrix[i])
+        nearest[selected] = -np.inf
+    return sorted(selected)
+
+
+class GalleryManager:
+    """Decides which verified frames join a student's gallery and evicts redundant ones."""
+
+    def __init__(self, face_index, max_images=30, novelty_threshold=0.05):
+        self.face_index = face_index
+        self.max_images = max_images
+        self.novelty_threshold = novelty_threshold
+
+    def is_novel(self, distances):
+        """Whether a frame with these distances to the current gallery adds anything new."""
+        return distances.size == 0 or float(np.min(distances)) >= self.novelty_threshold
+
+    def add_verified_frame(self, student_id, folder, path, embedding):
+        """Adds a saved frame's embedding, then evicts captured frames while the gallery is over the cap."""
+        self.face_index.add_embedding(student_id, folder, path, embedding)
+        files, matrix = self.face_index.gallery(student_id, folder)
+        if len(files) <= self.max_images: return []
+        distances = pairwise_distances(matrix)
+        candidates = [i for i, f in enumerate(files) if is_captured_frame(f)]
+        evict = []
+        while len(files) - len(evict) > self.max_images and candidates:
+            # Most redundant = closest to its nearest remaining neighbour
+            i = min(candidates, key=lambda c: distances[c].min())
+            candidates.remove(i)
+            distances[:, i] = np.inf
+            evict.append(files[i])
+        self._evict(student_id, folder, evict)
+        return evict
+
+    def prune(self, student_id, folder, max_images=None, dry_run=False):
+        """Shrinks a gallery to max_images by farthest-point selection; returns the evicted file names."""
+        max_images = max_images or self.max_images
+        files, matrix = self.face_index.gallery(student_id, folder)
+        if len(files) <= max_images: return []
+        protected = [i for i, f in enumerate(files) if not is_captured_frame(f)]
+        keep = set(select_diverse(matrix, protected, max_images))
+        evict = [f for i, f in enumerate(files) if i not in keep]
+        if not dry_run:
+            self._evict(student_id, folder, evict)
+        return evict
+
+    def _evict(self, student_id, folder, file_names):
+        if not file_names: return
+        # Index first, so a concurrent match never points at a deleted file
+        self.face_index.remove_images(student_id, file_names)
+        for file_name in file_names:
+            try:
+                os.remove(os.path.join(self.face_index.dataset_path, folder, file_name))
+            except FileNotFoundError:
+                pass
+        logger.info(f"Evicted {len(file_names)} redundant image(s) from the gallery of {folder}.")
@@ -0,0 +1,53 @@
+"""Decoding of uploaded webcam frames at the smallest useful resolution.
+
+The face pipeline only needs a few hundred pixels across the face, so there
+is no point in decoding a 1080p JPEG at full size. ``decode_frame`` reads the
+image size from the JPEG's SOF header without decoding it, and picks the
+largest ``IMREAD_REDUCED_COLOR_*`` factor that keeps the shorter side at or
+above ``min_dimension`` (a 1920x1080 frame with a minimum of 480 decodes at
+1/2, to 960x540, not at 1/4, to 480x270). libjpeg then scales during the IDCT, which is much
+cheaper than decoding in full and resizing.
+"""
+import struct
+
+import cv2
+import numpy as np
+
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+# Start-of-frame markers; C4 (DHT), C8 (JPG) and CC (DAC) share the range but are not frames
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_STANDALONE_MARKERS = frozenset(range(0xD0, 0xD8)) | {0x01}
+
+
+def jpeg_size(data):
+    """(width, height) from a JPEG's SOF header, or None if data is not a well-formed JPEG."""
+    if data[:2] != b'\xff\xd8': return None
+    i, n = 2, len(data)
+    while i + 4 <= n:
+        if data[i] != 0xFF: return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+            continue
+        if marker in _STANDALONE_MARKERS:
+            i += 2
+            continue
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        if marker in _SOF_MARKERS:
+            if i + 9 > n: return None
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return (width, height) if width and height else None
+        if marker == 0xDA: return None  # Start of scan before any frame header
+        i += 2 + length
+    return None
+
+
+def decode_frame(data, min_dimension=0):
+    """Decodes image bytes to a BGR array, downscaled by 2/4/8 while the shorter side stays >= min_dimension."""
+    buf = np.frombuffer(data, np.uint8)
+    size = jpeg_size(data) if min_dimension else None
+    if size:
+        for factor, flag in _REDUCED_FLAGS:
+            if min(size) // factor >= min_dimension:
+                return cv2.imdecode(buf, flag)
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
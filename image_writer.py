@@ -0,0 +1,133 @@
+"""Background writer for attendance proof and retraining images.
+
+A successful mark used to JPEG-encode the frame twice with ``cv2.imwrite``
+while the student waited. The request now queues the frame and returns; a
+background thread encodes it once, writes the proof image and hard-links the
+retraining copy to it (falling back to a second write of the same bytes where
+links are not possible, e.g. across filesystems), then runs the job's
+callback, such as adding the new embedding to the face index.
+
+The queue is bounded: when it is full the job runs in the request thread
+instead, so a slow disk slows requests down rather than dropping images.
+``close`` drains the queue and is registered with ``atexit`` by the app, so
+a graceful worker shutdown flushes pending writes.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+from file_locks import atomic_write_bytes
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+WRITE_LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1, 2.5]
+_STOP = object()
+
+
+class AsyncImageWriter:
+    """Encodes and writes frames on a background thread fed by a bounded queue."""
+
+    def __init__(self, max_queue_size=64, jpeg_quality=95, enabled=True):
+        self.max_queue_size = max_queue_size
+        self.jpeg_quality = jpeg_quality
+        self.enabled = enabled
+        self.write_latency = Histogram("image_write_seconds", "Time to encode and write one proof/retraining image pair", WRITE_LATENCY_BUCKETS)
+        self._stats = {'written': 0, 'failures': 0, 'inline': 0, 'last_error': None}
+        self._stats_lock = threading.Lock()
+        self._queue = queue.Queue(max_queue_size)
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so a gunicorn --preload worker starts its own
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid(): return
+        with self._start_lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid(): return
+            self._queue = queue.Queue(self.max_queue_size)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name="image-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, frame, proof_path, retrain_path=None, on_written=None):
+        """Queues a frame to be saved at proof_path (and linked at retrain_path); on_written runs after the files exist.
+
+        Returns True if the job was queued, False if it ran in the calling thread.
+        """
+        job = (frame, proof_path, retrain_path, on_written)
+        if self.enabled:
+            self._ensure_thread()
+            try:
+                self._queue.put_nowait(job)
+                return True
+            except queue.Full:
+                pass
+        with self._stats_lock:
+            self._stats['inline'] += 1
+        self._process(job)
+        return False
+
+    def _loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is _STOP: return
+                self._process(job)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, job):
+        frame, proof_path, retrain_path, on_written = job
+        started = time.perf_counter()
+        try:
+            self._write(frame, proof_path, retrain_path)
+            if on_written: on_written()
+        except Exception as e:
+            logger.error(f"Could not save attendance image {proof_path}: {e}", exc_info=True)
+            with self._stats_lock:
+                self._stats['failures'] += 1
+                self._stats['last_error'] = str(e)
+            return
+        self.write_latency.observe(time.perf_counter() - started)
+        with self._stats_lock:
+            self._stats['written'] += 1
+
+    def _write(self, frame, proof_path, retrain_path):
+        ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok: raise ValueError("JPEG encoding failed")
+        data = encoded.tobytes()
+        os.makedirs(os.path.dirname(proof_path) or '.', exist_ok=True)
+        with open(proof_path, 'wb') as f: f.write(data)
+        if not retrain_path: return
+        # Link under a temporary name and rename over any existing file; writing through an
+        # existing path could modify an older proof image that it is linked to
+        tmp_path = f"{retrain_path}.{os.getpid()}.tmp"
+        try:
+            os.link(proof_path, tmp_path)
+            os.replace(tmp_path, retrain_path)
+        except OSError:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            atomic_write_bytes(retrain_path, data)  # No hard links here (other filesystem, FAT, ...)
+
+    def stats(self):
+        """Queue depth and counts of written, failed and inline (queue full) jobs."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        alive = bool(self._thread and self._thread.is_alive() and self._pid == os.getpid())
+        return {**stats, 'queue_depth': self._queue.qsize() if alive else 0, 'max_queue_size': self.max_queue_size, 'enabled': self.enabled}
+
+    def flush(self):
+        """Blocks until every queued job has been written."""
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        """Writes pending jobs and stops the background thread."""
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            self._queue.put(_STOP)
+            self._thread.join()
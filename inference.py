@@ -0,0 +1,138 @@
+"""Model loading, warm-up and single-pass face inference for the attendance pipeline.
+
+DeepFace builds its models lazily on first use, so without a warm-up the
+first attendance request served by each worker pays for loading the
+detector, VGG-Face and emotion weights. ``warm_up`` builds them all and runs
+one dummy inference before traffic is accepted; called at import time it
+also works under ``gunicorn --preload``, where forked workers share the
+loaded weights copy-on-write.
+
+``detect_face`` runs the detector and alignment once per frame; the returned
+crop is then handed to both the emotion model and the embedding model with
+``detector_backend='skip'`` so neither of them detects the face again.
+``analyze_emotions`` and ``embed_faces`` take a batch of such crops so a
+``MicroBatcher`` can serve several concurrent requests with one forward pass.
+
+The module's public functions double as the local inference backend;
+``inference_daemon.InferenceClient`` offers the same functions over a Unix
+socket.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WARMUP_STATE = {'ready': False, 'started_at': None, 'finished_at': None, 'duration_seconds': None, 'error': None}
+_warmup_lock = threading.Lock()
+
+
+def _deepface():
+    # Imported on first use so thin clients of the inference daemon never load TensorFlow
+    from deepface import DeepFace
+    return DeepFace
+
+
+def _dummy_frame(size=224):
+    """A smooth synthetic BGR frame; enough to drive every model once."""
+    ramp = np.linspace(0, 255, size, dtype=np.uint8)
+    return np.dstack([np.tile(ramp, (size, 1)), np.tile(ramp[:, None], (1, size)), np.full((size, size), 128, np.uint8)])
+
+
+def warm_up(recognition_model="VGG-Face", detector_backend="opencv", extra_models=()):
+    """Builds the detection, recognition and emotion models and runs a dummy inference through each.
+
+    extra_models are further recognition models used on crops, e.g. the twin verification models.
+    """
+    with _warmup_lock:
+        if WARMUP_STATE['ready']: return True
+        WARMUP_STATE['started_at'] = time.time()
+        try:
+            frame = _dummy_frame()
+            _deepface().represent(img_path=frame, model_name=recognition_model, detector_backend=detector_backend, enforce_detection=False)
+            _deepface().analyze(frame, actions=['emotion'], detector_backend=detector_backend, enforce_detection=False, silent=True)
+            for model_name in extra_models:
+                if model_name != recognition_model: embed_face(frame, model_name)
+        except Exception as e:
+            WARMUP_STATE['error'] = str(e)
+            logger.error(f"Model warm-up failed: {e}", exc_info=True)
+            return False
+        WARMUP_STATE['finished_at'] = time.time()
+        WARMUP_STATE['duration_seconds'] = round(WARMUP_STATE['finished_at'] - WARMUP_STATE['started_at'], 3)
+        WARMUP_STATE['error'] = None
+        WARMUP_STATE['ready'] = True
+        logger.info(f"Models warmed up in {WARMUP_STATE['duration_seconds']}s.")
+        return True
+
+
+def detect_face(frame, detector_backend="opencv", enforce_detection=True, align=True):
+    """Detects and aligns the largest face in a BGR frame.
+
+    Returns a dict with the aligned BGR uint8 'crop', its 'facial_area' and the
+    detector 'confidence'. Raises ValueError when enforce_detection is set and
+    no face is found.
+    """
+    faces = _deepface().extract_faces(img_path=frame, detector_backend=detector_backend, enforce_detection=enforce_detection, align=align)
+    face = max(faces, key=lambda f: f['facial_area']['w'] * f['facial_area']['h'])
+    crop = face['face']
+    if crop.dtype != np.uint8:
+        crop = np.clip(crop * 255, 0, 255).astype(np.uint8)  # extract_faces returns RGB floats in [0, 1]
+    return {'crop': np.ascontiguousarray(crop[:, :, ::-1]), 'facial_area': face['facial_area'], 'confidence': face.get('confidence')}
+
+
+def analyze_emotion(crop):
+    """Emotion scores for an already detected face crop."""
+    return _deepface().analyze(crop, actions=['emotion'], detector_backend='skip', enforce_detection=False, silent=True)[0]
+
+
+def embed_face(crop, model_name="VGG-Face"):
+    """Embedding of an already detected face crop."""
+    result = _deepface().represent(img_path=crop, model_name=model_name, detector_backend='skip', enforce_detection=False)
+    return np.asarray(result[0]['embedding'], dtype=np.float32)
+
+
+def represent_image(img, model_name="VGG-Face", detector_backend="opencv", enforce_detection=True):
+    """Embedding of the first face found in an image path or BGR array."""
+    result = _deepface().represent(img_path=img, model_name=model_name, detector_backend=detector_backend, enforce_detection=enforce_detection)
+    return np.asarray(result[0]['embedding'], dtype=np.float32)
+
+
+def _first_face(result):
+    """Batched DeepFace calls return one list of faces per input image."""
+    return result[0] if isinstance(result, list) else result
+
+
+def _per_item(fn, items):
+    results = []
+    for item in items:
+        try:
+            results.append(fn(item))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def analyze_emotions(crops):
+    """Emotion scores for a batch of crops, in one forward pass when DeepFace accepts a list of images."""
+    if len(crops) > 1:
+        try:
+            results = _deepface().analyze(list(crops), actions=['emotion'], detector_backend='skip', enforce_detection=False, silent=True)
+            if len(results) == len(crops):
+                return [_first_face(r) for r in results]
+        except (TypeError, ValueError, AttributeError):
+            pass  # Releases without batch input only take one image per call
+    return _per_item(analyze_emotion, crops)
+
+
+def embed_faces(crops, model_name="VGG-Face"):
+    """Embeddings for a batch of crops, in one forward pass when DeepFace accepts a list of images."""
+    if len(crops) > 1:
+        try:
+            results = _deepface().represent(img_path=list(crops), model_name=model_name, detector_backend='skip', enforce_detection=False)
+            if len(results) == len(crops):
+                return [np.asarray(_first_face(r)['embedding'], dtype=np.float32) for r in results]
+        except (TypeError, ValueError, AttributeError):
+            pass
+    return _per_item(lambda crop: embed_face(crop, model_name), crops)
@@ -0,0 +1,308 @@
+"""Shared local inference daemon and its client.
+
+One long-lived process loads the detection, emotion and VGG-Face models and
+serves every gunicorn worker over a Unix domain socket, so the weights are
+held in memory once instead of once per worker. Requests from all workers
+go through the daemon's micro-batchers, so concurrent submissions share
+forward passes.
+
+Wire format, in both directions: a 4-byte big-endian header length, a JSON
+header, then the raw bytes of any NumPy arrays listed in ``header['arrays']``.
+
+Run it with:
+
+    python inference_daemon.py --socket /run/attendance/inference.sock
+
+and start the app with INFERENCE_SOCKET pointing at the same path. For a
+graceful restart, start a new daemon on the same path; it binds a temporary
+socket, warms up, then atomically renames it into place. Send SIGTERM to the
+old daemon afterwards: it stops accepting connections, finishes in-flight
+requests and exits.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_HEADER_LENGTH = struct.Struct('>I')
+_IDLE_POLL_SECONDS = 1.0
+_READ_TIMEOUT_SECONDS = 30.0  # Longest pause allowed inside one message, like the client's default timeout
+
+
+# --- Framing ---
+
+def _recv_exactly(sock, size):
+    chunks, remaining = [], size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk: raise ConnectionError("Connection closed mid-message.")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def _json_default(value):
+    # DeepFace results carry NumPy scalars
+    if isinstance(value, np.ndarray): return value.tolist()
+    if isinstance(value, np.generic): return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def send_message(sock, header, arrays=()):
+    arrays = [np.ascontiguousarray(a) for a in arrays]
+    header = dict(header, arrays=[{'dtype': a.dtype.str, 'shape': list(a.shape)} for a in arrays])
+    encoded = json.dumps(header, default=_json_default).encode()
+    sock.sendall(_HEADER_LENGTH.pack(len(encoded)) + encoded)
+    for a in arrays:
+        sock.sendall(memoryview(a).cast('B'))
+
+
+def recv_message(sock, first_bytes=b''):
+    prefix = first_bytes + _recv_exactly(sock, _HEADER_LENGTH.size - len(first_bytes))
+    header = json.loads(_recv_exactly(sock, _HEADER_LENGTH.unpack(prefix)[0]))
+    arrays = []
+    for spec in header.pop('arrays', []):
+        dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+        data = _recv_exactly(sock, dtype.itemsize * int(np.prod(shape)))
+        arrays.append(np.frombuffer(data, dtype=dtype).reshape(shape))
+    return header, arrays
+
+
+# --- Server ---
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            self._serve_connection(self.request)
+        except (ConnectionError, OSError):
+            pass  # Client went away; nothing to answer
+
+    def _serve_connection(self, sock):
+        while True:
+            sock.settimeout(_IDLE_POLL_SECONDS)
+            try:
+                first = sock.recv(1)
+            except socket.timeout:
+                if self.server.draining: return
+                continue
+            if not first: return
+            # Bounded, so a worker that stalls mid-send can't pin this thread (and hold up drain() on SIGTERM)
+            sock.settimeout(_READ_TIMEOUT_SECONDS)
+            try:
+                header, arrays = recv_message(sock, first)
+            except socket.timeout:
+                logger.warning(f"Closing a connection that sent no data for {_READ_TIMEOUT_SECONDS}s mid-request.")
+                return
+            except (ValueError, KeyError, TypeError) as e:
+                # Bad JSON or array specs: the framing can no longer be trusted, so answer and close
+                send_message(sock, {'ok': False, 'error': f"Malformed request: {e}", 'error_type': 'BadRequest'})
+                return
+            with self.server.in_flight_lock:
+                self.server.in_flight += 1
+            try:
+                reply, reply_arrays = self.server.dispatch(header, arrays)
+            except Exception as e:
+                reply, reply_arrays = {'ok': False, 'error': str(e), 'error_type': type(e).__name__}, []
+            finally:
+                with self.server.in_flight_lock:
+                    self.server.in_flight -= 1
+            send_message(sock, reply, reply_arrays)
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Threaded Unix socket server; every connection gets its own thread."""
+    daemon_threads = False
+    block_on_close = True  # server_close() waits for in-flight requests
+    request_queue_size = 128  # Every worker thread may connect at once after a restart
+
+    def __init__(self, socket_path, model_name="VGG-Face", detector_backend="opencv", max_batch_size=16, max_wait_ms=20, extra_models=()):
+        import inference
+        from batching import MicroBatcher
+
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.extra_models = tuple(extra_models)  # Other recognition models to load before publishing (e.g. for twins)
+        self.started_at = time.time()
+        self.draining = False
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+        self.inference = inference
+        self.emotion_batcher = MicroBatcher("emotion", inference.analyze_emotions, max_batch_size, max_wait_ms)
+        self.embedding_batcher = MicroBatcher("embedding", lambda crops: inference.embed_faces(crops, model_name), max_batch_size, max_wait_ms)
+
+        # Bind a private path first and rename it into place once warmed up,
+        # so a restarting daemon never leaves clients without a listener
+        self._bind_path = f"{socket_path}.{os.getpid()}.tmp"
+        if os.path.exists(self._bind_path): os.remove(self._bind_path)
+        super().__init__(self._bind_path, _Handler)
+        self._inode = None
+
+    def publish(self):
+        """Warms the models up, then makes the socket reachable at its public path."""
+        self.inference.warm_up(recognition_model=self.model_name, detector_backend=self.detector_backend, extra_models=self.extra_models)
+        os.chmod(self._bind_path, 0o660)
+        os.replace(self._bind_path, self.socket_path)
+        self._inode = os.stat(self.socket_path).st_ino
+        logger.info(f"Inference daemon {os.getpid()} listening on {self.socket_path}")
+
+    def dispatch(self, header, arrays):
+        op, args = header.get('op'), header.get('args', {})
+        if op == 'health':
+            return {'ok': True, 'result': {'pid': os.getpid(), 'ready': self.inference.WARMUP_STATE['ready'] and not self.draining,
+                                           'draining': self.draining, 'in_flight': self.in_flight,
+                                           'uptime_seconds': round(time.time() - self.started_at, 1), 'model_name': self.model_name}}, []
+        if op == 'detect_face':
+            face = self.inference.detect_face(arrays[0], args.get('detector_backend', self.detector_backend), args.get('enforce_detection', True), args.get('align', True))
+            return {'ok': True, 'result': {'facial_area': face['facial_area'], 'confidence': face['confidence']}}, [face['crop']]
+        if op == 'analyze_emotion':
+            return {'ok': True, 'result': self.emotion_batcher.run(arrays[0])}, []
+        if op == 'embed_face':
+            if args.get('model_name', self.model_name) != self.model_name:
+                return {'ok': True, 'result': None}, [self.inference.embed_face(arrays[0], args['model_name'])]
+            return {'ok': True, 'result': None}, [self.embedding_batcher.run(arrays[0])]
+        if op == 'represent_image':
+            img = arrays[0] if arrays else args['path']
+            vector = self.inference.represent_image(img, args.get('model_name', self.model_name), args.get('detector_backend', self.detector_backend), args.get('enforce_detection', True))
+            return {'ok': True, 'result': None}, [vector]
+        raise ValueError(f"Unknown op: {op}")
+
+    def drain(self):
+        """Stops accepting connections and lets in-flight requests finish."""
+        self.draining = True
+        self.shutdown()
+
+    def server_close(self):
+        super().server_close()
+        # Only remove the public path if it still points at this daemon's socket
+        for path in (self._bind_path, self.socket_path):
+            try:
+                if path == self._bind_path or os.stat(path).st_ino == self._inode:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def serve(socket_path, **kwargs):
+    server = InferenceServer(socket_path, **kwargs)
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: threading.Thread(target=server.drain, daemon=True).start())
+    server.publish()
+    try:
+        server.serve_forever(poll_interval=0.5)
+    finally:
+        server.server_close()
+        logger.info(f"Inference daemon {os.getpid()} stopped.")
+
+
+# --- Client ---
+
+class InferenceError(RuntimeError):
+    """The daemon could not be reached or failed to run a request."""
+
+
+class InferenceClient:
+    """Thin client offering the inference module's backend functions over the daemon socket."""
+
+    def __init__(self, socket_path, timeout=30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _drop_connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def call(self, op, args=None, arrays=()):
+        # One retry covers a daemon that is restarting or closed this thread's idle connection. A timeout is
+        # never retried (the daemon is alive but stuck), nor is anything that fails once reply bytes have arrived
+        for attempt in range(2):
+            reused = getattr(self._local, 'sock', None) is not None
+            try:
+                sock = self._connection()
+                send_message(sock, {'op': op, 'args': args or {}}, arrays)
+                first = sock.recv(1)
+                if not first: raise ConnectionResetError("Connection closed before the reply.")
+            except socket.timeout as e:
+                self._drop_connection()
+                raise InferenceError(f"Inference daemon at {self.socket_path} timed out after {self.timeout}s: {e}")
+            except (FileNotFoundError, ConnectionRefusedError, ConnectionResetError, BrokenPipeError) as e:
+                # No daemon listening, or a stale connection reset before any reply byte: safe to try again
+                self._drop_connection()
+                if attempt or not (reused or isinstance(e, (FileNotFoundError, ConnectionRefusedError))):
+                    raise InferenceError(f"Inference daemon unavailable at {self.socket_path}: {e}")
+                continue
+            except OSError as e:
+                self._drop_connection()
+                raise InferenceError(f"Inference daemon unavailable at {self.socket_path}: {e}")
+            try:
+                header, reply_arrays = recv_message(sock, first)
+                break
+            except (OSError, ValueError) as e:
+                self._drop_connection()
+                raise InferenceError(f"Inference daemon at {self.socket_path} sent an incomplete reply: {e}")
+        if not header.get('ok'):
+            # A missing face is a ValueError locally too; keep that contract for callers
+            error_cls = ValueError if header.get('error_type') == 'ValueError' else InferenceError
+            raise error_cls(header.get('error'))
+        return header.get('result'), reply_arrays
+
+    def health(self):
+        return self.call('health')[0]
+
+    def detect_face(self, frame, detector_backend="opencv", enforce_detection=True, align=True):
+        result, arrays = self.call('detect_face', {'detector_backend': detector_backend, 'enforce_detection': enforce_detection, 'align': align}, [frame])
+        return {'crop': arrays[0], **result}
+
+    def analyze_emotion(self, crop):
+        return self.call('analyze_emotion', arrays=[crop])[0]
+
+    def analyze_emotions(self, crops):
+        return [self.analyze_emotion(crop) for crop in crops]
+
+    def embed_face(self, crop, model_name="VGG-Face"):
+        return self.call('embed_face', {'model_name': model_name}, [crop])[1][0]
+
+    def embed_faces(self, crops, model_name="VGG-Face"):
+        return [self.embed_face(crop, model_name) for crop in crops]
+
+    def represent_image(self, img, model_name="VGG-Face", detector_backend="opencv", enforce_detection=True):
+        args = {'model_name': model_name, 'detector_backend': detector_backend, 'enforce_detection': enforce_detection}
+        if isinstance(img, str):
+            return self.call('represent_image', dict(args, path=os.path.abspath(img)))[1][0]
+        return self.call('represent_image', args, [img])[1][0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Shared face inference daemon for the attendance app.")
+    parser.add_argument('--socket', default=os.environ.get('INFERENCE_SOCKET', '/tmp/attendance-inference.sock'))
+    parser.add_argument('--model', default="VGG-Face")
+    parser.add_argument('--detector', default="opencv")
+    parser.add_argument('--extra-model', action='append', default=[], help="Another recognition model to warm up (repeatable), e.g. Facenet512 for twins")
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--max-wait-ms', type=float, default=20)
+    cli_args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    serve(cli_args.socket, model_name=cli_args.model, detector_backend=cli_args.detector,
+          max_batch_size=cli_args.max_batch_size, max_wait_ms=cli_args.max_wait_ms, extra_models=cli_args.extra_model)
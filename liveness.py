@@ -0,0 +1,95 @@
+"""Tiered smile liveness check.
+
+Answering "is the student smiling" used to take a full pass of DeepFace's
+emotion model on every submission. ``SmileLiveness`` first runs OpenCV's
+bundled smile Haar cascade over the mouth region of the aligned face crop,
+which takes a few milliseconds. The mouth region is rescaled to a fixed
+width and the smile scored as raw cascade hits per 1000 px of it, so the
+score does not depend on the size of the crop:
+
+* score >= ``accept_score``: smiling, decided on the fast path;
+* score < ``reject_score``: not smiling, decided on the fast path;
+* anything in between goes to the emotion model as before.
+
+The default thresholds were calibrated on real face crops (crop sizes 64 to
+300 px): broad smiles score 18-34, faint closed-mouth smiles around 12, a
+talking open mouth up to 13 and neutral faces 0.5-3.
+``benchmarks/calibrate_liveness.py`` reports the scores of labelled crops
+from your own cameras.
+
+Modes: 'tiered' (the above), 'emotion' (always the model) and 'cascade'
+(never the model; in-between frames count as not smiling). The cascade
+ships with opencv-python 4.x only; the fast-path modes refuse to start
+without it. Every decision is counted in ``liveness_decisions_total`` by
+path and result.
+"""
+import threading
+
+import cv2
+
+from metrics import Counter
+from quality_gate import load_cascade, require_cascade
+
+SMILE_CASCADE_FILE = "haarcascade_smile.xml"
+LIVENESS_MODES = ('tiered', 'emotion', 'cascade')
+MOUTH_REGION_START = 0.55  # The mouth is in the lower part of an aligned face crop
+MOUTH_REGION_WIDTH = 120  # Pixels; the mouth region is rescaled to this width before counting hits
+HAPPY_SCORE_THRESHOLD = 70  # DeepFace emotion scores are percentages (0-100)
+
+
+def emotion_is_smile(result):
+    """The emotion model's verdict: dominant emotion happy, or a happiness score of at least HAPPY_SCORE_THRESHOLD %."""
+    return result['dominant_emotion'] == 'happy' or result['emotion']['happy'] >= HAPPY_SCORE_THRESHOLD
+
+
+class SmileLiveness:
+    """Decides whether a face crop is smiling, calling the emotion model only for unclear cases."""
+
+    def __init__(self, emotion_fn, mode='tiered', accept_score=15.0, reject_score=5.0):
+        if mode not in LIVENESS_MODES:
+            raise ValueError(f"mode must be one of {LIVENESS_MODES}")
+        if mode != 'emotion': require_cascade(SMILE_CASCADE_FILE, f"the '{mode}' liveness mode")
+        self.emotion_fn = emotion_fn  # crop -> DeepFace emotion result, e.g. the emotion micro-batcher
+        self.mode = mode
+        self.accept_score = accept_score
+        self.reject_score = reject_score
+        self.decisions = Counter("liveness_decisions_total", "Liveness decisions by path (fast or model) and result", 'decision')
+        self._local = threading.local()  # CascadeClassifier is not safe to share between threads
+
+    def _cascade(self):
+        if not hasattr(self._local, 'cascade'):
+            self._local.cascade = load_cascade(SMILE_CASCADE_FILE)
+        return self._local.cascade
+
+    def smile_score(self, crop):
+        """Smile-cascade hits per 1000 px of the rescaled mouth region of a BGR face crop."""
+        gray = crop if crop.ndim == 2 else cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        mouth = gray[int(gray.shape[0] * MOUTH_REGION_START):, :]
+        if mouth.size == 0: return 0.0
+        height = max(1, round(mouth.shape[0] * MOUTH_REGION_WIDTH / mouth.shape[1]))
+        interpolation = cv2.INTER_AREA if mouth.shape[1] > MOUTH_REGION_WIDTH else cv2.INTER_LINEAR
+        mouth = cv2.equalizeHist(cv2.resize(mouth, (MOUTH_REGION_WIDTH, height), interpolation=interpolation))
+        hits, _ = self._cascade().detectMultiScale2(mouth, scaleFactor=1.1, minNeighbors=0, minSize=(30, 15))
+        return round(len(hits) * 1000.0 / mouth.size, 2)
+
+    def check(self, crop):
+        """{'live', 'path' ('fast' or 'model'), 'score'} for an aligned BGR face crop."""
+        score = self.smile_score(crop) if self.mode != 'emotion' else None
+        if score is not None:
+            if score >= self.accept_score:
+                return self._decide(True, 'fast', score)
+            if score < self.reject_score or self.mode == 'cascade':
+                return self._decide(False, 'fast', score)
+        return self._decide(emotion_is_smile(self.emotion_fn(crop)), 'model', score)
+
+    def _decide(self, live, path, score):
+        self.decisions.inc(f"{path}_{'accept' if live else 'reject'}")
+        return {'live': live, 'path': path, 'score': score}
+
+    def stats(self):
+        """Decision counts and the share of them made on the fast path."""
+        decisions = self.decisions.snapshot()
+        total = sum(decisions.values())
+        fast = sum(count for decision, count in decisions.items() if decision.startswith('fast_'))
+        return {'mode': self.mode, 'accept_score': self.accept_score, 'reject_score': self.reject_score,
+                'decisions': decisions, 'fast_path_rate': round(fast / total, 4) if total else None}
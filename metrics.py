@@ -0,0 +1,146 @@
+"""Minimal in-process metrics: fixed-bucket histograms and counters.
+
+Metrics register themselves in ``REGISTRY`` by name. ``snapshot_all`` returns
+them as JSON-friendly dicts and ``render_prometheus`` in the Prometheus text
+exposition format, for a ``/metrics`` endpoint. Values are per process; with
+several gunicorn workers each one reports its own.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+REGISTRY = {}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}' if pairs else ''
+
+
+def _header(name, description, kind):
+    return [f"# HELP {name} {_escape(description)}", f"# TYPE {name} {kind}"]
+
+
+class Histogram:
+    """Counts observations into cumulative buckets, Prometheus style."""
+
+    def __init__(self, name, description, buckets, register=True):
+        self.name = name
+        self.description = description
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+        if register: REGISTRY[name] = self
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """Observes the duration of the with-block in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def snapshot(self):
+        """Cumulative bucket counts plus total count and sum."""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative, running = {}, 0
+        for bound, count in zip(self.buckets + [float('inf')], counts):
+            running += count
+            cumulative['+Inf' if bound == float('inf') else str(bound)] = running
+        return {'buckets': cumulative, 'count': running, 'sum': round(total, 6)}
+
+    def _samples(self, labels=()):
+        snapshot = self.snapshot()
+        lines = [f"{self.name}_bucket{_labels(list(labels) + [('le', bound)])} {count}" for bound, count in snapshot['buckets'].items()]
+        return lines + [f"{self.name}_sum{_labels(labels)} {snapshot['sum']}", f"{self.name}_count{_labels(labels)} {snapshot['count']}"]
+
+    def render(self):
+        return _header(self.name, self.description, 'histogram') + self._samples()
+
+
+class HistogramFamily:
+    """Histograms sharing a name and buckets, one per value of a label (e.g. a pipeline stage)."""
+
+    def __init__(self, name, description, buckets, label):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label = label
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def labels(self, value):
+        child = self._children.get(value)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(value, Histogram(self.name, self.description, self.buckets, register=False))
+        return child
+
+    def observe(self, value, amount):
+        self.labels(value).observe(amount)
+
+    def time(self, value):
+        """Observes the duration of the with-block under the given label value."""
+        return self.labels(value).time()
+
+    def snapshot(self):
+        return {value: child.snapshot() for value, child in sorted(self._children.items())}
+
+    def render(self):
+        lines = _header(self.name, self.description, 'histogram')
+        for value, child in sorted(self._children.items()):
+            lines += child._samples([(self.label, value)])
+        return lines
+
+
+class Counter:
+    """Monotonic counts, optionally split by the value of one label (e.g. a request outcome)."""
+
+    def __init__(self, name, description, label=None):
+        self.name = name
+        self.description = description
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def inc(self, value=None, amount=1):
+        with self._lock:
+            self._values[value] = self._values.get(value, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            values = dict(self._values)
+        if self.label is None: return values.get(None, 0)
+        return dict(sorted(values.items()))
+
+    def render(self):
+        lines = _header(self.name, self.description, 'counter')
+        with self._lock:
+            values = sorted(self._values.items(), key=lambda item: str(item[0]))
+        return lines + [f"{self.name}{_labels([(self.label, value)] if self.label else [])} {count}" for value, count in values]
+
+
+def snapshot_all():
+    return {name: metric.snapshot() for name, metric in REGISTRY.items()}
+
+
+def render_prometheus():
+    """Every registered metric in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name in sorted(REGISTRY):
+        lines += REGISTRY[name].render()
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,77 @@
+"""Opt-in sampling profiler for single requests.
+
+``SamplingProfiler`` samples one thread's Python stack every few
+milliseconds from a helper thread (via ``sys._current_frames``), so the
+profiled code runs unmodified and the overhead is bounded by the sampling
+rate rather than by the number of calls, unlike ``cProfile``. Samples are
+aggregated into "collapsed" stacks (``outer;inner;leaf count`` per line),
+the input format of flamegraph.pl, speedscope and similar viewers.
+
+Time spent in C code (NumPy, OpenCV, TensorFlow) is attributed to the Python
+frame that called it, which is what we want for finding the slow step.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread until stopped."""
+
+    def __init__(self, thread_id=None, interval_seconds=0.005, max_depth=64):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval_seconds = interval_seconds
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.duration_seconds = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._loop, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None: return  # The profiled thread has exited
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        if self._thread is None: return self
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.duration_seconds = time.perf_counter() - self.started_at
+        return self
+
+    def collapsed(self):
+        """One 'frame;frame;frame count' line per distinct stack, most frequent first."""
+        return '\n'.join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()) + '\n'
+
+    def top(self, n=10):
+        """The n functions with the most samples on top of the stack (self time), as (name, samples)."""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            if stack: leaves[stack[-1]] += count
+        return leaves.most_common(n)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f: f.write(self.collapsed())
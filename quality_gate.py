@@ -0,0 +1,127 @@
+"""Cheap OpenCV checks on a webcam frame before any model runs.
+
+Dark, washed-out or blurry frames, and frames without exactly one large
+enough face, used to go through face detection, the emotion model and
+recognition before failing. ``QualityGate`` rejects them in a few
+milliseconds, on a grayscale copy downscaled to ``analysis_dimension``:
+
+* brightness and contrast: mean and standard deviation of the pixels;
+* sharpness: variance of the Laplacian (low when there are no edges);
+* faces: OpenCV's bundled Haar cascade; faces narrower than
+  ``min_face_fraction`` of the frame's shorter side are too far away and
+  are not counted, so people in the background don't cause a rejection.
+
+Each rejection has a reason, a message telling the student what to fix, and
+is counted in ``frame_quality_rejections_total``. The Haar cascades ship with
+opencv-python 4.x only (requirements.txt pins it); a gate with face checks
+refuses to start on a build without them rather than quietly skipping half
+of its checks.
+"""
+import os
+import threading
+
+import cv2
+
+from metrics import Counter
+
+FACE_CASCADE_FILE = "haarcascade_frontalface_default.xml"
+HAAR_WINDOW = 24  # Detection window of the frontal face cascade, in pixels
+MESSAGES = {
+    'too_dark': "The picture is too dark. Move to a brighter place or turn towards a light.",
+    'too_bright': "The picture is overexposed. Move away from bright light behind or in front of you.",
+    'low_contrast': "The picture is washed out. Make sure your face is evenly lit.",
+    'blurry': "The picture is blurry. Hold the camera still and try again.",
+    'no_face': "No face found. Look straight at the camera.",
+    'face_too_small': "Your face is too small in the picture. Move closer to the camera.",
+    'multiple_faces': "More than one face found. Make sure only you are in the picture.",
+}
+
+
+def load_cascade(file_name):
+    """A Haar cascade shipped with opencv-python, or None if this OpenCV build has none."""
+    if not hasattr(cv2, 'CascadeClassifier'): return None
+    path = os.path.join(getattr(getattr(cv2, 'data', None), 'haarcascades', ''), file_name)
+    if not os.path.exists(path): return None
+    cascade = cv2.CascadeClassifier(path)
+    return None if cascade.empty() else cascade
+
+
+def require_cascade(file_name, feature):
+    """Raises RuntimeError at startup if a Haar cascade that `feature` needs is missing from this OpenCV build."""
+    if load_cascade(file_name) is None:
+        raise RuntimeError(f"OpenCV {cv2.__version__} has no {file_name} (opencv-python 5 dropped the Haar cascades), but "
+                           f"{feature} needs it. Install 'opencv-python<5' as in requirements.txt, or turn {feature} off.")
+
+
+class QualityGate:
+    """Accepts or rejects a BGR frame on exposure, sharpness and face count / size."""
+
+    def __init__(self, min_brightness=40, max_brightness=220, min_contrast=20, min_sharpness=30, min_face_fraction=0.15,
+                 max_faces=1, analysis_dimension=320, check_faces=True, enabled=True):
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_contrast = min_contrast
+        self.min_sharpness = min_sharpness
+        self.min_face_fraction = min_face_fraction
+        self.max_faces = max_faces
+        self.analysis_dimension = analysis_dimension
+        self.check_faces = check_faces
+        self.enabled = enabled
+        self.rejections = Counter("frame_quality_rejections_total", "Frames rejected by the quality gate, by reason", 'reason')
+        self._local = threading.local()  # CascadeClassifier is not safe to share between threads
+        if enabled and check_faces: require_cascade(FACE_CASCADE_FILE, "the quality gate's face check")
+
+    def _cascade(self):
+        if not hasattr(self._local, 'cascade'):
+            self._local.cascade = load_cascade(FACE_CASCADE_FILE)
+        return self._local.cascade
+
+    def _resized(self, gray, longest_side):
+        longest = max(gray.shape[:2])
+        if longest <= longest_side: return gray
+        scale = longest_side / longest
+        return cv2.resize(gray, (round(gray.shape[1] * scale), round(gray.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+
+    def _faces(self, gray):
+        """Widths of the faces found, as fractions of the frame's shorter side."""
+        cascade = self._cascade()
+        # Detect at the scale where a face of 3/4 the required width just fills the cascade's 24 px window:
+        # smaller faces are irrelevant, and slightly small ones are still found to say "move closer"
+        short = min(gray.shape[:2])
+        scale = min(1.0, HAAR_WINDOW / (0.75 * self.min_face_fraction * short)) if self.min_face_fraction > 0 else 1.0
+        small = self._resized(gray, round(max(gray.shape[:2]) * scale))
+        faces = cascade.detectMultiScale(small, scaleFactor=1.2, minNeighbors=5, minSize=(HAAR_WINDOW, HAAR_WINDOW))
+        return [float(w) / min(small.shape[:2]) for _, _, w, _ in faces]
+
+    def check(self, frame):
+        """(reason, measures): reason is None for an acceptable frame, else a key of MESSAGES.
+
+        The checks run cheapest first and stop at the first failure, so measures may be partial.
+        """
+        if not self.enabled: return None, {}
+        reason, measures = self._check(frame)
+        if reason: self.rejections.inc(reason)
+        return reason, measures
+
+    def _check(self, frame):
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        gray = self._resized(gray, self.analysis_dimension) if self.analysis_dimension else gray
+        mean, std = cv2.meanStdDev(gray)
+        m = {'brightness': float(mean[0][0]), 'contrast': float(std[0][0])}
+        if m['brightness'] < self.min_brightness: return 'too_dark', m
+        if m['brightness'] > self.max_brightness: return 'too_bright', m
+        if m['contrast'] < self.min_contrast: return 'low_contrast', m
+        m['sharpness'] = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        if m['sharpness'] < self.min_sharpness: return 'blurry', m
+        if not self.check_faces: return None, m
+
+        faces = m['faces'] = self._faces(gray)
+        large = [f for f in faces if f >= self.min_face_fraction]
+        if not faces: return 'no_face', m
+        if not large: return 'face_too_small', m
+        if len(large) > self.max_faces: return 'multiple_faces', m
+        return None, m
+
+    @staticmethod
+    def message(reason):
+        return MESSAGES.get(reason, "The picture could not be used. Please try again.")
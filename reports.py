@@ -0,0 +1,36 @@
+"""Vectorised report engine for the detailed overall attendance report."""
+import pandas as pd
+
+
+def build_detailed_report(records, students, subjects):
+    """Per-student, per-subject attendance from all records in one pass.
+
+    records has Date, Name and Subject columns (one row per mark). A subject
+    counts as held on every day it has at least one record, and a student is
+    present for it on every day they have a record for it. Returns the same
+    list of dicts that the email report has always used.
+    """
+    if not subjects:
+        return [{"student_name": s, "subject_breakdown": [], "grand_total_present": 0, "grand_total_classes": 0} for s in students]
+
+    records = records[records['Subject'].isin(subjects)]
+    held = records.groupby('Subject')['Date'].nunique().reindex(subjects, fill_value=0)
+    present = (records[records['Name'].isin(students)]
+               .groupby(['Name', 'Subject'])['Date'].nunique()
+               .unstack(fill_value=0)
+               .reindex(index=pd.Index(students).unique(), columns=subjects, fill_value=0))
+
+    held_counts = [int(n) for n in held.to_numpy()]
+    total_held = sum(held_counts)
+    present_rows = dict(zip(present.index, present.to_numpy().astype(int).tolist()))
+
+    final_report = []
+    for student in students:
+        row = present_rows[student]
+        final_report.append({
+            "student_name": student,
+            "subject_breakdown": [{"subject": subject, "present": row[i], "total": held_counts[i]} for i, subject in enumerate(subjects)],
+            "grand_total_present": sum(row),
+            "grand_total_classes": total_held,
+        })
+    return final_report
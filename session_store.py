@@ -0,0 +1,146 @@
+"""Storage for attendance link sessions.
+
+A session is created by the admin's "generate link" request and read by every
+student request that follows, which under gunicorn can land on any worker.
+``MemorySessionStore`` keeps them in the worker's own dict (one worker only);
+``SqliteSessionStore`` keeps them in a WAL-mode SQLite table keyed by session
+ID, so every worker sees the same sessions and they survive worker restarts.
+
+Both stores take and return session dicts with an ``expires_at`` datetime,
+treat expired sessions as absent, and sweep expired rows every
+``sweep_interval_seconds``. They also remember the nonces of used
+single-use tokens (``use_token``) until those tokens expire.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+
+class MemorySessionStore:
+    """Sessions in a per-process dict; only correct with a single worker."""
+
+    def __init__(self, sweep_interval_seconds=60):
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._sessions = {}
+        self._used_tokens = {}  # nonce -> expiry
+        self._tokens_lock = threading.Lock()
+        self._last_sweep = time.time()
+
+    def get(self, session_id):
+        """The live session for session_id, or None if it is unknown or has expired."""
+        session = self._sessions.get(session_id)
+        if session and datetime.now() > session['expires_at']:
+            self._sessions.pop(session_id, None)
+            return None
+        return session
+
+    def put(self, session_id, session):
+        self._maybe_sweep()
+        self._sessions[session_id] = session
+
+    def use_token(self, nonce, expires_at):
+        """Records a single-use token's nonce; False if it was already used."""
+        self._maybe_sweep()
+        with self._tokens_lock:
+            if nonce in self._used_tokens: return False
+            self._used_tokens[nonce] = expires_at
+            return True
+
+    def sweep(self):
+        """Drops every expired session and used token; returns how many sessions were removed."""
+        now = datetime.now()
+        expired = [sid for sid, s in list(self._sessions.items()) if now > s['expires_at']]
+        for sid in expired:
+            self._sessions.pop(sid, None)
+        with self._tokens_lock:
+            self._used_tokens = {nonce: at for nonce, at in self._used_tokens.items() if at >= now}
+        return len(expired)
+
+    def _maybe_sweep(self):
+        if time.time() - self._last_sweep >= self.sweep_interval_seconds:
+            self._last_sweep = time.time()
+            self.sweep()
+
+
+class SqliteSessionStore:
+    """Sessions in a SQLite table in WAL mode, shared by every worker process."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            expires_at REAL NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at);
+        CREATE TABLE IF NOT EXISTS used_tokens (
+            nonce TEXT PRIMARY KEY,
+            expires_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, db_path, sweep_interval_seconds=60):
+        self.db_path = db_path
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._local = threading.local()
+        self._last_sweep = 0.0
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():  # Connections must not cross a fork
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, session_id):
+        """The live session for session_id, or None if it is unknown or has expired."""
+        self._maybe_sweep()
+        row = self._conn().execute("SELECT expires_at, data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None: return None
+        expires_at, data = row
+        if time.time() > expires_at:
+            self._conn().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            return None
+        session = json.loads(data)
+        session['expires_at'] = datetime.fromtimestamp(expires_at)
+        if 'admin_location' in session: session['admin_location'] = tuple(session['admin_location'])
+        return session
+
+    def put(self, session_id, session):
+        self._maybe_sweep()
+        data = {k: v for k, v in session.items() if k != 'expires_at'}
+        self._conn().execute("INSERT OR REPLACE INTO sessions (id, expires_at, data) VALUES (?, ?, ?)",
+                             (session_id, session['expires_at'].timestamp(), json.dumps(data)))
+
+    def use_token(self, nonce, expires_at):
+        """Records a single-use token's nonce; False if it was already used (by any worker)."""
+        self._maybe_sweep()
+        return self._conn().execute("INSERT OR IGNORE INTO used_tokens (nonce, expires_at) VALUES (?, ?)",
+                                    (nonce, expires_at.timestamp())).rowcount == 1
+
+    def sweep(self):
+        """Deletes every expired session and used token; returns how many sessions were removed."""
+        now = time.time()
+        self._conn().execute("DELETE FROM used_tokens WHERE expires_at < ?", (now,))
+        return self._conn().execute("DELETE FROM sessions WHERE expires_at < ?", (now,)).rowcount
+
+    def _maybe_sweep(self):
+        # Per process; a sweep is one indexed range delete, so overlapping sweeps across workers are harmless
+        if time.time() - self._last_sweep >= self.sweep_interval_seconds:
+            self._last_sweep = time.time()
+            self.sweep()
+
+
+def create_session_store(backend, db_path, sweep_interval_seconds=60):
+    """Builds the configured session store: 'memory' or 'sqlite'."""
+    if backend == 'memory':
+        return MemorySessionStore(sweep_interval_seconds)
+    if backend == 'sqlite':
+        return SqliteSessionStore(db_path, sweep_interval_seconds)
+    raise ValueError(f"Unknown session backend: {backend}")
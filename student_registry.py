@@ -0,0 +1,76 @@
+"""Cached index of the student folders in the dataset directory.
+
+Student folders are named ``<id>-<name>``. Instead of listing the dataset
+directory on every lookup, the registry keeps ID -> folder and name -> folder
+maps plus the sorted name list, and rebuilds them only when the directory's
+mtime changes (another worker added, renamed or removed a folder) or when
+the app invalidates it after its own changes.
+"""
+import os
+import threading
+
+
+class _Snapshot:
+    def __init__(self, folders):
+        self.folders = folders  # In os.listdir order, so first-match semantics are unchanged
+        self.names = []
+        self.by_id = {}
+        self.by_name = {}
+        for folder in folders:
+            parts = folder.split('-', 1)
+            if len(parts) == 2:
+                self.by_id.setdefault(parts[0], folder)
+                self.by_name.setdefault(parts[1], folder)
+            else:
+                self.by_name.setdefault(folder, folder)  # Malformed folder: the whole name is the display name
+        for folder in sorted(folders):
+            try:
+                self.names.append(folder.split('-', 1)[1])
+            except IndexError:
+                self.names.append(folder)
+
+
+class StudentRegistry:
+    """O(1) student folder lookups, refreshed when the dataset directory changes."""
+
+    def __init__(self, dataset_path):
+        self.dataset_path = dataset_path
+        self._snapshot = _Snapshot([])
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _current(self):
+        try:
+            mtime = os.stat(self.dataset_path).st_mtime_ns
+        except FileNotFoundError:
+            return _Snapshot([])
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    with os.scandir(self.dataset_path) as entries:
+                        folders = [e.name for e in entries if e.is_dir()]
+                    self._snapshot, self._mtime = _Snapshot(folders), mtime
+        return self._snapshot
+
+    def invalidate(self):
+        """Forces a rebuild on the next lookup, e.g. after this process changed a folder."""
+        with self._lock:
+            self._mtime = None
+
+    def all_names(self):
+        """Display names of every student, in folder-name order."""
+        return list(self._current().names)
+
+    def folders(self):
+        """Every student folder name, in folder-name order."""
+        return sorted(self._current().folders)
+
+    def folder_by_id(self, student_id):
+        snapshot = self._current()
+        if '-' in student_id:
+            # An ID containing '-' can only be matched by prefix, as the folder-name split is ambiguous
+            return next((f for f in snapshot.folders if f.startswith(f"{student_id}-")), None)
+        return snapshot.by_id.get(student_id)
+
+    def folder_by_name(self, student_name):
+        return self._current().by_name.get(student_name)
@@ -0,0 +1,111 @@
+import os
+import zlib
+
+import numpy as np
+import pytest
+
+from ann_index import IdentityIndex, IVFIndex
+from face_index import FaceIndex, l2_normalize
+
+DIM = 16
+
+
+def _vectors(rng, n):
+    return l2_normalize(rng.standard_normal((n, DIM)).astype(np.float32))
+
+
+@pytest.fixture
+def populated():
+    """An index of 60 owners with 10 rows each, added one owner at a time."""
+    rng = np.random.default_rng(0)
+    index = IVFIndex(n_lists=8, nprobe=2)
+    rows = {}
+    for owner in range(60):
+        rows[owner] = _vectors(rng, 10)
+        index.add(owner, rows[owner], [f"{owner}_{i}.jpg" for i in range(10)])
+    return index, rows
+
+
+def _brute_force(rows, probe, k):
+    distances = [(float(1.0 - v @ probe), owner, f"{owner}_{i}.jpg") for owner, matrix in rows.items() for i, v in enumerate(matrix)]
+    return sorted(distances)[:k]
+
+
+def test_full_probe_matches_brute_force(populated):
+    index, rows = populated
+    assert len(index._lists) > 1
+    for probe in _vectors(np.random.default_rng(1), 20):
+        hits = index.search(probe, k=10, nprobe=len(index._lists))
+        expected = _brute_force(rows, probe, 10)
+        assert [(owner, payload) for _, owner, payload in hits] == [(owner, payload) for _, owner, payload in expected]
+        np.testing.assert_allclose([d for d, _, _ in hits], [d for d, _, _ in expected], atol=1e-5)
+
+
+def test_remove_hides_owner_and_keeps_size(populated):
+    index, rows = populated
+    removed = set(range(0, 60, 3))
+    for owner in removed:
+        index.remove(owner)
+    index.remove('never added')
+    assert len(index) == 10 * (60 - len(removed))
+    assert len(index) == sum(len(l.owners) for l in index._lists)
+    for owner, matrix in rows.items():
+        hits = index.search(matrix[0], k=len(index), nprobe=len(index._lists))
+        assert not removed & {o for _, o, _ in hits}
+        if owner not in removed:
+            assert hits[0][1] == owner
+
+
+def test_retrain_on_growth_keeps_every_row():
+    rng = np.random.default_rng(2)
+    index = IVFIndex(n_lists=4)
+    index.add('first', _vectors(rng, 16), [f"first_{i}" for i in range(16)])
+    assert index._trained_size == 16
+    payloads = {f"first_{i}" for i in range(16)}
+    for owner in range(10):
+        index.add(owner, _vectors(rng, 16), [f"{owner}_{i}" for i in range(16)])
+        payloads |= {f"{owner}_{i}" for i in range(16)}
+    assert index._trained_size > 16  # Retrained at least once on the way
+    assert len(index) == len(payloads) == 176
+    _, owners, stored = index._all_rows()
+    assert set(stored) == payloads and len(stored) == 176
+    assert all(index._owner_lists[o] == {c for c, l in enumerate(index._lists) if o in l.owners} for o in set(owners))
+
+
+class FakeBackend:
+    def represent_image(self, img, model_name, detector_backend, enforce_detection=True):
+        return np.random.default_rng(zlib.crc32(os.path.basename(img).encode())).standard_normal(DIM).astype(np.float32)
+
+
+def _face_index(tmp_path):
+    index = FaceIndex(str(tmp_path / 'dataset'), str(tmp_path / 'embeddings'), backend=FakeBackend())
+    index.load()
+    return index
+
+
+def _add(index, student_id, n=3):
+    folder = f"{student_id}-Student {student_id}"
+    index.add_images(student_id, folder, [os.path.join(index.dataset_path, folder, f"{student_id}_{i}.jpg") for i in range(n)])
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_sync_follows_another_writer(tmp_path, compact):
+    writer = _face_index(tmp_path)
+    for student_id in ('0001', '0002', '0003'):
+        _add(writer, student_id)
+    if compact: writer.compact()  # The removal then leaves a tombstone instead of deleting a file
+    identity = IdentityIndex(_face_index(tmp_path), refresh_seconds=0)
+    identity.sync(force=True)
+    assert identity.stats()['students'] == 3
+
+    writer.remove_student('0002')
+    _add(writer, '0004')
+    identity.sync(force=True)
+    stats = identity.stats()
+    assert (stats['students'], stats['embeddings']) == (3, 9)
+
+    probe = FakeBackend().represent_image('0004_1.jpg', None, None)
+    best = identity.identify(probe, k=9)
+    assert best[0]['student_id'] == '0004' and best[0]['file'] == '0004_1.jpg' and best[0]['folder'] == '0004-Student 0004'
+    assert '0002' not in {m['student_id'] for m in best}
+    assert best[0]['distance'] == pytest.approx(0.0, abs=1e-6)
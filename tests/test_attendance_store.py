@@ -0,0 +1,49 @@
+import csv
+import multiprocessing
+import os
+from datetime import datetime
+
+from attendance_store import CSV_FILE_NAME, CsvAttendanceStore, SqliteAttendanceStore
+
+NOW = datetime(2024, 5, 6, 9, 30)
+NAMES = [f"Student {i}" for i in range(10)]
+SUBJECTS = ["Maths", "Physics"]
+WORKERS = 4
+
+
+def _mark_all(make_store, results):
+    store = make_store()
+    store.load()
+    marked = sum(store.mark(name, subject, now=NOW) for name in NAMES for subject in SUBJECTS)
+    results.put(marked)
+
+
+def _mark_concurrently(make_store):
+    """Every worker process marks every (name, subject) once; returns how many marks each reported as new."""
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_mark_all, args=(make_store, results)) for _ in range(WORKERS)]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join(30)
+    return [results.get(timeout=5) for _ in workers]
+
+
+def test_csv_store_keeps_one_row_per_mark_across_processes(tmp_path):
+    marked = _mark_concurrently(lambda: CsvAttendanceStore(str(tmp_path), fsync_policy='never'))
+    assert sum(marked) == len(NAMES) * len(SUBJECTS)
+
+    with open(os.path.join(tmp_path, NOW.strftime("%Y-%m-%d"), CSV_FILE_NAME), newline='') as f:
+        rows = list(csv.DictReader(f))
+    keys = [(row['Name'], row['Subject']) for row in rows]
+    assert len(keys) == len(set(keys)) == len(NAMES) * len(SUBJECTS)
+
+
+def test_sqlite_store_keeps_one_row_per_mark_across_processes(tmp_path):
+    make_store = lambda: SqliteAttendanceStore(str(tmp_path / "attendance.db"), fsync_policy='never')
+    make_store().load()  # Create the schema before the workers race on it
+    marked = _mark_concurrently(make_store)
+    assert sum(marked) == len(NAMES) * len(SUBJECTS)
+
+    rows = make_store().day_records(NOW.strftime("%Y-%m-%d"))
+    assert len(rows) == len(NAMES) * len(SUBJECTS)
+    assert not rows.duplicated(["Name", "Subject"]).any()
@@ -0,0 +1,94 @@
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def _held_batcher(name, batch_fn, **kwargs):
+    """A batcher whose first pass blocks until the returned event is set, so later items queue up behind it."""
+    gate, calls = threading.Event(), []
+
+    def held(items):
+        calls.append(list(items))
+        gate.wait(5)
+        return batch_fn(items)
+
+    return MicroBatcher(name, held, **kwargs), gate, calls
+
+
+def test_queued_items_share_one_pass():
+    batcher, gate, calls = _held_batcher('test_share', lambda items: [i * 10 for i in items], max_batch_size=8, max_wait_ms=50)
+    first = batcher.submit(0)
+    while not calls: time.sleep(0.001)
+    futures = [batcher.submit(i) for i in range(1, 6)]
+    gate.set()
+    assert first.result(timeout=5) == 0
+    assert [f.result(timeout=5) for f in futures] == [10, 20, 30, 40, 50]
+    assert calls == [[0], [1, 2, 3, 4, 5]]
+
+
+def test_batch_never_exceeds_max_size():
+    batcher, gate, calls = _held_batcher('test_max_size', lambda items: items, max_batch_size=3, max_wait_ms=50)
+    first = batcher.submit(0)
+    while not calls: time.sleep(0.001)
+    futures = [batcher.submit(i) for i in range(1, 8)]
+    gate.set()
+    assert [f.result(timeout=5) for f in [first] + futures] == list(range(8))
+    assert [len(c) for c in calls] == [1, 3, 3, 1]
+
+
+def test_exception_element_fails_only_its_request():
+    batcher = MicroBatcher('test_partial', lambda items: [ValueError(i) if i == 1 else i * 10 for i in items], enabled=False)
+    assert batcher.run(2) == 20
+    with pytest.raises(ValueError):
+        batcher.run(1)
+
+
+def test_failed_pass_fails_every_request():
+    def broken(items):
+        raise RuntimeError("model not loaded")
+
+    batcher, gate, calls = _held_batcher('test_broken', broken, max_wait_ms=50)
+    first = batcher.submit(0)
+    while not calls: time.sleep(0.001)
+    futures = [first] + [batcher.submit(i) for i in range(1, 4)]
+    gate.set()
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model not loaded"):
+            future.result(timeout=5)
+
+
+def test_result_count_mismatch_fails_every_request():
+    batcher, gate, calls = _held_batcher('test_mismatch', lambda items: items[:-1], max_batch_size=4, max_wait_ms=200)
+    first = batcher.submit(0)
+    while not calls: time.sleep(0.001)
+    futures = [first] + [batcher.submit(i) for i in range(1, 4)]
+    gate.set()
+    for future in futures:
+        with pytest.raises(RuntimeError, match="does not match"):
+            future.result(timeout=5)
+    assert [len(c) for c in calls] == [1, 3]
+
+
+def test_non_list_result_fails_every_request():
+    batcher = MicroBatcher('test_non_list', lambda items: None)
+    with pytest.raises(RuntimeError, match="does not match"):
+        batcher.run('x', timeout=5)
+
+
+def test_lone_request_does_not_wait_for_the_window():
+    batcher = MicroBatcher('test_lone', lambda items: items, max_wait_ms=2000)
+    started = time.perf_counter()
+    assert batcher.run('x', timeout=5) == 'x'
+    assert time.perf_counter() - started < 1.0
+
+
+def test_run_times_out():
+    gate = threading.Event()
+    batcher = MicroBatcher('test_timeout', lambda items: [gate.wait(5)] * len(items))
+    with pytest.raises(TimeoutError):
+        batcher.run('x', timeout=0.1)
+    gate.set()
@@ -0,0 +1,148 @@
+import json
+import os
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from email_jobs import EmailJobs, SmtpPool
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib; each RCPT TO follows the server's script for that address."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        self.reply("220 test ESMTP")
+        recipient = None
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line: return
+            verb = line.split(' ', 1)[0].split(':', 1)[0].upper()
+            if verb == 'EHLO':
+                self.wfile.write(b"250-test\r\n250 8BITMIME\r\n")
+            elif verb in ('HELO', 'MAIL', 'RSET', 'NOOP'):
+                self.reply("250 OK")
+            elif verb == 'RCPT':
+                recipient = line.split('<', 1)[1].split('>', 1)[0]
+                with server.lock:
+                    server.attempts.setdefault(recipient, []).append(time.monotonic())
+                    script = server.script.get(recipient, [])
+                    action = script.pop(0) if script else 'ok'
+                if action == 'drop': return  # Connection lost mid-transaction
+                self.reply("250 OK" if action == 'ok' else f"{action} Scripted reply")
+            elif verb == 'DATA':
+                self.reply("354 Go ahead")
+                while self.rfile.readline() not in (b".\r\n", b""): pass
+                with server.lock: server.delivered.append(recipient)
+                self.reply("250 Queued")
+            elif verb == 'QUIT':
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Not implemented")
+
+
+@pytest.fixture
+def smtp_server():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SmtpHandler)
+    server.daemon_threads = True
+    server.lock, server.script, server.attempts, server.delivered = threading.Lock(), {}, {}, []
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _run_job(jobs, smtp_server, recipients, timeout=10):
+    pool = SmtpPool('127.0.0.1', smtp_server.server_address[1], security='none', size=2, timeout=5)
+    messages = [(name, email, f"Hello {name}") for name, email in recipients.items()]
+    job_id = jobs.submit('Attendance', 'admin@example.com', messages, pool)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = jobs.get(job_id)
+        if job['status'] not in ('queued', 'running'): return job
+        time.sleep(0.02)
+    pytest.fail(f"Job {job_id} did not finish")
+
+
+def test_every_recipient_sent(tmp_path, smtp_server):
+    jobs = EmailJobs(str(tmp_path), senders=2)
+    recipients = {f"Student {i}": f"s{i}@example.com" for i in range(5)}
+    job = _run_job(jobs, smtp_server, recipients)
+    assert job['status'] == 'done'
+    assert (job['total'], job['sent'], job['failed']) == (5, 5, 0)
+    assert all(r['status'] == 'sent' and r['attempts'] == 1 for r in job['recipients'].values())
+    assert sorted(smtp_server.delivered) == sorted(recipients.values())
+
+
+def test_permanent_failure_is_not_retried(tmp_path, smtp_server):
+    smtp_server.script['bad@example.com'] = ['550']
+    jobs = EmailJobs(str(tmp_path), senders=1, max_attempts=3, backoff_seconds=0.01)
+    job = _run_job(jobs, smtp_server, {'Alice': 'alice@example.com', 'Bad': 'bad@example.com'})
+    assert job['status'] == 'done_with_errors'
+    assert (job['sent'], job['failed']) == (1, 1)
+    assert job['recipients']['Bad']['status'] == 'failed' and job['recipients']['Bad']['attempts'] == 1
+    assert '550' in job['recipients']['Bad']['error']
+    assert len(smtp_server.attempts['bad@example.com']) == 1
+    assert job['recipients']['Alice']['status'] == 'sent'
+
+
+@pytest.mark.parametrize('transient', ['451', 'drop'])
+def test_transient_failure_is_retried_with_backoff(tmp_path, smtp_server, transient):
+    smtp_server.script['flaky@example.com'] = [transient, transient]
+    jobs = EmailJobs(str(tmp_path), senders=1, max_attempts=3, backoff_seconds=0.1)
+    job = _run_job(jobs, smtp_server, {'Flaky': 'flaky@example.com'})
+    assert job['status'] == 'done'
+    assert job['recipients']['Flaky'] == {'email': 'flaky@example.com', 'status': 'sent', 'attempts': 3, 'error': None}
+    first, second, third = smtp_server.attempts['flaky@example.com']
+    assert second - first >= 0.1 and third - second >= 0.2  # Exponential backoff
+
+
+def test_gives_up_after_max_attempts(tmp_path, smtp_server):
+    smtp_server.script['flaky@example.com'] = ['451'] * 5
+    jobs = EmailJobs(str(tmp_path), senders=1, max_attempts=2, backoff_seconds=0.01)
+    job = _run_job(jobs, smtp_server, {'Flaky': 'flaky@example.com'})
+    assert job['status'] == 'done_with_errors'
+    assert job['recipients']['Flaky']['status'] == 'failed' and job['recipients']['Flaky']['attempts'] == 2
+    assert len(smtp_server.attempts['flaky@example.com']) == 2
+
+
+def _write_job(jobs_path, job_id, pid, status='running'):
+    job = {'id': job_id, 'subject': 'Attendance', 'status': status, 'created_at': '2024-05-06T09:00:00', 'finished_at': None,
+           'total': 2, 'sent': 1, 'failed': 0, 'message': None, 'pid': pid,
+           'recipients': {'Alice': {'email': 'alice@example.com', 'status': 'sent', 'attempts': 1, 'error': None},
+                          'Bob': {'email': 'bob@example.com', 'status': 'pending', 'attempts': 0, 'error': None}}}
+    with open(os.path.join(jobs_path, f"{job_id}.json"), 'w') as f: json.dump(job, f)
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_recover_fails_jobs_of_exited_workers(tmp_path):
+    _write_job(tmp_path, 'deadworker', _dead_pid())
+    _write_job(tmp_path, 'livingworker', os.getppid())  # Another process that is still running
+    _write_job(tmp_path, 'finished', _dead_pid(), status='done')
+    jobs = EmailJobs(str(tmp_path))
+    assert jobs.recover() == 1
+
+    job = jobs.get('deadworker')
+    assert job['status'] == 'failed' and 'Interrupted' in job['message'] and job['finished_at']
+    assert (job['sent'], job['failed']) == (1, 1)
+    assert job['recipients']['Alice']['status'] == 'sent' and job['recipients']['Bob']['status'] == 'failed'
+    assert jobs.get('livingworker')['status'] == 'running'
+    assert jobs.get('finished')['status'] == 'done'
+
+
+def test_get_fails_a_job_this_process_no_longer_runs(tmp_path):
+    _write_job(tmp_path, 'lostthread', os.getpid())  # Our pid, but no thread of this EmailJobs is sending it
+    assert EmailJobs(str(tmp_path)).get('lostthread')['status'] == 'failed'
@@ -0,0 +1,104 @@
+import os
+import zlib
+
+import numpy as np
+import pytest
+
+from face_index import FaceIndex
+
+DIM = 16
+
+
+class FakeBackend:
+    """Deterministic embeddings derived from the image file name."""
+
+    def represent_image(self, img, model_name, detector_backend, enforce_detection=True):
+        seed = zlib.crc32(os.path.basename(img).encode())
+        return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+
+
+def _index(tmp_path, packed_dtype='float32'):
+    index = FaceIndex(str(tmp_path / 'dataset'), str(tmp_path / 'embeddings'), backend=FakeBackend(), packed_dtype=packed_dtype)
+    index.load()
+    return index
+
+
+def _add(index, student_id, files):
+    folder = f"{student_id}-Student {student_id}"
+    index.add_images(student_id, folder, [os.path.join(index.dataset_path, folder, f) for f in files])
+    return folder
+
+
+def _stored(index):
+    return dict(index.stored_entries())
+
+
+def _store_files(index):
+    return sorted(n for n in os.listdir(index.store_dir) if n.endswith('.npz') or n.startswith('packed'))
+
+
+@pytest.fixture
+def compacted(tmp_path):
+    """A store with three students, compacted once."""
+    index = _index(tmp_path)
+    for student_id in ('0001', '0002', '0003'):
+        _add(index, student_id, [f"{student_id}_{i}.jpg" for i in range(3)])
+    assert index.compact() == (3, 9)
+    return index
+
+
+@pytest.mark.parametrize('packed_dtype, tolerance', [('float32', 0), ('float16', 1e-3), ('int8', 2e-2)])
+def test_compact_round_trip(tmp_path, packed_dtype, tolerance):
+    writer = _index(tmp_path, packed_dtype)
+    folders = {student_id: _add(writer, student_id, [f"{student_id}_{i}.jpg" for i in range(4)]) for student_id in ('0001', '0002')}
+    before = _stored(writer)
+    assert writer.compact() == (2, 8)
+    assert _store_files(writer) == ['packed-1.npy', 'packed-1.scales.npy', 'packed.json']
+
+    reader = _index(tmp_path, packed_dtype)
+    assert sorted(_stored(reader)) == ['0001', '0002']
+    for student_id, folder in folders.items():
+        files, matrix = reader.gallery(student_id, folder)
+        assert files == before[student_id]['files']
+        np.testing.assert_allclose(matrix, before[student_id]['matrix'], atol=tolerance)
+        np.testing.assert_allclose(np.linalg.norm(matrix, axis=1), 1.0, atol=1e-5)
+
+
+def test_remove_student_after_compaction_is_seen_by_other_instances(tmp_path, compacted):
+    other = _index(tmp_path)
+    compacted.remove_student('0002')
+    assert sorted(_stored(other)) == ['0001', '0003']
+    files, matrix = other.gallery('0002', '0002-Student 0002')
+    assert files == [] and matrix.shape[0] == 0
+
+    # Re-adding the same ID replaces the tombstone; the old packed rows stay hidden
+    _add(compacted, '0002', ['new.jpg'])
+    files, matrix = other.gallery('0002', '0002-Student 0002')
+    assert files == ['new.jpg'] and matrix.shape == (1, DIM)
+
+
+def test_updates_over_packed_rows(tmp_path, compacted):
+    other = _index(tmp_path)
+    compacted.remove_images('0001', ['0001_1.jpg'])
+    compacted.add_embedding('0003', '0003-Student 0003', '/proofs/frame.jpg', np.ones(DIM, dtype=np.float32))
+
+    files, matrix = other.gallery('0001', '0001-Student 0001')
+    assert files == ['0001_0.jpg', '0001_2.jpg'] and matrix.shape == (2, DIM)
+    files, matrix = other.gallery('0003', '0003-Student 0003')
+    assert files == ['0003_0.jpg', '0003_1.jpg', '0003_2.jpg', 'frame.jpg']
+    np.testing.assert_allclose(matrix[-1], np.full(DIM, 1 / np.sqrt(DIM)), rtol=1e-6)
+    files, _ = other.gallery('0002', '0002-Student 0002')  # Untouched: still served from the packed rows
+    assert files == ['0002_0.jpg', '0002_1.jpg', '0002_2.jpg']
+
+
+def test_second_compaction_replaces_generation_and_overrides(tmp_path, compacted):
+    compacted.remove_student('0002')
+    compacted.remove_images('0001', ['0001_0.jpg'])
+    _add(compacted, '0004', ['0004_0.jpg'])
+    expected = {student_id: entry['files'] for student_id, entry in _stored(compacted).items()}
+    assert sorted(expected) == ['0001', '0003', '0004']
+
+    assert compacted.compact() == (3, 6)
+    assert _store_files(compacted) == ['packed-2.npy', 'packed-2.scales.npy', 'packed.json']
+    reader = _index(tmp_path)
+    assert {student_id: entry['files'] for student_id, entry in _stored(reader).items()} == expected
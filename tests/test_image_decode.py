@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+import pytest
+
+from image_decode import decode_frame, jpeg_size
+
+
+def _image(width, height):
+    return np.random.default_rng(0).integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+
+
+def _encode(image, ext='.jpg'):
+    ok, buf = cv2.imencode(ext, image)
+    assert ok
+    return buf.tobytes()
+
+
+def test_jpeg_size_reads_the_frame_header():
+    assert jpeg_size(_encode(_image(1280, 720))) == (1280, 720)
+    assert jpeg_size(_encode(_image(64, 48), '.png')) is None
+    assert jpeg_size(b'\xff\xd8\xff') is None  # Truncated
+
+
+@pytest.mark.parametrize('width, height, expected', [
+    (1920, 1080, (960, 540)),  # 1/4 would leave a 270 px short side
+    (1080, 1920, (540, 960)),  # Portrait phone camera
+    (3840, 2160, (960, 540)),
+    (640, 480, (640, 480)),    # Already at the minimum: decoded in full
+])
+def test_decode_keeps_short_side_at_minimum(width, height, expected):
+    frame = decode_frame(_encode(_image(width, height)), min_dimension=480)
+    assert (frame.shape[1], frame.shape[0]) == expected
+    assert min(frame.shape[:2]) >= 480
+
+
+def test_png_is_decoded_in_full():
+    frame = decode_frame(_encode(_image(1280, 720), '.png'), min_dimension=480)
+    assert frame.shape[:2] == (720, 1280)
+
+
+def test_decode_without_minimum_is_full_size():
+    frame = decode_frame(_encode(_image(1920, 1080)))
+    assert frame.shape[:2] == (1080, 1920)
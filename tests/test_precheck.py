@@ -0,0 +1,105 @@
+import io
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+from quality_gate import FACE_CASCADE_FILE, require_cascade
+
+try:
+    require_cascade(FACE_CASCADE_FILE, "the app's quality gate")
+except RuntimeError as e:
+    pytest.skip(str(e), allow_module_level=True)
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = (0.0, 0.0)
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('workspace')
+    for folder in ('0001-Alice', '0002-Bob'):
+        (workdir / 'dataset' / folder).mkdir(parents=True)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(workdir)
+        mp.setenv('SECRET_KEY', 'test-secret-key-0123456789')
+        mp.setenv('INFERENCE_SOCKET', str(workdir / 'no-daemon.sock'))  # Thin client, so no model is loaded
+        import app
+        yield app
+
+
+@pytest.fixture
+def client(app_module):
+    for session_id, subject in (('s1', 'Maths'), ('s2', 'Physics')):
+        app_module.ATTENDANCE_SESSIONS.put(session_id, {'admin_location': HERE, 'subject': subject,
+                                                        'expires_at': datetime.now() + timedelta(minutes=5)})
+    return app_module.app.test_client()
+
+
+def _precheck(client, session_id='s1', student_id='0001', latitude=0.0):
+    return client.post(f'/api/precheck/{session_id}', json={'student_id': student_id, 'latitude': latitude, 'longitude': 0.0})
+
+
+def _upload(client, token, session_id='s1'):
+    return client.post(f'/api/mark_attendance/{session_id}', data={'image': (io.BytesIO(b'not a jpeg'), 'frame.jpg'), 'token': token})
+
+
+def test_precheck_outcomes(client, app_module):
+    too_far = _precheck(client, latitude=1.0).get_json()
+    assert not too_far['success'] and too_far['message'].startswith('Too far')
+
+    unknown = _precheck(client, student_id='0099').get_json()
+    assert not unknown['success'] and 'No student found' in unknown['message']
+
+    app_module.ATTENDANCE_STORE.mark('Bob', 'Maths')
+    marked = _precheck(client, student_id='0002').get_json()
+    assert marked['success'] and marked['marked']
+
+    ok = _precheck(client).get_json()
+    assert ok['success'] and ok['token'] and ok['expires_in'] == app_module.PRECHECK_TOKEN_TTL_SECONDS
+
+
+def test_token_is_single_use(client):
+    token = _precheck(client).get_json()['token']
+    assert _upload(client, token).status_code != 400  # Consumed, though the frame itself is unusable
+    replay = _upload(client, token)
+    assert replay.status_code == 400
+    assert 'already used' in replay.get_json()['message']
+
+
+def test_token_from_another_session_is_rejected(client):
+    token = _precheck(client, session_id='s1').get_json()['token']
+    response = _upload(client, token, session_id='s2')
+    assert response.status_code == 400
+    assert 'Invalid check-in' in response.get_json()['message']
+
+
+def test_tampered_or_missing_token_is_rejected(client):
+    token = _precheck(client).get_json()['token']
+    assert _upload(client, token[:-2] + 'xx').status_code == 400
+    assert _upload(client, '').status_code == 400  # PRECHECK_REQUIRED
+
+
+def test_expired_token_is_rejected(client, app_module, monkeypatch):
+    token = _precheck(client).get_json()['token']
+    monkeypatch.setattr(app_module, 'PRECHECK_TOKEN_TTL_SECONDS', -1)  # Any age is past the limit
+    response = _upload(client, token).get_json()
+    assert not response['success'] and 'expired' in response['message']
+
+
+def test_missing_secret_key_refuses_tokens_only(client, app_module, monkeypatch):
+    token = _precheck(client).get_json()['token']
+    monkeypatch.setattr(app_module.app, 'secret_key', '')
+    assert _precheck(client).status_code == 503
+    assert _upload(client, token).status_code == 503
+    assert _precheck(client, latitude=1.0).status_code == 200  # Checks that need no key still answer
+
+
+def test_app_imports_without_secret_key(tmp_path):
+    env = {k: v for k, v in os.environ.items() if k != 'SECRET_KEY'}
+    env.update(PYTHONPATH=os.pathsep.join(filter(None, [REPO, env.get('PYTHONPATH')])), INFERENCE_SOCKET=str(tmp_path / 'no-daemon.sock'))
+    result = subprocess.run([sys.executable, '-c', 'import app'], cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert 'SECRET_KEY' in result.stderr
@@ -0,0 +1,89 @@
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from timetable import CompiledTimetable
+
+MONDAY = "2024-05-06"
+
+
+@pytest.fixture
+def timetable(tmp_path):
+    path = tmp_path / "timetable.json"
+    path.write_text(json.dumps({"Monday": [
+        {"subject": "Maths", "start": "09:00", "end": "10:00"},
+        {"subject": "Physics", "start": "10:00", "end": "11:00"},
+        {"subject": "Lab", "start": "13:00", "end": "16:00"},
+        {"subject": "Seminar", "start": "14:00", "end": "14:30"},
+    ]}))
+    return CompiledTimetable(str(path))
+
+
+@pytest.mark.parametrize('time, expected', [
+    ("08:49:59", None),
+    ("08:50:00", "Maths"),      # Window opens 10 minutes before the start
+    ("09:55:00", "Maths"),      # Overlap with Physics' early window: the earlier slot wins
+    ("10:15:00", "Maths"),      # Window closes 15 minutes after the end, inclusive
+    ("10:15:01", "Physics"),
+    ("11:15:00", "Physics"),
+    ("11:15:01", None),
+    ("14:10:00", "Lab"),        # A short slot inside a long one is still the long one's
+    ("16:15:00", "Lab"),
+    ("16:15:01", None),
+])
+def test_subject_at_window_boundaries(timetable, time, expected):
+    assert timetable.subject_at(datetime.fromisoformat(f"{MONDAY}T{time}")) == expected
+
+
+def test_subject_at_other_day_is_none(timetable):
+    assert timetable.subject_at(datetime.fromisoformat("2024-05-07T09:30:00")) is None
+
+
+def test_change_is_picked_up_after_invalidate(timetable, tmp_path):
+    assert timetable.subjects() == ["Lab", "Maths", "Physics", "Seminar"]
+    (tmp_path / "timetable.json").write_text(json.dumps({"Monday": [{"subject": "Art", "start": "09:00", "end": "10:00"}]}))
+    timetable.invalidate()
+    assert timetable.subject_at(datetime.fromisoformat(f"{MONDAY}T09:30:00")) == "Art"
+    assert timetable.subjects() == ["Art"]
+
+
+def _linear_scan(slots, now):
+    """The lookup get_current_subject used to do: the first slot in file order whose window contains now."""
+    for slot in slots:
+        start = datetime.combine(now.date(), datetime.strptime(slot['start'], "%H:%M").time())
+        end = datetime.combine(now.date(), datetime.strptime(slot['end'], "%H:%M").time())
+        if start - timedelta(minutes=10) <= now <= end + timedelta(minutes=15):
+            return slot['subject']
+    return None
+
+
+def test_unsorted_file_keeps_file_order(tmp_path):
+    path = tmp_path / "timetable.json"
+    path.write_text(json.dumps({"Monday": [
+        {"subject": "Seminar", "start": "14:00", "end": "14:30"},
+        {"subject": "Lab", "start": "13:00", "end": "16:00"},
+    ]}))
+    timetable = CompiledTimetable(str(path))
+    assert timetable.subject_at(datetime.fromisoformat(f"{MONDAY}T13:30:00")) == "Lab"
+    assert timetable.subject_at(datetime.fromisoformat(f"{MONDAY}T14:10:00")) == "Seminar"  # Listed first
+    assert timetable.subject_at(datetime.fromisoformat(f"{MONDAY}T14:45:00")) == "Seminar"
+    assert timetable.subject_at(datetime.fromisoformat(f"{MONDAY}T14:45:01")) == "Lab"
+
+
+def test_matches_linear_scan_on_random_timetables(tmp_path):
+    rng = random.Random(0)
+    path = tmp_path / "timetable.json"
+    for _ in range(20):
+        slots = []
+        for i in range(rng.randint(1, 8)):
+            start = rng.randint(7 * 60, 17 * 60)
+            end = start + rng.randint(15, 180)
+            slots.append({"subject": f"S{i}", "start": f"{start // 60:02d}:{start % 60:02d}", "end": f"{end // 60:02d}:{end % 60:02d}"})
+        path.write_text(json.dumps({"Monday": slots}))
+        timetable = CompiledTimetable(str(path))
+        edges = [datetime.fromisoformat(f"{MONDAY}T{slot[key]}") + timedelta(minutes=shift, seconds=offset)
+                 for slot in slots for key, shift in (('start', -10), ('end', 15)) for offset in (-1, 0, 1)]
+        for now in edges + [datetime.fromisoformat(MONDAY) + timedelta(seconds=rng.randint(6 * 3600, 22 * 3600)) for _ in range(200)]:
+            assert timetable.subject_at(now) == _linear_scan(slots, now), (slots, now)
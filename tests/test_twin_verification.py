@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from face_index import FaceIndex, l2_normalize
+from twin_verification import TwinVerifier
+
+THRESHOLDS = {'VGG-Face': 0.4, 'Facenet512': 0.3}
+DIM = 8
+
+
+def _unit(*weights):
+    """A unit vector built from weights on the first axes; distances between them are 1 - cos."""
+    v = np.zeros(DIM, dtype=np.float32)
+    v[:len(weights)] = weights
+    return l2_normalize(v[None])[0]
+
+
+@pytest.fixture
+def verifier(tmp_path):
+    primary = FaceIndex(str(tmp_path / 'dataset'), str(tmp_path / 'embeddings'), 'VGG-Face', backend=None)
+    return TwinVerifier(primary, THRESHOLDS, margin=0.05)
+
+
+def _verify(verifier, claimed_rows, sibling_rows, probe):
+    """Verifies a claim of student 'a' against sibling 'b' with each model's gallery stubbed in."""
+    rows = {'a': claimed_rows, 'b': sibling_rows}
+
+    def sync(student_id, folder):
+        return {model: ([f'{i}.jpg' for i in range(len(r))], np.vstack(r) if r else np.empty((0, 0), dtype=np.float32))
+                for model, r in ((m, rows[student_id].get(m, [])) for m in THRESHOLDS)}
+
+    verifier.sync = sync
+    return verifier.verify('a', 'a-Twin A', {'b': 'b-Twin B'}, {model: probe for model in THRESHOLDS})
+
+
+def test_match(verifier):
+    probe = _unit(1)
+    result = _verify(verifier, {m: [_unit(1)] for m in THRESHOLDS}, {m: [_unit(0, 1)] for m in THRESHOLDS}, probe)
+    assert result['outcome'] == 'match'
+    assert result['margin'] == pytest.approx(1.0)
+    assert result['distances'] == pytest.approx([0.0])
+
+
+def test_sibling(verifier):
+    probe = _unit(0, 1)
+    result = _verify(verifier, {m: [_unit(1)] for m in THRESHOLDS}, {m: [_unit(0, 1)] for m in THRESHOLDS}, probe)
+    assert result['outcome'] == 'sibling'
+    assert result['margin'] < 0
+
+
+def test_ambiguous(verifier):
+    probe = _unit(1)
+    claimed, sibling = _unit(1, 0.1), _unit(1, 0.15)  # Both well within every threshold, barely apart
+    result = _verify(verifier, {m: [claimed] for m in THRESHOLDS}, {m: [sibling] for m in THRESHOLDS}, probe)
+    assert result['outcome'] == 'ambiguous'
+    assert 0 <= result['margin'] < 0.05
+
+
+def test_low_confidence(verifier):
+    probe = _unit(1)
+    claimed, sibling = _unit(1, 1.2), _unit(0, 1)  # Distance 0.36: within VGG-Face's 0.4, over Facenet512's 0.3
+    result = _verify(verifier, {m: [claimed] for m in THRESHOLDS}, {m: [sibling] for m in THRESHOLDS}, probe)
+    assert result['outcome'] == 'low_confidence'
+
+
+def test_model_without_claimed_photos_is_low_confidence_not_sibling(verifier):
+    # Every Facenet512 embedding of the claimed twin failed; the probe matches their VGG-Face photo exactly
+    probe = _unit(1)
+    result = _verify(verifier, {'VGG-Face': [_unit(1)]}, {m: [_unit(0, 1)] for m in THRESHOLDS}, probe)
+    assert result['scores']['a']['Facenet512'] == float('inf')
+    assert result['margin'] == pytest.approx(1.0)  # VGG-Face only
+    assert result['outcome'] == 'low_confidence'
@@ -0,0 +1,103 @@
+"""Compiled, cached view of timetable.json.
+
+``get_current_subject`` used to re-read the JSON and ``strptime`` every slot
+on each call. ``CompiledTimetable`` parses the file once per change. For every
+weekday it takes the attendance windows (slot start - 10 min to slot end + 15
+min, in seconds of the day) and cuts the day at every window edge. Each piece
+stores the first slot in file order whose window covers it, which is what the
+old linear scan returned, so overlapping windows resolve the same way even in
+a hand-edited file whose slots are not sorted. The current subject is then
+found with one bisection, and the set of subjects is kept alongside for the
+subject list and the reports.
+"""
+import bisect
+import json
+import os
+import threading
+from datetime import datetime
+
+EARLY_MINUTES = 10
+LATE_MINUTES = 15
+
+
+def _seconds(hhmm):
+    t = datetime.strptime(hhmm, "%H:%M")
+    return t.hour * 3600 + t.minute * 60
+
+
+class _Day:
+    def __init__(self, windows):
+        def first(covers):
+            return next((subject for start, end, subject in windows if covers(start, end)), None)
+
+        # Windows are closed intervals: at_edge[i] answers exactly at edges[i], between[i] strictly between
+        # edges[i - 1] and edges[i] (nothing is open before the first edge)
+        self.edges = sorted({t for start, end, _ in windows for t in (start, end)})
+        self.at_edge = [first(lambda start, end: start <= t <= end) for t in self.edges]
+        self.between = [None] + [first(lambda start, end: start <= lo and hi <= end) for lo, hi in zip(self.edges, self.edges[1:])]
+
+    def subject_at(self, seconds):
+        """First slot (in file order) whose window contains the given second of the day."""
+        i = bisect.bisect_left(self.edges, seconds)
+        if i < len(self.edges) and self.edges[i] == seconds: return self.at_edge[i]
+        return self.between[i] if 0 < i < len(self.edges) else None
+
+
+class _Compiled:
+    def __init__(self, timetable):
+        self.days = {}
+        subjects = set()
+        for day, slots in timetable.items():
+            windows = []
+            for slot in slots if isinstance(slots, list) else []:
+                if not isinstance(slot, dict) or 'subject' not in slot: continue
+                subjects.add(slot['subject'])
+                try:
+                    windows.append((_seconds(slot['start']) - EARLY_MINUTES * 60, _seconds(slot['end']) + LATE_MINUTES * 60, slot['subject']))
+                except (ValueError, KeyError, TypeError): continue
+            self.days[day] = _Day(windows)
+        self.subjects = sorted(subjects)
+
+
+_EMPTY = _Compiled({})
+
+
+class CompiledTimetable:
+    """Timetable lookups that re-parse the file only when its mtime changes or after invalidate()."""
+
+    def __init__(self, path):
+        self.path = path
+        self._compiled = _EMPTY
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _current(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return _EMPTY
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    try:
+                        with open(self.path, 'r') as f: timetable = json.load(f)
+                    except (json.JSONDecodeError, FileNotFoundError):
+                        timetable = {}
+                    self._compiled = _Compiled(timetable if isinstance(timetable, dict) else {})
+                    self._mtime = mtime
+        return self._compiled
+
+    def invalidate(self):
+        """Forces a re-parse on the next lookup; call after writing the file."""
+        with self._lock:
+            self._mtime = None
+
+    def subject_at(self, now):
+        """The subject whose attendance window contains the datetime now, or None."""
+        day = self._current().days.get(now.strftime('%A'))
+        if day is None: return None
+        return day.subject_at(now.hour * 3600 + now.minute * 60 + now.second + now.microsecond / 1e6)
+
+    def subjects(self):
+        """Sorted list of every subject in the timetable."""
+        return list(self._current().subjects)
@@ -0,0 +1,163 @@
+"""Multi-model verification for students enrolled as twins.
+
+A twin's attendance used to run ``DeepFace.find`` with
+``model_name=["VGG-Face", "Age", "Gender"]`` against their own folder: the
+representations were rebuilt on every request, "Age" and "Gender" are not
+recognition models, and the probe was never compared with the sibling, which
+is the comparison that matters for identical twins.
+
+``TwinVerifier`` keeps one embeddings store per recognition model (the
+primary ``FaceIndex`` is reused for its own model) and holds the galleries
+of both members of each pair up to date in every store, so nothing is
+embedded at request time except the probe, once per model. For each model
+the galleries of the claimed student and their sibling(s) are stacked into
+one matrix, cached until either gallery changes, and scored with a single
+matrix product. The claim is accepted only if, for every model, the claimed
+student's best distance is within that model's threshold, and on average
+over the models they beat the closest sibling by at least ``margin``. The
+average only covers models under which both twins have photos; a model with
+no photos of the claimed student fails their threshold instead.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from face_index import FaceIndex, l2_normalize
+
+logger = logging.getLogger(__name__)
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error(f"Precomputing twin embeddings failed: {future.exception()}")
+
+
+class TwinVerifier:
+    """Scores a probe against a twin pair's galleries under several recognition models."""
+
+    def __init__(self, face_index, model_thresholds, margin=0.05):
+        self.face_index = face_index  # Primary index; its galleries decide which images each twin has
+        self.model_thresholds = dict(model_thresholds)  # model name -> maximum cosine distance of a match
+        self.margin = margin
+        store_path = os.path.dirname(face_index.store_dir)
+        self.indexes = {model: face_index if model == face_index.model_name else
+                        FaceIndex(face_index.dataset_path, store_path, model, face_index.detector_backend, face_index.backend, face_index.packed_dtype)
+                        for model in self.model_thresholds}
+        self._stacked = {}  # (model, member ids) -> (gallery matrices, stacked matrix, row owners)
+        self._executor = None
+        self._executor_pid = None
+
+    def load(self):
+        for model, index in self.indexes.items():
+            if index is not self.face_index: index.load()
+
+    # --- Galleries ---
+
+    def sync(self, student_id, folder):
+        """Brings the student's rows in every model's store in line with the primary gallery; returns it per model."""
+        files, matrix = self.face_index.gallery(student_id, folder)
+        galleries = {}
+        for model, index in self.indexes.items():
+            if index is self.face_index:
+                galleries[model] = (files, matrix)
+                continue
+            gallery = index.gallery(student_id, folder)
+            stored = set(gallery[0])
+            stale = stored - set(files)
+            missing = [os.path.join(self.face_index.dataset_path, folder, f) for f in files if f not in stored]
+            if stale: index.remove_images(student_id, stale)
+            if missing:
+                logger.info(f"Embedding {len(missing)} image(s) of twin {student_id} with {model}.")
+                index.add_images(student_id, folder, missing)
+            galleries[model] = index.gallery(student_id, folder) if stale or missing else gallery
+        return galleries
+
+    def precompute(self, members):
+        """Embeds the galleries of the given (student_id, folder) twins under every model ahead of their first request."""
+        for student_id, folder in members:
+            self.sync(student_id, folder)
+
+    def precompute_in_background(self, members):
+        """Queues precompute() on a background thread, so enrolment requests don't wait for the extra models."""
+        if self._executor is None or self._executor_pid != os.getpid():  # Threads do not survive fork
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="twin-precompute")
+            self._executor_pid = os.getpid()
+        future = self._executor.submit(self.precompute, list(members))
+        future.add_done_callback(_log_failure)
+        return future
+
+    def rename_student(self, student_id, new_folder):
+        for index in self.indexes.values():
+            if index is not self.face_index: index.rename_student(student_id, new_folder)
+
+    def remove_student(self, student_id):
+        for index in self.indexes.values():
+            if index is not self.face_index: index.remove_student(student_id)
+
+    def add_embeddings(self, student_id, folder, path, embeddings):
+        """Adds a verified frame's probe embeddings to the secondary stores (the primary one goes through the gallery manager)."""
+        for model, index in self.indexes.items():
+            if index is not self.face_index and model in embeddings:
+                index.add_embedding(student_id, folder, path, embeddings[model])
+
+    def _stack(self, model, members, galleries):
+        """The members' galleries as one matrix plus the member index of each row, cached per pair."""
+        key = (model, tuple(student_id for student_id, _ in members))
+        matrices = [galleries[student_id][model][1] for student_id, _ in members]
+        cached = self._stacked.get(key)
+        if cached and len(cached[0]) == len(matrices) and all(a is b for a, b in zip(cached[0], matrices)):
+            return cached[1], cached[2]
+        present = [m for m in matrices if m.shape[0]]
+        stacked = np.vstack(present) if present else np.empty((0, 0), dtype=np.float32)
+        owners = np.concatenate([np.full(m.shape[0], i) for i, m in enumerate(matrices)]) if present else np.empty(0, dtype=int)
+        self._stacked[key] = (matrices, stacked, owners)
+        return stacked, owners
+
+    # --- Verification ---
+
+    def _margin(self, claimed, sibling):
+        """Average lead of the claimed student over one sibling, over the models where both have photos."""
+        models = [m for m in self.model_thresholds if np.isfinite(claimed[m]) and np.isfinite(sibling[m])]
+        return float(np.mean([sibling[m] - claimed[m] for m in models])) if models else float('inf')
+
+    def embed(self, crop, known=None):
+        """{model: embedding} of an aligned face crop; embeddings already computed can be passed in `known`."""
+        embeddings = dict(known or {})
+        for model, index in self.indexes.items():
+            if model not in embeddings:
+                embeddings[model] = index.backend.embed_face(crop, model)
+        return embeddings
+
+    def verify(self, student_id, folder, siblings, embeddings):
+        """Decides a twin's claim; siblings maps the other members' IDs to their folders.
+
+        Returns a dict with 'outcome' ('match', 'low_confidence', 'ambiguous' or 'sibling'), the per-model
+        best distance of every member ('scores'), the average 'margin' over the closest sibling, and the
+        claimed student's distances to their primary gallery ('distances', for the gallery manager).
+        """
+        members = [(student_id, folder)] + sorted(siblings.items())
+        galleries = {member_id: self.sync(member_id, member_folder) for member_id, member_folder in members}
+        scores = {member_id: {} for member_id, _ in members}
+        distances = np.empty(0, dtype=np.float32)
+        for model in self.model_thresholds:
+            stacked, owners = self._stack(model, members, galleries)
+            all_distances = 1.0 - stacked @ l2_normalize(embeddings[model]) if stacked.shape[0] else np.empty(0, dtype=np.float32)
+            for i, (member_id, _) in enumerate(members):
+                own = all_distances[owners == i]
+                scores[member_id][model] = float(own.min()) if own.size else float('inf')
+                if i == 0 and model == self.face_index.model_name: distances = own
+
+        claimed = scores[student_id]
+        margins = [self._margin(claimed, scores[sibling]) for sibling, _ in members[1:]]
+        margin = min(margins) if margins else float('inf')
+        if margin < 0:
+            outcome = 'sibling'
+        elif any(claimed[m] > threshold for m, threshold in self.model_thresholds.items()):
+            outcome = 'low_confidence'
+        elif margin < self.margin:
+            outcome = 'ambiguous'
+        else:
+            outcome = 'match'
+        return {'outcome': outcome, 'scores': scores, 'margin': margin, 'distances': distances}